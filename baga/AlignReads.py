@@ -32,6 +32,11 @@ from baga import _StringIO
 from baga import _tarfile
 from baga import _array
 from baga import _json
+from baga import _re
+try:
+    from shlex import quote as _quote
+except ImportError:
+    from pipes import quote as _quote
 
 # external Python modules
 from Bio.Seq import Seq as _Seq
@@ -46,12 +51,25 @@ from random import sample as _sample
 from baga import decide_max_processes as _decide_max_processes
 from baga import get_exe_path as _get_exe_path
 from baga import get_jar_path as _get_jar_path
+from baga.References import ReferenceCache as _ReferenceCache
 
 from baga import MetaSample as _MetaSample
+from baga import JobScheduler as _JobScheduler
+from baga import ExternalProgramError as _ExternalProgramError
 from baga import PROGRESS
 from baga import PY3 as _PY3
 def main():
     pass
+def samtoolsHasMarkdup(path_to_exe):
+    '''markdup (and fixmate -m) were added in samtools v1.6'''
+    try:
+        proc = _subprocess.Popen([path_to_exe, 'markdup'], 
+                stdout = _subprocess.PIPE, stderr = _subprocess.PIPE)
+    except OSError:
+        return(False)
+    stdout, stderr = proc.communicate()
+    return(b'unrecognized command' not in stderr)
+
 class SAMs_old:
     '''
     A collection of short read datasets that have been aligned to the same genome 
@@ -490,30 +508,18 @@ class SAMs(_MetaSample):
             self.genome_name = genome.sample_name
 
 
-    def align(self, insert_size = False, 
-                    path_to_exe = False, 
-                    local_alns_path = ['alignments'], 
-                    force = False, 
-                    max_cpus = -1):
-
-
-        if not path_to_exe:
-            path_to_exe = _get_exe_path('bwa')
+    def _prepareAlignment(self, path_to_exe, local_alns_path):
+        '''
+        write genome sequence to a fasta file, index it for BWA and make the 
+        folder for alignments to it. Both are reused if the genome sequence 
+        is unchanged: see References.ReferenceCache.
 
+        returns (path to genome fasta, path to alignments folder)
+        '''
         # write genome sequence to a fasta file
-        try:
-            _os.makedirs('genome_sequences')
-        except OSError:
-            pass
-
-        genome_fna = 'genome_sequences/%s.fna' % self.genome_name
-
-        records_to_write = []
-        for seq_id,seq_array in self.genome_sequence.items():
-            records_to_write += [_SeqRecord(_Seq(seq_array.tostring()), 
-                    id = seq_id, description = self.genome_names[seq_id])]
-
-        _SeqIO.write(records_to_write, genome_fna, 'fasta')
+        references = _ReferenceCache()
+        genome_fna = references.fasta(self.genome_name, self.genome_sequence, 
+                self.genome_names)
 
         # make folder for alignments (BAMs)
         local_alns_path = _os.path.sep.join(local_alns_path)
@@ -527,10 +533,6 @@ class SAMs(_MetaSample):
         if not _os.path.exists(local_alns_path_genome):
             _os.makedirs(local_alns_path_genome)
 
-
-        max_processes = _decide_max_processes( max_cpus )
-
-
         e1 = 'Could not find "read_files" attribute. Before aligning to genome, '\
                 'reads must be quality score trimmed. Please run trim() method '\
                 'on this Reads instance.'
@@ -543,69 +545,260 @@ class SAMs(_MetaSample):
             assert _os.path.exists(files[1]), e2 % files[1]
             assert _os.path.exists(files[2]), e2 % files[2]
 
-        # always (re)index in case of upstream changes in data
-        print('Writing BWA index files for %s' % genome_fna)
-        _subprocess.call([path_to_exe, 'index', genome_fna])
+        # (re)index only if the genome sequence changed since last indexed
+        if not references.bwaIndex(genome_fna, path_to_exe):
+            raise _ExternalProgramError('BWA index failed for {}'.format(
+                    genome_fna))
+
+        return(genome_fna, local_alns_path_genome)
+
+    def _threadsPerSample(self, max_processes, threads_per_sample = False):
+        '''
+        Number of BWA threads per sample so all samples can be aligned 
+        concurrently within max_processes, unless set explicitly.
+        '''
+        if threads_per_sample:
+            return(max(1, min(int(threads_per_sample), max_processes)))
+        num_samples = max(1, len(self.read_files))
+        return(max(1, max_processes // num_samples))
+
+    def _logThroughput(self, scheduler, bwa_logs):
+        '''
+        Log reads aligned per second and samples per hour for alignment jobs 
+        just run by a JobScheduler, read counts being from BWA's log output.
+        '''
+        pattern = _re.compile(r'\[M::process\] read (\d+) sequences')
+        done = [job for job in scheduler.done if job['name'] in bwa_logs and \
+                not job['failed']]
+        if not done:
+            return
+        
+        total_reads = 0
+        for job in done:
+            try:
+                with open(bwa_logs[job['name']]) as fin:
+                    num_reads = sum([int(n) for n in pattern.findall(fin.read())])
+            except IOError:
+                num_reads = 0
+            seconds = max(job['finished'] - job['started'], 1e-3)
+            total_reads += num_reads
+            self.logger.info('{}: {:,} reads aligned in {:.1f} s ({:,.0f} '\
+                    'reads/sec, {} threads)'.format(job['name'], num_reads, 
+                    seconds, num_reads / seconds, job['cpus']))
+        
+        seconds = max(max([job['finished'] for job in done]) - \
+                min([job['started'] for job in done]), 1e-3)
+        self.logger.info('Aligned {} samples in {:.1f} s: {:,.0f} reads/sec, '\
+                '{:.1f} samples/hour'.format(len(done), seconds, 
+                total_reads / seconds, len(done) * 3600.0 / seconds))
+
+    def _bwaCommand(self, path_to_exe, pairname, files, genome_fna, 
+            insert_size, num_threads):
+        RGinfo = r"@RG\tID:%s\tSM:%s\tPL:ILLUMINA" % (pairname,pairname)
+        if insert_size:
+            cmd = [path_to_exe, 'mem', 
+                    '-t', str(num_threads), 
+                    '-M', '-a', 
+                    '-I', insert_size, 
+                    '-R', RGinfo, 
+                    genome_fna, files[1], files[2]]
+        else:
+            # BWA can estimate on-the-fly
+            cmd = [path_to_exe, 'mem', 
+                    '-t', str(num_threads), 
+                    '-M', '-a', 
+                    '-R', RGinfo, 
+                    genome_fna, files[1], files[2]]
+        return(cmd)
+
+    def align(self, insert_size = False, 
+                    path_to_exe = False, 
+                    local_alns_path = ['alignments'], 
+                    force = False, 
+                    max_cpus = -1, 
+                    threads_per_sample = False):
+        '''
+        Align each read pair to the genome with BWA MEM
+
+        Samples are aligned concurrently, each BWA using threads_per_sample 
+        threads which by default divides max_cpus between all samples. Reads 
+        per second and samples per hour are logged on completion.
+        '''
+
+        if not path_to_exe:
+            path_to_exe = _get_exe_path('bwa')
 
+        genome_fna, local_alns_path_genome = self._prepareAlignment(path_to_exe, 
+                local_alns_path)
+
+        scheduler = _JobScheduler(max_cpus = max_cpus, sample = self)
+        num_threads = self._threadsPerSample(scheduler.max_processes, 
+                threads_per_sample)
 
         aligned_read_files = {}
+        bwa_logs = {}
         for pairname,files in self.read_files.items():
-            RGinfo = r"@RG\tID:%s\tSM:%s\tPL:ILLUMINA" % (pairname,pairname)
-            if insert_size:
-                cmd = [path_to_exe, 'mem', 
-                        '-t', str(max_processes), 
-                        '-M', '-a', 
-                        '-I', insert_size, 
-                        '-R', RGinfo, 
-                        genome_fna, files[1], files[2]]
-            else:
-                # BWA can estimate on-the-fly
-                cmd = [path_to_exe, 'mem', 
-                        '-t', str(max_processes), 
-                        '-M', '-a', 
-                        '-R', RGinfo, 
-                        genome_fna, files[1], files[2]]
+            cmd = self._bwaCommand(path_to_exe, pairname, files, genome_fna, 
+                    insert_size, num_threads)
             
-            out_sam = _os.path.sep.join([local_alns_path_genome, 
-                    '%s__%s.sam' % (pairname, self.genome_name)])
+            out_prefix = _os.path.sep.join([local_alns_path_genome, 
+                    '%s__%s' % (pairname, self.genome_name)])
+            out_sam = out_prefix + '.sam'
             
             if not _os.path.exists(out_sam) or force:
-                print('Called: "%s"' % ' '.join(cmd))
-                with open(out_sam, "wb") as out:
-                    _subprocess.call(cmd, stdout = out)
-                
+                name = 'bwa_{}'.format(pairname)
+                bwa_logs[name] = out_prefix + '_bwa.log'
+                cmd = '{} > {} 2> {}'.format(' '.join([_quote(str(c)) for c \
+                        in cmd]), _quote(out_sam), _quote(bwa_logs[name]))
+                print('Called: %s' % cmd)
+                scheduler.add(['bash', '-c', cmd], name, cpus = num_threads, 
+                        outputs = [out_sam])
             else:
                 print('Found:')
                 print(out_sam)
                 print('use "force = True" to overwrite')
             
-            print(' '.join(cmd))
-            
             aligned_read_files[pairname] = out_sam
 
+        failed = scheduler.run()
+        self._logThroughput(scheduler, bwa_logs)
+        if failed:
+            raise _ExternalProgramError('Alignment failed for: {}'.format(
+                    ', '.join(failed)))
+
         self.aligned_read_files = aligned_read_files
 
+    def alignStreamed(self, insert_size = False, 
+                            path_to_exe = False, 
+                            samtools_exe = False, 
+                            picard_jar = False, 
+                            use_java = 'java', 
+                            local_alns_path = ['alignments'], 
+                            force = False, 
+                            mem_num_gigs = 2, 
+                            max_cpus = -1, 
+                            threads_per_sample = False, 
+                            keep_intermediates = False):
+        '''
+        Align, sort and mark duplicates in one pass per read pair
+
+        BWA output is piped straight into sorting and duplicate marking by 
+        samtools markdup (after fixmate) if the samtools version provides it, 
+        else into sorting with Picard MarkDuplicates run on the sorted BAM 
+        which is then removed. This gives the same sorted, deduplicated and 
+        indexed BAMs as align(), toBAMs(), removeDuplicates() and 
+        sortIndexBAMs() without the intermediate SAM and BAM files and second 
+        sort. With keep_intermediates, the SAM (and Picard input) are also 
+        kept for debugging. Samples are run concurrently as for align().
+        '''
+        if not path_to_exe:
+            path_to_exe = _get_exe_path('bwa')
+
+        if not samtools_exe:
+            samtools_exe = _get_exe_path('samtools')
+
+        use_markdup = samtoolsHasMarkdup(samtools_exe)
+        if not use_markdup and not picard_jar:
+            picard_jar = _get_jar_path('picard')
+
+        genome_fna, local_alns_path_genome = self._prepareAlignment(path_to_exe, 
+                local_alns_path)
+
+        scheduler = _JobScheduler(max_cpus = max_cpus, sample = self)
+        num_threads = self._threadsPerSample(scheduler.max_processes, 
+                threads_per_sample)
+        samtools = _quote(samtools_exe)
+
+        aligned_read_files = {}
+        paths_to_BAMs = []
+        paths_to_BAMs_dd_si = []
+        bwa_logs = {}
+        for pairname,files in self.read_files.items():
+            cmd = self._bwaCommand(path_to_exe, pairname, files, genome_fna, 
+                    insert_size, num_threads)
+            
+            out_prefix = _os.path.sep.join([local_alns_path_genome, 
+                    '%s__%s' % (pairname, self.genome_name)])
+            # named as if via sortIndexBAMs() for later steps
+            BAM_out = out_prefix + '_dd_si.bam'
+            tmp_prefix = _quote(out_prefix + '_tmp')
+            
+            pipeline = [' '.join([_quote(str(c)) for c in cmd] + \
+                    ['2>', _quote(out_prefix + '_bwa.log')])]
+            if keep_intermediates:
+                pipeline += ['tee {}'.format(_quote(out_prefix + '.sam'))]
+                aligned_read_files[pairname] = out_prefix + '.sam'
+            
+            if use_markdup:
+                pipeline += [
+                    '{} fixmate -m - -'.format(samtools), 
+                    '{} sort -T {} -o - -'.format(samtools, tmp_prefix), 
+                    '{} markdup -T {} - {}'.format(samtools, tmp_prefix, 
+                            _quote(BAM_out))]
+                commands = [' | '.join(pipeline)]
+            else:
+                BAM_sorted = out_prefix + '.bam'
+                pipeline += [
+                    '{} view -bu -'.format(samtools), 
+                    '{} sort -T {} -o {} -'.format(samtools, tmp_prefix, 
+                            _quote(BAM_sorted))]
+                picard_command = ['MarkDuplicates', 'I=', BAM_sorted, 
+                        'O=', BAM_out, 'M=', out_prefix + '_dd.log']
+                commands = [' | '.join(pipeline), ' '.join([_quote(c) for c in \
+                        [use_java, '-Xmx%sg' % mem_num_gigs, '-jar', picard_jar] + \
+                        picard_command])]
+                if keep_intermediates:
+                    paths_to_BAMs += [BAM_sorted]
+                else:
+                    commands += ['rm {}'.format(_quote(BAM_sorted))]
+            
+            commands += ['{} index {}'.format(samtools, _quote(BAM_out))]
+            
+            if not _os.path.exists(BAM_out) or force:
+                cmd = 'set -o pipefail; ' + ' && '.join(commands)
+                print('Called: %s' % cmd)
+                name = 'bwa_{}'.format(pairname)
+                bwa_logs[name] = out_prefix + '_bwa.log'
+                scheduler.add(['bash', '-c', cmd], name, cpus = num_threads, 
+                        mem_gigs = 1 if use_markdup else mem_num_gigs, 
+                        outputs = [BAM_out, BAM_out + '.bai'])
+            else:
+                print('Found:')
+                print(BAM_out)
+                print('use "force = True" to overwrite')
+            
+            paths_to_BAMs_dd_si += [BAM_out]
+
+        failed = scheduler.run()
+        self._logThroughput(scheduler, bwa_logs)
+        if failed:
+            raise _ExternalProgramError('Alignment to sorted, deduplicated BAM '\
+                    'failed for: {}'.format(', '.join(failed)))
+
+        if keep_intermediates:
+            self.aligned_read_files = aligned_read_files
+            if paths_to_BAMs:
+                self.paths_to_BAMs = paths_to_BAMs
+        self.paths_to_BAMs_dd_si = paths_to_BAMs_dd_si
+
     def toBAMs(self, path_to_exe = False, force = False, max_cpus = -1):
         if not path_to_exe:
             path_to_exe = _get_exe_path('samtools')
 
-        processes = set()
-        max_processes = _decide_max_processes( max_cpus )
+        scheduler = _JobScheduler(max_cpus = max_cpus, sample = self)
 
         paths_to_BAMs = []
 
         for pairname,SAM in self.aligned_read_files.items():
             BAM_out = SAM[:-4] + '.bam'
             if not _os.path.exists(BAM_out) or force:
-                cmd = '{0} view -buh {1} | {0} sort -o {2}.bam -T {3}; '\
+                cmd = 'set -o pipefail; {0} view -buh {1} | {0} sort -o {2}.bam -T {3} && '\
                         '{0} index {2}.bam'.format(path_to_exe, SAM, SAM[:-4], 
                         SAM[:-4].split(_os.path.sep)[-1])
                 print('Called: %s' % cmd)
-                processes.add( _subprocess.Popen(cmd, shell=True) )
-                if len(processes) >= max_processes:
-                    (pid, exit_status) = _os.wait()
-                    processes.difference_update(
-                        [p for p in processes if p.poll() is not None])
+                # samtools sort uses 768 MB by default
+                scheduler.add(['bash', '-c', cmd], 'samtools_{}'.format(pairname), 
+                        mem_gigs = 1, outputs = [BAM_out, BAM_out + '.bai'])
             else:
                 print('Found:')
                 print(BAM_out)
@@ -613,10 +806,10 @@ class SAMs(_MetaSample):
             
             paths_to_BAMs += [BAM_out]
 
-        # Check if all the child processes were closed
-        for p in processes:
-            if p.poll() is None:
-                p.wait()
+        failed = scheduler.run()
+        if failed:
+            raise _ExternalProgramError('Conversion to BAM failed for: {}'\
+                    ''.format(', '.join(failed)))
 
         self.paths_to_BAMs = paths_to_BAMs
 
@@ -624,32 +817,21 @@ class SAMs(_MetaSample):
         if not path_to_jar:
             path_to_jar = _get_jar_path('picard')
 
-        processes = set()
-        max_processes = _decide_max_processes( max_cpus )
+        # each picard reserves mem_num_gigs of memory
+        scheduler = _JobScheduler(max_cpus = max_cpus, sample = self)
 
-        print('Print: will use %s cpus for picard' % max_processes)
+        print('Print: will use up to %s cpus for picard' % scheduler.max_processes)
 
         paths_to_BAMs_dd = []
         for BAM in self.paths_to_BAMs:
             BAM_out = BAM[:-4] + '_dd.bam'
             if not _os.path.exists(BAM_out) or force:
-                # an alternative parallel code with polling not waiting
-                # while len(processes) >= max_processes:
-                    # _sleep(1)
-                    # print('processes: %s' % (len(processes)))
-                    # processes.difference_update(
-                        # [p for p in processes if p.poll() is not None]
-                    # )
                 picard_command = ['MarkDuplicates', 'I=', BAM, 'O=', BAM_out, 'M=', BAM[:-4] + '_dd.log'] #, 'VALIDATION_STRINGENCY=','LENIENT']
                 cmd = ['java', '-Xmx%sg' % mem_num_gigs, '-jar', path_to_jar] + picard_command
-                processes.add( _subprocess.Popen(cmd, shell=False) )
                 print('Called: %s' % (' '.join(map(str, cmd))))
-                #_subprocess.call(cmd, shell=False)
-                print('processes: %s, max_processes: %s' % (len(processes),max_processes))
-                if len(processes) >= max_processes:
-                    (pid, exit_status) = _os.wait()
-                    processes.difference_update(
-                        [p for p in processes if p.poll() is not None])
+                scheduler.add(cmd, 'picard_{}'.format(
+                        BAM[:-4].split(_os.path.sep)[-1]), 
+                        mem_gigs = mem_num_gigs, outputs = [BAM_out])
                 
             else:
                 print('Found:')
@@ -658,10 +840,10 @@ class SAMs(_MetaSample):
             
             paths_to_BAMs_dd += [BAM_out]
 
-        # Check if all the child processes were closed
-        for p in processes:
-            if p.poll() is None:
-                p.wait()
+        failed = scheduler.run()
+        if failed:
+            raise _ExternalProgramError('Duplicate removal failed for: {}'\
+                    ''.format(', '.join(failed)))
 
         self.paths_to_BAMs_dd = paths_to_BAMs_dd
 
@@ -670,22 +852,21 @@ class SAMs(_MetaSample):
         if not path_to_exe:
             path_to_exe = _get_exe_path('samtools')
 
-        processes = set()
-        max_processes = _decide_max_processes( max_cpus )
+        scheduler = _JobScheduler(max_cpus = max_cpus, sample = self)
 
         paths_to_BAMs_dd_si = []
         for SAM in self.paths_to_BAMs_dd:
             BAM_out = SAM[:-4] + '_si.bam'
             if not _os.path.exists(BAM_out) or force:
-                cmd = '{0} sort -o {2}_si.bam -T {3}_si {1}; {0} index {2}_si.bam'\
+                cmd = '{0} sort -o {2}_si.bam -T {3}_si {1} && {0} index {2}_si.bam'\
                         ''.format(path_to_exe, SAM, SAM[:-4], 
                         SAM[:-4].split(_os.path.sep)[-1])
                 print('Called: %s' % cmd)
-                processes.add( _subprocess.Popen(cmd, shell=True) )
-                if len(processes) >= max_processes:
-                    (pid, exit_status) = _os.wait()
-                    processes.difference_update(
-                        [p for p in processes if p.poll() is not None])
+                # samtools sort uses 768 MB by default
+                scheduler.add(cmd, 'samtools_{}'.format(
+                        SAM[:-4].split(_os.path.sep)[-1]), 
+                        mem_gigs = 1, outputs = [BAM_out, BAM_out + '.bai'], 
+                        shell = True)
             else:
                 print('Found:')
                 print(BAM_out)
@@ -693,10 +874,10 @@ class SAMs(_MetaSample):
             
             paths_to_BAMs_dd_si += [BAM_out]
 
-        # Check if all the child processes were closed
-        for p in processes:
-            if p.poll() is None:
-                p.wait()
+        failed = scheduler.run()
+        if failed:
+            raise _ExternalProgramError('Sorting and indexing failed for: {}'\
+                    ''.format(', '.join(failed)))
 
         self.paths_to_BAMs_dd_si = paths_to_BAMs_dd_si
 
@@ -718,7 +899,9 @@ class SAMs(_MetaSample):
         if not samtools_exe:
             samtools_exe = _get_exe_path('samtools')
 
-        genome_fna = 'genome_sequences/{}.fna'.format(self.genome_name)
+        references = _ReferenceCache()
+        genome_fna = references.fasta(self.genome_name, self.genome_sequence, 
+                self.genome_names)
 
         e1 = 'Could not find "paths_to_BAMs_dd_si" attribute. Before starting '\
                 'GATK analysis, read alignments must have duplicates removed. '\
@@ -733,19 +916,13 @@ class SAMs(_MetaSample):
         for BAM in self.paths_to_BAMs_dd_si:
             assert _os.path.exists(BAM), e2 % BAM
 
-        # always (re)generate dict in case of upstream changes in data
-        print('Creating sequence dictionary for %s' % genome_fna)
-        _subprocess.call([use_java, '-jar', picard_jar, 
-                'CreateSequenceDictionary', 
-                'R=', genome_fna, 
-                'O=', genome_fna[:-4] + '.dict'])
+        # (re)generate dict and index only if the genome sequence changed
+        if not references.sequenceDict(genome_fna, picard_jar, use_java) or \
+                not references.faidx(genome_fna, samtools_exe):
+            raise _ExternalProgramError('Indexing for GATK failed for {}'\
+                    ''.format(genome_fna))
 
-        # always (re)index in case of upstream changes in data
-        print('Writing index files for %s' % genome_fna)
-        _subprocess.call([samtools_exe, 'faidx', genome_fna])
-
-        processes = set()
-        max_processes = _decide_max_processes( max_cpus )
+        scheduler = _JobScheduler(max_cpus = max_cpus, sample = self)
 
         for BAM in self.paths_to_BAMs_dd_si:
             intervals = BAM[:-4] + '.intervals'
@@ -756,20 +933,18 @@ class SAMs(_MetaSample):
                         '-I', BAM, 
                         '-o', intervals] #, '--validation_strictness', 'LENIENT']
                 print(' '.join(map(str, cmd)))
-                processes.add( _subprocess.Popen(cmd, shell=False) )
-                if len(processes) >= max_processes:
-                    (pid, exit_status) = _os.wait()
-                    processes.difference_update(
-                        [p for p in processes if p.poll() is not None])
+                scheduler.add(cmd, 'GATK_RealignerTargetCreator_{}'.format(
+                        BAM[:-4].split(_os.path.sep)[-1]), 
+                        mem_gigs = mem_num_gigs, outputs = [intervals])
             else:
                 print('Found:')
                 print(intervals)
                 print('use "force = True" to overwrite')
 
-        # Check if all the child processes were closed
-        for p in processes:
-            if p.poll() is None:
-                p.wait()
+        failed = scheduler.run()
+        if failed:
+            raise _ExternalProgramError('GATK RealignerTargetCreator failed '\
+                    'for: {}'.format(', '.join(failed)))
 
 
         paths_to_BAMs_dd_si_ra = []
@@ -785,11 +960,9 @@ class SAMs(_MetaSample):
                         '-o', bam_out,
                         '--filter_bases_not_stored']
                 print(' '.join(map(str, cmd)))
-                processes.add( _subprocess.Popen(cmd, shell=False) )
-                if len(processes) >= max_processes:
-                    _os.wait()
-                    processes.difference_update(
-                        [p for p in processes if p.poll() is not None])
+                scheduler.add(cmd, 'GATK_IndelRealigner_{}'.format(
+                        BAM[:-4].split(_os.path.sep)[-1]), 
+                        mem_gigs = 4, outputs = [bam_out])
             else:
                 print('Found:')
                 print(bam_out)
@@ -797,9 +970,10 @@ class SAMs(_MetaSample):
             
             paths_to_BAMs_dd_si_ra += [bam_out]
 
-        for p in processes:
-            if p.poll() is None:
-                p.wait()
+        failed = scheduler.run()
+        if failed:
+            raise _ExternalProgramError('GATK IndelRealigner failed for: {}'\
+                    ''.format(', '.join(failed)))
 
         # the last list of BAMs in ready_BAMs is input for CallgVCFsGATK
         # both IndelRealignGATK and recalibBaseScoresGATK put here
@@ -30,6 +30,12 @@ from collections import OrderedDict as _OrderedDict
 from collections import defaultdict as _defaultdict
 from collections import Counter as _Counter
 from glob import glob as _glob
+from itertools import chain as _chain
+from bisect import bisect_left as _bisect_left
+try:
+    from collections.abc import Mapping as _Mapping
+except ImportError:
+    from collections import Mapping as _Mapping
 
 from baga import _subprocess
 from baga import _os
@@ -45,6 +51,7 @@ from baga import _md5
 
 # external Python modules
 import pysam as _pysam
+import numpy as _np
 from Bio import SeqIO as _SeqIO
 from Bio.Seq import Seq as _Seq
 from Bio.SeqRecord import SeqRecord as _SeqRecord
@@ -53,30 +60,177 @@ from Bio.SeqRecord import SeqRecord as _SeqRecord
 from baga import decide_max_processes as _decide_max_processes
 from baga import get_exe_path as _get_exe_path
 from baga import report_time as _report_time
+from baga.References import ReferenceCache as _ReferenceCache
 def main():
     pass
 
-def parseVCF(path_to_VCF):
-    '''returns (header, header_section_order, colnames, variants)'''
+def _parse_region(region):
+    '''
+    Split a 'chrom:start-end' region string into (chrom, start, end).
+
+    start and end are base-1 inclusive as in samtools/tabix region strings and 
+    either may be absent (None) e.g., 'chrom' or 'chrom:start'.
+    '''
+    if ':' not in region:
+        return(region, None, None)
+    chrom, span = region.rsplit(':', 1)
+    span = span.replace(',', '')
+    if '-' in span:
+        start, end = span.split('-')
+        start = int(start) if len(start) else None
+        end = int(end) if len(end) else None
+    else:
+        start, end = int(span), None
+    return(chrom, start, end)
+
+def _parse_header_lines(lines):
+    '''
+    Parse VCF meta-information lines and the #CHROM line.
+
+    returns (header, header_section_order, colnames) as per parseVCF()
+    '''
     header_section_order = _OrderedDict()
     header = _defaultdict(list)
     pattern = _re.compile('##([^=]+)=(.+)$')
-    variants = []
-    collect_variants = False
-    for line in open(path_to_VCF):
-        if collect_variants:
-            variants += [line.rstrip()]
-        elif line[:6] == '#CHROM':
-            colnames = line.rstrip().split('\t')
-            collect_variants = True
+    colnames = None
+    for line in lines:
+        line = line.rstrip()
+        if line[:6] == '#CHROM':
+            colnames = line.split('\t')
+            break
+        section, value = _re.match(pattern, line).groups()
+        header_section_order[section] = True
+        header[section] += [line]
+
+    return(dict(header), list(header_section_order), colnames)
+
+class VCFRecord(object):
+    '''
+    A single VCF data line, split into cells only when first needed.
+
+    The unsplit line is always available as .line (without line ending) for 
+    passing through unchanged e.g., when writing a new VCF.
+    '''
+    __slots__ = ('line', '_cells')
+
+    def __init__(self, line):
+        self.line = line.rstrip()
+        self._cells = None
+
+    @property
+    def cells(self):
+        if self._cells is None:
+            self._cells = self.line.split('\t')
+        return(self._cells)
+
+    @property
+    def CHROM(self):
+        # avoid splitting the whole row for a chromosome check
+        if self._cells is None:
+            return(self.line[:self.line.index('\t')])
+        return(self._cells[0])
+
+    @property
+    def POS(self):
+        return(int(self.cells[1]))
+
+    def __str__(self):
+        return(self.line)
+
+class VCFReader(object):
+    '''
+    Stream variants from a VCF file without loading all rows into memory.
+
+    The header is parsed once at instantiation into the same structures 
+    returned by parseVCF() i.e., .header, .header_section_order and .colnames.
+    Iterating over a VCFReader yields VCFRecord objects one at a time.
+
+    Plain text, gzip and bgzip compressed files are accepted. If a bgzipped 
+    VCF has a tabix index (.tbi or .csi), queries for a region e.g., 
+    'NC_011770.1:2689000-2691500' seek directly to the relevant block. 
+    Without an index, region queries scan the file.
+    '''
+    def __init__(self, path_to_VCF):
+        e = 'Could not find {}.\nPlease ensure all files exist'.format(path_to_VCF)
+        assert _os.path.exists(path_to_VCF), e
+        self.path_to_VCF = path_to_VCF
+        with open(path_to_VCF, 'rb') as filein:
+            self.compressed = filein.read(2) == b'\x1f\x8b'
+        self.indexed = self.compressed and any([_os.path.exists(path_to_VCF + ext) \
+                for ext in ('.tbi', '.csi')])
+        with self._open() as filein:
+            header_lines = (line for line in filein if line[:1] == '#')
+            (self.header, 
+             self.header_section_order, 
+             self.colnames) = _parse_header_lines(header_lines)
+        e = 'Could not find #CHROM line in {}: is this a VCF?'.format(path_to_VCF)
+        assert self.colnames is not None, e
+        self.sample_names = self.colnames[9:]
+
+    def _open(self):
+        if self.compressed:
+            # bgzip is multi-member gzip so plain gzip decompression works
+            return(_gzip.open(self.path_to_VCF, 'rt'))
         else:
-            section, value = _re.match(pattern, line.rstrip()).groups()
-            header_section_order[section] = True
-            header[section] += [line.rstrip()]
+            return(open(self.path_to_VCF))
 
-    header = dict(header)
-    header_section_order = list(header_section_order)
-    return(header, header_section_order, colnames, variants)
+    def rows(self, region = None):
+        '''yield each data row as an unsplit string, optionally within a region'''
+        if region is not None and self.indexed:
+            tabix_file = _pysam.TabixFile(self.path_to_VCF)
+            try:
+                for line in tabix_file.fetch(region = region):
+                    yield line
+            finally:
+                tabix_file.close()
+            return
+        
+        if region is not None:
+            chrom, start, end = _parse_region(region)
+        
+        with self._open() as filein:
+            for line in filein:
+                if line[:1] == '#':
+                    continue
+                line = line.rstrip()
+                if region is not None:
+                    cells = line.split('\t', 2)
+                    if cells[0] != chrom:
+                        continue
+                    pos1 = int(cells[1])
+                    if start is not None and pos1 < start:
+                        continue
+                    if end is not None and pos1 > end:
+                        continue
+                yield line
+
+    def fetch(self, region = None):
+        '''yield VCFRecord objects, optionally only those in 'chrom:start-end' '''
+        for line in self.rows(region = region):
+            yield VCFRecord(line)
+
+    def __iter__(self):
+        return(self.fetch())
+
+def indexVCF(path_to_VCF):
+    '''
+    Compress a VCF with bgzip and build a tabix index for region queries.
+
+    The uncompressed original is kept. Returns path to the compressed VCF.
+    '''
+    return(_pysam.tabix_index(path_to_VCF, preset = 'vcf', keep_original = True, 
+            force = True))
+
+def parseVCF(path_to_VCF):
+    '''
+    returns (header, header_section_order, colnames, variants)
+
+    All data rows are loaded into a list: for large VCFs use VCFReader instead 
+    which yields rows one at a time.
+    '''
+    vcf = VCFReader(path_to_VCF)
+    variants = list(vcf.rows())
+    return(vcf.header, vcf.header_section_order, vcf.colnames, variants)
 
 def dictify_vcf_header(header):
     '''convert VCF header to dict using re for quotes'''
@@ -96,6 +250,171 @@ def dictify_vcf_header(header):
 
     return(headerdict)
 
+def _group_rows(*columns):
+    '''
+    Group rows of equal-length arrays sharing the same values in every column.
+
+    returns (row_groups, group_sizes, first_rows): the group index of each 
+    row, the number of rows in each group and a row index representing each 
+    group. Groups are numbered in sort order of the columns, first column 
+    most significant.
+    '''
+    num_rows = len(columns[0])
+    if num_rows == 0:
+        empty = _np.zeros(0, dtype = _np.int64)
+        return(empty, empty, empty)
+    # lexsort takes the most significant key last
+    order = _np.lexsort(columns[::-1])
+    new_group = _np.zeros(num_rows, dtype = bool)
+    new_group[0] = True
+    for column in columns:
+        sorted_column = column[order]
+        new_group[1:] |= sorted_column[1:] != sorted_column[:-1]
+    sorted_groups = _np.cumsum(new_group) - 1
+    row_groups = _np.empty(num_rows, dtype = _np.int64)
+    row_groups[order] = sorted_groups
+    group_sizes = _np.bincount(sorted_groups)
+    first_rows = order[new_group]
+    return(row_groups, group_sizes, first_rows)
+
+class _ChromosomeVariants(_Mapping):
+    '''read-only position => [[REF, ALT], set(filters)] view of a VariantTable'''
+    def __init__(self, table, start, end):
+        self._table = table
+        self._start = start
+        self._end = end
+
+    def __getitem__(self, position):
+        positions = self._table.positions[self._start:self._end]
+        i = _np.searchsorted(positions, position)
+        if i == len(positions) or positions[i] != position:
+            raise KeyError(position)
+        return(self._table._entry(self._start + i))
+
+    def __iter__(self):
+        return(iter(self._table.positions[self._start:self._end].tolist()))
+
+    def __len__(self):
+        return(self._end - self._start)
+
+class _SampleVariants(_Mapping):
+    '''read-only chromosome => positions view of a VariantTable'''
+    def __init__(self, table, start, end):
+        self._table = table
+        self._start = start
+        self._end = end
+        chroms = table.chroms[start:end]
+        self._chrom_indexes = _np.unique(chroms)
+        self._bounds = {}
+        for c in self._chrom_indexes.tolist():
+            self._bounds[table.chromosomes[c]] = (
+                    start + _np.searchsorted(chroms, c, side = 'left'), 
+                    start + _np.searchsorted(chroms, c, side = 'right'))
+
+    def __getitem__(self, chromosome):
+        s, e = self._bounds[chromosome]
+        return(_ChromosomeVariants(self._table, s, e))
+
+    def __iter__(self):
+        return(iter([self._table.chromosomes[c] for c in self._chrom_indexes.tolist()]))
+
+    def __len__(self):
+        return(len(self._bounds))
+
+class VariantTable(_Mapping):
+    '''
+    Columnar store of per sample variant calls from a VCF.
+
+    Each call of a variant in a sample is a row across parallel NumPy arrays:
+    .samples (index into .sample_names), .chroms (index into .chromosomes), 
+    .positions, .allele_codes (index into .alleles, a list of unique 
+    (REF, ALT) pairs) and .filter_masks with one bit per name in 
+    .filter_names. As for sortVariantsKeepFilter(), ALT is a tuple of 
+    (ALT, frequency, ploidy) if a genotype has more than one allele.
+
+    Rows are sorted by sample, chromosome then position. A VariantTable can 
+    be used where the nested dicts of:
+        sample => chromosome => position = [[REF, ALT], set(filters)]
+    are expected: it is a read-only mapping and each entry is only built 
+    when accessed.
+    '''
+    def __init__(self, sample_names, chromosomes, alleles, filter_names, 
+            samples, chroms, positions, allele_codes, filter_masks):
+        self.sample_names = list(sample_names)
+        self.chromosomes = list(chromosomes)
+        self.alleles = list(alleles)
+        self.filter_names = list(filter_names)
+        e = 'Too many filters ({}) for a 64 bit filter mask'.format(len(self.filter_names))
+        assert len(self.filter_names) <= 64, e
+        samples = _np.asarray(samples, dtype = _np.int32)
+        chroms = _np.asarray(chroms, dtype = _np.int32)
+        positions = _np.asarray(positions, dtype = _np.int64)
+        allele_codes = _np.asarray(allele_codes, dtype = _np.int32)
+        filter_masks = _np.asarray(filter_masks, dtype = _np.uint64)
+        # sort and keep the last of any repeated sample, chromosome, position 
+        # as would happen when assigning into nested dicts
+        order = _np.lexsort((positions, chroms, samples))
+        keep = _np.ones(len(order), dtype = bool)
+        if len(order):
+            keep[:-1] = (samples[order][1:] != samples[order][:-1]) | \
+                        (chroms[order][1:] != chroms[order][:-1]) | \
+                        (positions[order][1:] != positions[order][:-1])
+        order = order[keep]
+        self.samples = samples[order]
+        self.chroms = chroms[order]
+        self.positions = positions[order]
+        self.allele_codes = allele_codes[order]
+        self.filter_masks = filter_masks[order]
+        self._filter_sets = {}
+        self._sample_bounds = {}
+        for s in _np.unique(self.samples).tolist():
+            self._sample_bounds[self.sample_names[s]] = (
+                    _np.searchsorted(self.samples, s, side = 'left'), 
+                    _np.searchsorted(self.samples, s, side = 'right'))
+
+    def __getitem__(self, sample):
+        s, e = self._sample_bounds[sample]
+        return(_SampleVariants(self, s, e))
+
+    def __iter__(self):
+        return(iter(sorted(self._sample_bounds, key = self.sample_names.index)))
+
+    def __len__(self):
+        return(len(self._sample_bounds))
+
+    def _entry(self, i):
+        '''build the [[REF, ALT], set(filters)] entry for row i'''
+        mask = int(self.filter_masks[i])
+        try:
+            filters = self._filter_sets[mask]
+        except KeyError:
+            filters = frozenset([f for n,f in enumerate(self.filter_names) if mask >> n & 1])
+            self._filter_sets[mask] = filters
+        REF, ALT = self.alleles[self.allele_codes[i]]
+        return([[REF, ALT], set(filters)])
+
+    def filterMask(self, filter_names):
+        '''bitmask for those of filter_names present in this table'''
+        mask = 0
+        for f in filter_names:
+            if f in self.filter_names:
+                mask |= 1 << self.filter_names.index(f)
+        return(_np.uint64(mask))
+
+    def queryCodes(self):
+        '''per row code for ALT only, ignoring REF, as in (chromosome, position, query)'''
+        queries = {}
+        codes = _np.array([queries.setdefault(ALT, len(queries)) \
+                for REF, ALT in self.alleles], dtype = _np.int32)
+        return(codes[self.allele_codes])
+
+    def subset(self, rows):
+        '''new VariantTable of the rows selected by a boolean mask or indexes'''
+        return(VariantTable(self.sample_names, self.chromosomes, self.alleles, 
+                self.filter_names, self.samples[rows], self.chroms[rows], 
+                self.positions[rows], self.allele_codes[rows], 
+                self.filter_masks[rows]))
+
 def sortVariantsKeepFilter(header, colnames, variantrows):
     '''
     Given a VCF file contents divided up by CallVariants.parseVCF(), return a 
@@ -103,6 +422,11 @@ def sortVariantsKeepFilter(header, colnames, variantrows):
     filters as described in the VCF header.
     Per sample filters stored in INFO columns must be described in header 
     ##INFO entries and have Descriptions starting "FILTER:".
+    variantrows can be any iterable of rows (strings) or VCFRecords, e.g., a 
+    VCFReader, so all rows need not be held in memory.
+    Variants are returned in a VariantTable which can be used like the 
+    sample => chromosome => position = [[REF, ALT], set(filters)] dicts
+    previously returned.
     '''
     # identify chromosome for this VCF <== this will fail if running against > 1 contigs . . .
     pattern = _re.compile('##contig=<ID=([A-Za-z0-9_\.]+),length=([0-9]+)>')
@@ -143,13 +467,21 @@ def sortVariantsKeepFilter(header, colnames, variantrows):
 
     allfilters = FILTERfilters | INFOfilters
 
-    # return empties now if nothing to process below
-    if len(variantrows) == 0:
-        variants = {}
+    def split_row(row):
+        if isinstance(row, VCFRecord):
+            return(row.cells)
+        return(row.rstrip().split('\t'))
+
+    variantrows = iter(variantrows)
+    try:
+        first_row = split_row(next(variantrows))
+    except StopIteration:
+        # return empties now if nothing to process below
+        variants = VariantTable(sample_names, [], [], [], [], [], [], [], [])
         return(variants, allfilters)
 
 
-    cols = dict(zip(parameter_names, variantrows[0].rstrip().split('\t')[:len(parameter_names)]))
+    cols = dict(zip(parameter_names, first_row[:len(parameter_names)]))
 
     e = 'Could not find FORMAT column in this VCF file. Probably no genotype data.'
     assert 'FORMAT' in cols, e
@@ -160,44 +492,49 @@ def sortVariantsKeepFilter(header, colnames, variantrows):
 
     # by sample chromosome position ref,query | filterlist
 
-    # three level automatic dicts
-    #                       sample               chromosome           position = [[ref,query], [filterlist]]
-    variants = _defaultdict(lambda: _defaultdict(lambda: _defaultdict(dict)))
-
-    for row in variantrows:
+    # columns of a VariantTable: one entry per sample per variant
+    # allele pairs, chromosomes and filter names are coded as integers
+    chromosome_codes = _OrderedDict()
+    allele_codes = _OrderedDict()
+    filter_bits = _OrderedDict()
+    def filter_mask(names):
+        mask = 0
+        for f in names:
+            mask |= 1 << filter_bits.setdefault(f, len(filter_bits))
+        return(mask)
+
+    samples_col = _array('i')
+    chroms_col = _array('i')
+    positions_col = _array('l')
+    alleles_col = _array('i')
+    # array typecode 'Q' is Python 3 only
+    filters_col = []
+
+    num_params = len(parameter_names)
+    for cells in _chain([first_row], (split_row(row) for row in variantrows)):
         # variant info
-        cols = dict(zip(parameter_names, row.rstrip().split('\t')[:len(parameter_names)]))
+        cols = dict(zip(parameter_names, cells[:num_params]))
+        # collect sample wide filters once per row
+        row_mask = filter_mask(set(cols['FILTER'].split(',')) - set(['PASS']))
         # collect per sample filters for this row
         INFO = dict([i.split('=') for i in cols['INFO'].split(';') if '=' in i])
         samples_filtered = {}
         for f in INFOfilters:
             if f in INFO:
-                indexes = map(int, INFO[f].split(','))
-                for i in indexes:
-                    try:
-                        samples_filtered[sample_names[i]].add(f)
-                    except KeyError:
-                        samples_filtered[sample_names[i]] = set([f])
-        
-        # collect sample wide filters
-        thesefilterflags = set(cols['FILTER'].split(',')) - set(['PASS'])
-        for sample_name in sample_names:
-            try:
-                samples_filtered[sample_name].update(thesefilterflags)
-            except KeyError:
-                samples_filtered[sample_name] = thesefilterflags
-        
-        # sample info
-        sample_data = dict(zip(sample_names, row.rstrip().split('\t')[len(parameter_names):]))
-        sample_data = dict([(s, dict(zip(sample_variant_info, d.split(':')))) for s,d in sample_data.items()])
+                bit = filter_mask([f])
+                for i in map(int, INFO[f].split(',')):
+                    samples_filtered[i] = samples_filtered.get(i, 0) | bit
         
-        for sample,data in sample_data.items():
+        chrom = chromosome_codes.setdefault(cols['CHROM'], len(chromosome_codes))
+        pos1 = int(cols['POS'])
+        alleles = cols['ALT'].split(',')
+        for sample_index,d in enumerate(cells[num_params:]):
+            data = dict(zip(sample_variant_info, d.split(':')))
             if data['GT'] != '.':
                 # there can be more than one variant per row
                 # rare for SNPs but can happen for indels
                 freqs = _Counter()
-                alleles = cols['ALT'].split(',')
-                allele_nums = map(int,data['GT'].split('/'))
+                allele_nums = list(map(int,data['GT'].split('/')))
                 for allele_num in allele_nums:
                     if allele_num > 0:
                         freqs[alleles[allele_num-1]] += 1
@@ -205,17 +542,19 @@ def sortVariantsKeepFilter(header, colnames, variantrows):
                 for ALT,freq in freqs.items():
                     if len(allele_nums) == 1:
                         # store ALT as single variant character
-                        variants[sample][cols['CHROM']][int(cols['POS'])] = [[cols['REF'], ALT], samples_filtered[sample]]
+                        allele = (cols['REF'], ALT)
                     else:
                         # store ALT as tuple of variant character, frequency, population_size
-                        variants[sample][cols['CHROM']][int(cols['POS'])] = [[cols['REF'], (ALT,freq,len(allele_nums))], samples_filtered[sample]]
+                        allele = (cols['REF'], (ALT,freq,len(allele_nums)))
+                    samples_col.append(sample_index)
+                    chroms_col.append(chrom)
+                    positions_col.append(pos1)
+                    alleles_col.append(allele_codes.setdefault(allele, len(allele_codes)))
+                    filters_col.append(row_mask | samples_filtered.get(sample_index, 0))
 
-    # convert nested defaultdicts to dicts
-    variants = dict(variants)
-    for k1,v1 in variants.items():
-        variants[k1] = dict(v1)
-        for k2,v2 in variants[k1].items():
-            variants[k1][k2] = dict(v2)
+    variants = VariantTable(sample_names, list(chromosome_codes), list(allele_codes), 
+            list(filter_bits), samples_col, chroms_col, positions_col, alleles_col, 
+            filters_col)
 
     return(variants, allfilters)
 
@@ -223,8 +562,19 @@ def sortAmongBetweenReference(variants, sample_size):
     '''Separate "among sample" and "to reference" variants
 
     Takes a dictionary produced by .sortVariantsKeepFilter() as input, returns two 
-    of the same shape in a single dictionary
+    of the same shape in a single dictionary. A VariantTable is divided without 
+    iterating over each variant in Python and two VariantTables are returned.
     '''
+    if isinstance(variants, VariantTable):
+        row_groups, group_sizes, first_rows = _group_rows(variants.chroms, 
+                variants.positions, variants.queryCodes())
+        among_groups = group_sizes < sample_size
+        print('among: {}; to reference: {}'.format(among_groups.sum(), 
+                (~among_groups).sum()))
+        among_rows = among_groups[row_groups]
+        return({'among':variants.subset(among_rows), 
+                'to_reference':variants.subset(~among_rows)})
+
     variant_freqs = _Counter()
     for sample, chromosomes in variants.items():
         # print('==> checking {}'.format(sample))
@@ -268,17 +618,40 @@ def to_by_position_filtered(variants, filters_applied, summarise = True):
     '''Sort variants by position and divide into non-filtered and filtered'''
     by_position = _defaultdict(_Counter)
     by_position_filtered = _defaultdict(_Counter)
-    for sample, chromosomes in variants.items():
-        for chromosome, positions in chromosomes.items():
-            # iterate through variants by position
-            for position, ((reference,query),filters) in sorted(positions.items()):
-                if len(filters & set(filters_applied)) == 0:
-                    # retain variants without any filters flagged (of those we are interested in)
-                    by_position[chromosome][(position,reference,query,None)] += 1
-                else:
-                    for f in filters & set(filters_applied):
-                        # also retain those with a filter flag, separately for each filter
-                        by_position_filtered[chromosome][(position,reference,query,f)] += 1
+    if isinstance(variants, VariantTable):
+        def count(rows, this_filter, counts):
+            # tally samples sharing each chromosome, position and allele
+            chroms = variants.chroms[rows]
+            positions = variants.positions[rows]
+            allele_codes = variants.allele_codes[rows]
+            row_groups, group_sizes, first_rows = _group_rows(chroms, positions, 
+                    allele_codes)
+            for i,size in zip(first_rows.tolist(), group_sizes.tolist()):
+                reference,query = variants.alleles[allele_codes[i]]
+                counts[variants.chromosomes[chroms[i]]][(int(positions[i]),
+                        reference,query,this_filter)] += size
+        
+        applied = variants.filterMask(filters_applied)
+        count((variants.filter_masks & applied) == 0, None, by_position)
+        for f in set(filters_applied) & set(variants.filter_names):
+            count((variants.filter_masks & variants.filterMask([f])) != 0, f, 
+                    by_position_filtered)
+        
+        if len(variants.chromosomes):
+            # as for dicts below, summarise the last chromosome
+            chromosome = variants.chromosomes[-1]
+    else:
+        for sample, chromosomes in variants.items():
+            for chromosome, positions in chromosomes.items():
+                # iterate through variants by position
+                for position, ((reference,query),filters) in sorted(positions.items()):
+                    if len(filters & set(filters_applied)) == 0:
+                        # retain variants without any filters flagged (of those we are interested in)
+                        by_position[chromosome][(position,reference,query,None)] += 1
+                    else:
+                        for f in filters & set(filters_applied):
+                            # also retain those with a filter flag, separately for each filter
+                            by_position_filtered[chromosome][(position,reference,query,f)] += 1
 
     if summarise:
         for f1 in sorted(filters_applied):
@@ -383,11 +756,11 @@ def reportCumulative(filter_order, reference_id, VCFs, VCFs_indels = False):
             print('dataset: {}'.format(dataset))
             for varianttype in variant_type_order:
                 for filename in varianttypes[varianttype]:
-                    header, header_section_order, these_colnames, variantrows = parseVCF(filename)
-                    variants, allfilters = sortVariantsKeepFilter(header, these_colnames, variantrows)
+                    vcf = VCFReader(filename)
+                    variants, allfilters = sortVariantsKeepFilter(vcf.header, vcf.colnames, vcf)
                     # divide variants into those among sample only, those between sample
                     # and reference
-                    variants_divided = sortAmongBetweenReference(variants, sample_size = len(these_colnames[9:]))
+                    variants_divided = sortAmongBetweenReference(variants, sample_size = len(vcf.sample_names))
                     variants_divided['all'] = variants
                     # cumulative filters applied here
                     for group_name in variant_groups:
@@ -483,11 +856,11 @@ def reportLists(include_filters, reference_id, VCFs, VCFs_indels = False):
         for varianttype in variant_type_order:
             print('==> Variant class: {}'.format(varianttype))
             filename = varianttypes[varianttype]
-            header, header_section_order, these_colnames, variantrows = parseVCF(filename)
-            variants, allfilters = sortVariantsKeepFilter(header, these_colnames, variantrows)
+            vcf = VCFReader(filename)
+            variants, allfilters = sortVariantsKeepFilter(vcf.header, vcf.colnames, vcf)
             # divide variants into those among sample only, those between sample
             # and reference
-            variants_divided = sortAmongBetweenReference(variants, sample_size = len(these_colnames[9:]))
+            variants_divided = sortAmongBetweenReference(variants, sample_size = len(vcf.sample_names))
             variants_divided['all'] = variants
             # filters applied here
             for group_name in variant_groups:
@@ -632,15 +1005,8 @@ class CallerGATK:
 
         print(self.genome_id)
 
-        genome_fna = 'genome_sequences/%s.fna' % self.genome_id
-
-        if not _os.path.exists(genome_fna):
-            records_to_write = []
-            for seq_id,seq_array in self.genome_sequence.items():
-                records_to_write += [_SeqRecord(_Seq(seq_array.tostring()), 
-                        id = seq_id, description = self.genome_names[seq_id])]
-            
-            _SeqIO.write(records_to_write, genome_fna, 'fasta')
+        genome_fna = _ReferenceCache().fasta(self.genome_id, 
+                self.genome_sequence, self.genome_names)
 
         jar = _os.path.sep.join(jar)
         local_variants_path = _os.path.sep.join(local_variants_path)
@@ -755,15 +1121,8 @@ class CallerGATK:
 
         print(self.genome_id)
 
-        genome_fna = 'genome_sequences/%s.fna' % self.genome_id
-
-        if not _os.path.exists(genome_fna):
-            records_to_write = []
-            for seq_id,seq_array in self.genome_sequence.items():
-                records_to_write += [_SeqRecord(_Seq(seq_array.tostring()), 
-                        id = seq_id, description = self.genome_names[seq_id])]
-            
-            _SeqIO.write(records_to_write, genome_fna, 'fasta')
+        genome_fna = _ReferenceCache().fasta(self.genome_id, 
+                self.genome_sequence, self.genome_names)
 
         jar = _os.path.sep.join(jar)
         local_variants_path = _os.path.sep.join(local_variants_path)
@@ -863,13 +1222,8 @@ class CallerGATK:
                                         local_variants_path,
                                         self.genome_id])
 
-        if not _os.path.exists(genome_fna):
-            records_to_write = []
-            for seq_id,seq_array in self.genome_sequence.items():
-                records_to_write += [_SeqRecord(_Seq(seq_array.tostring()), 
-                        id = seq_id, description = self.genome_names[seq_id])]
-            
-            _SeqIO.write(records_to_write, genome_fna, 'fasta')
+        genome_fna = _ReferenceCache().fasta(self.genome_id, 
+                self.genome_sequence, self.genome_names)
 
         e1 = 'Could not find "paths_to_raw_gVCFs" attribute. \
         Before starting performing joint GATK analysis, variants must be called. \
@@ -934,14 +1288,8 @@ class CallerGATK:
             force = False):
         
         jar = _os.path.sep.join(jar)
-        genome_fna = 'genome_sequences/%s.fna' % self.genome_id
-        if not _os.path.exists(genome_fna):
-            records_to_write = []
-            for seq_id,seq_array in self.genome_sequence.items():
-                records_to_write += [_SeqRecord(_Seq(seq_array.tostring()), 
-                        id = seq_id, description = self.genome_names[seq_id])]
-            
-            _SeqIO.write(records_to_write, genome_fna, 'fasta')
+        genome_fna = _ReferenceCache().fasta(self.genome_id, 
+                self.genome_sequence, self.genome_names)
 
         e1 = 'Could not find "path_to_unfiltered_VCF" attribute. \
         Before filtering, joint calling of variants is necessary. \
@@ -1023,14 +1371,8 @@ class CallerGATK:
             use_java = 'java',
             force = False):
         jar = _os.path.sep.join(jar)
-        genome_fna = 'genome_sequences/%s.fna' % self.genome_id
-        if not _os.path.exists(genome_fna):
-            records_to_write = []
-            for seq_id,seq_array in self.genome_sequence.items():
-                records_to_write += [_SeqRecord(_Seq(seq_array.tostring()), 
-                        id = seq_id, description = self.genome_names[seq_id])]
-            
-            _SeqIO.write(records_to_write, genome_fna, 'fasta')
+        genome_fna = _ReferenceCache().fasta(self.genome_id, 
+                self.genome_sequence, self.genome_names)
 
         e1 = 'Could not find "path_to_unfiltered_VCF" attribute. \
         Before filtering, joint calling of variants is necessary. \
@@ -1115,14 +1457,8 @@ class CallerGATK:
         '''
         jar = _os.path.sep.join(jar)
         samtools_exe = _os.path.sep.join(samtools_exe)
-        genome_fna = 'genome_sequences/%s.fna' % self.genome_id
-        if not _os.path.exists(genome_fna):
-            records_to_write = []
-            for seq_id,seq_array in self.genome_sequence.items():
-                records_to_write += [_SeqRecord(_Seq(seq_array.tostring()), 
-                        id = seq_id, description = self.genome_names[seq_id])]
-            
-            _SeqIO.write(records_to_write, genome_fna, 'fasta')
+        genome_fna = _ReferenceCache().fasta(self.genome_id, 
+                self.genome_sequence, self.genome_names)
 
         local_variants_path = _os.path.sep.join(local_variants_path)
         if not _os.path.exists(local_variants_path):
@@ -1244,6 +1580,7 @@ class CallerDiscoSNP:
             self.reads = reads_paths
             if genome:
                 self.genome_sequence = genome.sequence
+                self.genome_names = genome.names
                 self.genome_id = genome.id
         elif path_to_baga:
             with _tarfile.open(path_to_baga, "r:gz") as tar:
@@ -1383,18 +1720,21 @@ class CallerDiscoSNP:
         cmd['-T'] = None
 
         if hasattr(self, 'genome_sequence') and hasattr(self, 'genome_id'):
+            genome_sequence = self.genome_sequence
+            if not hasattr(genome_sequence, 'items'):
+                # saved with a single sequence
+                genome_sequence = {self.genome_id: genome_sequence}
             print('Will map DiscoSNP++ variants to {} ({:,} bp)'.format(
-                    self.genome_id, len(self.genome_sequence)))
+                    self.genome_id, sum(map(len, genome_sequence.values()))))
             if not path_to_bwa:
                 path_to_bwa = _get_exe_path('bwa')
             if _os.path.isfile(path_to_bwa):
                 # VCF maker only wants path to bwa exe, not the exe itself
                 path_to_bwa = path_to_bwa[:-4]
-            genome_fna = 'genome_sequences/%s.fna' % self.genome_id
-            if not _os.path.exists(genome_fna):
-                _SeqIO.write(_SeqRecord(_Seq(self.genome_sequence.tostring()), id = self.genome_id), 
-                        genome_fna, 
-                        'fasta')
+            # same sequences and descriptions as for the aligners and GATK so 
+            # the FASTA and its indexes are shared rather than rewritten
+            genome_fna = _ReferenceCache().fasta(self.genome_id, 
+                    genome_sequence, getattr(self, 'genome_names', {}))
             
             cmd['-G'] = [genome_fna]
             cmd['-B'] = [path_to_bwa]
@@ -1489,14 +1829,18 @@ class Summariser:
         all_headerdicts = {}
 
         for VCF in self.VCF_paths: #break
-            header, header_section_order, these_colnames, variantrows = parseVCF(VCF)
-            if len(variantrows) == 0:
+            vcf = VCFReader(VCF)
+            variantrows = vcf.fetch()
+            try:
+                first_row = next(variantrows)
+            except StopIteration:
                 print('WARNING: no variants found in {}'.format(VCF))
                 continue
-            headerdict = dictify_vcf_header(header)
+            headerdict = dictify_vcf_header(vcf.header)
             all_headerdicts[VCF] = headerdict
             #print(headerdict)
-            variants, allfilters = sortVariantsKeepFilter(header, these_colnames, variantrows)
+            variants, allfilters = sortVariantsKeepFilter(vcf.header, vcf.colnames, 
+                    _chain([first_row], variantrows))
             #print(variants)
             for sample,chromosomes in variants.items():
                 if sample not in all_variants:
@@ -1609,7 +1953,7 @@ class Summariser:
                                     "multi", "multi", "multi", multi_ORF_IDs, multi_ORF_names, "multi")
                         elif len(ORFs_info) == 1:
                             ORF_id,s,e,strand,gene_name = ORFs_info[0]
-                            ORF_seq = self.replicons[replicon_id]['sequence'][s:e].tostring()
+                            ORF_seq = str(self.replicons[replicon_id]['sequence'][s:e])
                             ORF0 = pos1 - 1 - s
                             ORF0_codon_start = ORF0 - ORF0 % 3
                             ref_codon = ORF_seq[ORF0_codon_start:ORF0_codon_start+3]
@@ -1772,10 +2116,10 @@ class Checker:
         all_variants = {}
 
         for VCF in self.VCF_paths: #break
-            header, header_section_order, these_colnames, variantrows = parseVCF(VCF)
-            headerdict = dictify_vcf_header(header)
+            vcf = VCFReader(VCF)
+            headerdict = dictify_vcf_header(vcf.header)
             #print(headerdict)
-            variants, allfilters = sortVariantsKeepFilter(header, these_colnames, variantrows)
+            variants, allfilters = sortVariantsKeepFilter(vcf.header, vcf.colnames, vcf)
             #print(variants)
             all_variants = dict(all_variants.items() + variants.items())
 
@@ -2153,6 +2497,34 @@ class Checker:
 
 
 
+class _RangeIndex(object):
+    '''
+    Sorted, merged ranges for bisect lookup of base-1 positions.
+
+    Ranges are (s, e) pairs of which s < pos1 <= e are included, as used by 
+    the Structure and Repeats modules for filtering.
+    '''
+    def __init__(self, ranges):
+        starts = []
+        ends = []
+        for s,e in sorted(ranges):
+            if len(starts) and s <= ends[-1]:
+                # overlapping or adjacent
+                ends[-1] = max(ends[-1], e)
+            else:
+                starts += [s]
+                ends += [e]
+        self.starts = starts
+        self.ends = ends
+
+    def __contains__(self, pos1):
+        # only the last range starting before pos1 might include it
+        i = _bisect_left(self.starts, pos1) - 1
+        return(i >= 0 and pos1 <= self.ends[i])
+
+    def __len__(self):
+        return(len(self.starts))
+
 class Filter:
     '''
     Methods to remove variant calls from VCFs according to position specific 
@@ -2225,6 +2597,40 @@ class Filter:
                 ('rearrangements1', 'rearrangements2'): 'baga genome rearrangements'
     }
 
+    def _mark_cells(self, cells, filter_id, sample_index = False):
+        '''
+        mark a split VCF row as failing filter_id, changing:
+            FILTER cell if sample_index = False (applies to all samples)
+            adding an entry to INFO describing which sample filtered if sample_index provided
+        '''
+        if sample_index is not False:
+            # applies just to this sample
+            infos = cells[7].split(';')
+            # ignore entries without an "="
+            infos = dict([i.split('=') for i in infos if '=' in i])
+            if filter_id in infos:
+                # add this sample index to existing of previously filtered samples at this position
+                new_filtered_index_list = list(map(int,infos[filter_id].split(','))) + [sample_index]
+                # could assert this sample not already filtered at this position . . .
+                # for now silently overwrite (!)
+                infos[filter_id] = ','.join(map(str,sorted(set(new_filtered_index_list))))
+            else:
+                # make new entry for this index
+                infos[filter_id] = str(sample_index)
+            
+            cells[7] = ';'.join(['='.join([k,v]) for k,v in sorted(infos.items())])
+        else:
+            # applies to all: change FILTER
+            filter_status = cells[6]
+            if filter_id in filter_status:
+                print('WARNING: {} already has {}'.format(cells[0], filter_id))
+            elif filter_status == 'PASS':
+                filter_status = filter_id
+            else:
+                filter_status = ';'.join(filter_status.split(';') + [filter_id])
+            
+            cells[6] = filter_status
+
     def apply_filter_by_ranges(self, variant_rows, ranges, filter_id, replicon_id, sample_index = False):
         '''
         return variant VCF rows changing:
@@ -2233,6 +2639,7 @@ class Filter:
 
         sample_index is base-0 index of sample column order
         '''
+        ranges = _RangeIndex(ranges)
         new_rows = []
         filtered = {}
         for row in variant_rows:
@@ -2242,47 +2649,10 @@ class Filter:
                 new_rows += [row]
                 continue
             pos1 = int(cells[1])
-            filter_status = cells[6]
-            info_cell = cells[7]
-            fail = False
-            for s, e in ranges:
-                if s < pos1 <= e:
-                    # this variant is within region to reject
-                    fail = True
-                    break
-            
-            if fail: #break
+            if pos1 in ranges:
+                # this variant is within region to reject
                 filtered[pos1] = cells[3:5]
-                if sample_index is not False:
-                    # applies just to this sample
-                    infos = info_cell.split(';')
-                    # ignore entries without an "="
-                    infos = dict([i.split('=') for i in infos if '=' in i])
-                    if filter_id in infos:
-                        # add this sample index to existing of previously filtered samples at this position
-                        new_filtered_index_list = map(int,infos[filter_id].split(',')) + [sample_index]
-                        # could assert this sample not already filtered at this position . . .
-                        # for now silently overwrite (!)
-                        infos[filter_id] = ','.join(map(str,sorted(set(new_filtered_index_list))))
-                    else:
-                        # make new entry for this index
-                        infos[filter_id] = str(sample_index)
-                    
-                    info_cell = ';'.join(['='.join([k,v]) for k,v in sorted(infos.items())])
-                    cells[7] = info_cell
-                else:
-                    # applies to all: change FILTER
-                    if filter_id in filter_status:
-                        print('WARNING: {} already has {}'.format(cells[0], filter_id))
-                    elif filter_status == 'PASS':
-                        filter_status = filter_id
-                    else:
-                        filter_status = ';'.join(filter_status.split(';') + [filter_id])
-                    
-                    cells[6] = filter_status
-                    
-                #print(filter_id,pos1,s,e,cells[6],info_cell.split(';')[-1])
-                
+                self._mark_cells(cells, filter_id, sample_index)
                 new_rows += ['\t'.join(cells)]
             else:
                 new_rows += [row]
@@ -2292,22 +2662,26 @@ class Filter:
     def markVariants(self, filters_to_apply):
         '''
         Given details of one or more filter to apply, write new VCFs with variants marked
+
+        Each VCF is read once and all filters for all samples are applied to 
+        each row as it is streamed to a single new VCF. The new VCF has a 
+        '__F_<filter>' suffix for each filter applied.
         '''
 
         all_filtered = {}
         for VCF_path in self.VCF_paths:
             all_filtered[VCF_path] = {}
-            use_VCF_path = VCF_path
+            vcf = VCFReader(VCF_path)
+            header = vcf.header
+            header_section_order = vcf.header_section_order
+            sample_order = vcf.sample_names
+            print('Applying {} filter(s) to variants in:\n{}'.format(
+                    ', '.join(filters_to_apply), VCF_path))
+            # per replicon: [(filter_id, sample_index, ranges, filtered), ...]
+            # in the order they should be applied to each row
+            lookups = _defaultdict(list)
             for filter_id, replicons in filters_to_apply.items(): #break
-                # new VCF with suffix saved for each filter applied
-                print('Applying {} filter to variants in:\n{}'.format(filter_id, use_VCF_path))
-                header, header_section_order, colnames, variants = parseVCF(use_VCF_path)
-                print('{} variant positions found'.format(len(variants)))
-                #print('variants',variants)
-                sample_order = colnames[9:]
                 these_filtered = {}
-                # filter_id = 'rearrangements'
-                # filter_info = filters_to_apply[filter_id]
                 if self.known_filters[filter_id]['per_sample']:
                     infos_to_add = set()
                     for replicon_id,all_ranges in replicons.items():
@@ -2317,56 +2691,75 @@ class Filter:
                             # try all samples in all vcfs to handle either scenario
                             if sample in sample_order:
                                 these_filtered[replicon_id][sample] = {}
+                                sample_index = sample_order.index(sample)
                                 if isinstance(ranges, dict):
                                     # sometimes 'extended' versions of filters e.g., no or few reads adjacent to disrupted regions
                                     # add as filtername1, filtername2 etc
                                     for n,(filter_variant,these_ranges) in enumerate(sorted(ranges.items())): #break
-                                        # variants list of rows gets iteratively added to per sample
-                                        variants, filtered = self.apply_filter_by_ranges(variants, 
-                                                                                    these_ranges, 
-                                                                                    filter_id+str(n+1), 
-                                                                                    replicon_id, 
-                                                                                    sample_index = sample_order.index(sample))
-                                        
-                                        # manually check that changes were applied
-                                        #[t.split('\t')[:8] for t in variants if int(t.split('\t')[1]) in filtered]
+                                        filtered = {}
+                                        lookups[replicon_id] += [(filter_id+str(n+1), 
+                                                sample_index, _RangeIndex(these_ranges), filtered)]
                                         infos_to_add.add(self.known_filters[filter_id]['string'][n])
                                         these_filtered[replicon_id][sample][filter_id+str(n+1)] = filtered
-                                        
                                 else:
                                     # one set of filter ranges, per sample
-                                    variants, filtered = self.apply_filter_by_ranges(variants, 
-                                                                                ranges, 
-                                                                                filter_id, 
-                                                                                replicon_id, 
-                                                                                sample_index = sample_order.index(sample))
-                                    infos_to_add.add(self.known_filters[filter_id]['string'])
+                                    filtered = {}
+                                    lookups[replicon_id] += [(filter_id, sample_index, 
+                                            _RangeIndex(ranges), filtered)]
+                                    infos_to_add.add(self.known_filters[filter_id]['string'][0])
                                     these_filtered[replicon_id][sample] = filtered
                     # add filter info as INFO
-                    header['INFO'] += list(infos_to_add)
+                    header['INFO'] += sorted(infos_to_add)
                 else:
                     # just a single reference-genome specific filter to be applied to all samples via the FILTER property
                     for replicon_id,all_ranges in replicons.items():
-                        variants, filtered = self.apply_filter_by_ranges(variants, all_ranges, filter_id, replicon_id)
+                        filtered = {}
+                        lookups[replicon_id] += [(filter_id, False, _RangeIndex(all_ranges), 
+                                filtered)]
                         # record filtered positions per sample even though determined by reference genome
                         these_filtered[replicon_id] = dict([(sample,filtered) for sample in sample_order])
-                        header['FILTER'] += self.known_filters[filter_id]['string']
+                    if 'FILTER' not in header:
+                        header['FILTER'] = []
+                        header_section_order += ['FILTER']
+                    for header_string in self.known_filters[filter_id]['string']:
+                        if header_string not in header['FILTER']:
+                            header['FILTER'] += [header_string]
                 
                 all_filtered[VCF_path][filter_id] = these_filtered
-                
-                newname = _os.path.extsep.join((use_VCF_path.split(_os.path.extsep)[:-1]))
-                newname = _os.path.extsep.join([newname + '__F_' + filter_id, use_VCF_path.split(_os.path.extsep)[-1]])
-                print('Writing all variants with filter information to:\n{}'.format(newname))
-                new_VCF_content = []
+            
+            if vcf.compressed and VCF_path.endswith('.gz'):
+                # filtered VCF is written uncompressed
+                use_VCF_path = VCF_path[:-len('.gz')]
+            else:
+                use_VCF_path = VCF_path
+            newname = _os.path.extsep.join((use_VCF_path.split(_os.path.extsep)[:-1]))
+            newname = _os.path.extsep.join([newname + ''.join(['__F_' + filter_id for \
+                    filter_id in filters_to_apply]), use_VCF_path.split(_os.path.extsep)[-1]])
+            print('Writing all variants with filter information to:\n{}'.format(newname))
+            num_rows = 0
+            with open(newname, 'w') as fout:
                 for header_section in header_section_order:
-                    new_VCF_content += ['\n'.join(header[header_section])]
+                    fout.write('\n'.join(header[header_section]) + '\n')
                 
-                new_VCF_content += ['\t'.join(colnames)]
-                new_VCF_content += ['\n'.join(variants)]
-                new_VCF_content = '\n'.join(new_VCF_content)
-                
-                open(newname, 'w').write(new_VCF_content)
-                use_VCF_path = newname
+                fout.write('\t'.join(vcf.colnames) + '\n')
+                for row in vcf.rows():
+                    num_rows += 1
+                    replicon_id = row[:row.index('\t')]
+                    if replicon_id in lookups:
+                        cells = row.split('\t')
+                        pos1 = int(cells[1])
+                        marked = False
+                        for filter_id, sample_index, ranges, filtered in lookups[replicon_id]:
+                            if pos1 in ranges:
+                                # this variant is within region to reject
+                                filtered[pos1] = cells[3:5]
+                                self._mark_cells(cells, filter_id, sample_index)
+                                marked = True
+                        if marked:
+                            row = '\t'.join(cells)
+                    fout.write(row + '\n')
+            
+            print('{} variant positions found'.format(num_rows))
 
         self.all_filtered = all_filtered
 
@@ -2465,7 +2858,7 @@ class Filter:
         for VCF in self.VCF_paths: #break
             match_fails = []
             replicons = {}
-            for line in open(VCF):
+            for line in VCFReader(VCF).header.get('contig', []):
                 if line.startswith('##contig='):
                     try:
                         replicon_id, replicon_length = _re.match(pattern, line).groups()
@@ -2495,8 +2888,7 @@ class Filter:
             raise LookupError('None of provided filters known . . .')
 
 
-        # this loads VCF, marks variants and writes new VCF
-        # could definitely streamline to get here quicker <=========
+        # this streams each VCF once, marks variants and writes new VCF
         self.markVariants(filters_to_apply)
 
         self.reportFiltered()
@@ -2620,11 +3012,11 @@ class Linkage:
         pooled_variants = {}
 
         for VCF in self.VCF_paths:
-            header, header_section_order, colnames, variants = parseVCF(VCF)
-            headerdict = dictify_vcf_header(header)
+            vcf = VCFReader(VCF)
+            headerdict = dictify_vcf_header(vcf.header)
             these_variants = {}
-            for variantline in variants:
-                chrm, pos, x, ref_char, alt_chars, s, filter_status, info1, info2keys, info2values = variantline.rstrip().split('\t')
+            for record in vcf:
+                chrm, pos, x, ref_char, alt_chars, s, filter_status, info1, info2keys, info2values = record.cells
                 if filter_status == 'PASS':
                     # parse VCF line
                     info1_extra = set([a for a in info1.split(';') if '=' not in a])
@@ -27,9 +27,25 @@ from a the Internet via a URL or from a local path.
 
 # stdlib
 from ftplib import FTP as _FTP
+from ftplib import error_reply as _error_reply
+from ftplib import error_perm as _error_perm
+from ftplib import error_temp as _error_temp
 from time import sleep as _sleep
-import urllib2 as _urllib2
+try:
+    import urllib2 as _urllib2
+    from urlparse import urlparse as _urlparse
+except ImportError:
+    import urllib.request as _urllib2
+    from urllib.parse import urlparse as _urlparse
 from glob import glob as _glob
+from io import TextIOWrapper as _TextIOWrapper
+from io import BytesIO as _BytesIO
+from io import BufferedReader as _BufferedReader
+from io import RawIOBase as _RawIOBase
+try:
+    from queue import Queue as _Queue
+except ImportError:
+    from Queue import Queue as _Queue
 
 # not sure if there is any advantage in going via the package __init__.py for 
 # widely used imports
@@ -44,8 +60,16 @@ from baga import _StringIO
 from baga import _array
 from baga import _time
 from baga import _md5
+from baga import _zlib
+from baga import _threading
+from baga import _urlopen
+from baga import _URLError
 
 from baga import report_time as _report_time
+from baga import decide_max_processes as _decide_max_processes
+from baga.ReadStats import ReadStatsIndex as _ReadStatsIndex
+from baga import Features as _Features
+from baga.Sequence import GenomeSequence as _GenomeSequence
 from baga import MetaSample as _MetaSample
 from baga import PROGRESS
 from baga import PY3 as _PY3
@@ -423,6 +447,62 @@ class Genome_old:
                     thisone = _tarfile.TarInfo(name = att_name)
                     thisone.size = length
                     tar.addfile(tarinfo = thisone, fileobj = io)
+class _StreamTee(_RawIOBase):
+    '''
+    Read-only stream passing every block read to callbacks e.g., the update 
+    method of a hash or the write method of a file.
+
+    If gunzip, blocks are passed to callbacks as read but decompressed from 
+    gzip for reading. Unlike GzipFile, this never seeks so works on a 
+    download in Python 2.
+    '''
+    def __init__(self, fileobj, callbacks, gunzip = False):
+        self.fileobj = fileobj
+        self.callbacks = callbacks
+        self.decompressor = None
+        if gunzip:
+            self.decompressor = _zlib.decompressobj(16 + _zlib.MAX_WBITS)
+        self.pending = b''
+    
+    def readable(self):
+        return(True)
+    
+    def _read(self, size):
+        data = self.fileobj.read(size)
+        for callback in self.callbacks:
+            callback(data)
+        return(data)
+    
+    def _decompress(self, size):
+        data = self.pending
+        while not data:
+            compressed = self._read(size)
+            if not compressed:
+                return(self.decompressor.flush())
+            while compressed:
+                data += self.decompressor.decompress(compressed)
+                # any more gzip members are concatenated
+                compressed = self.decompressor.unused_data.lstrip(b'\x00')
+                if compressed:
+                    self.decompressor = _zlib.decompressobj(16 + _zlib.MAX_WBITS)
+        return(data)
+    
+    def readinto(self, b):
+        if self.decompressor is None:
+            data = self._read(len(b))
+        else:
+            data = self._decompress(len(b))
+            data, self.pending = data[:len(b)], data[len(b):]
+        n = len(data)
+        b[:n] = data
+        return(n)
+    
+    def drain(self, block_size = 2**20):
+        '''read to the end so all data has passed to callbacks'''
+        while self.read(block_size):
+            pass
+
+
 class Genome(_MetaSample):
     '''
     Collect one or more chromosome sequences from the Internet or a local path
@@ -753,18 +833,94 @@ class Genome(_MetaSample):
         # collect next
         uid,info = sorted(self.assemblies_info.items())[0]
         del self.assemblies_info[uid]
+        fetched = self._fetchAssembly(uid, info, 
+                include_complete = include_complete, 
+                include_scaffolds = include_scaffolds, 
+                include_contigs = include_contigs, refseq_only = refseq_only, 
+                force = force, retain_gbk = retain_gbk, 
+                use_genome_identifier = use_genome_identifier, path = path)
+        return(self._useAssembly(fetched))
+
+    def downloadAssemblies(self, max_workers = 4, include_complete = True, 
+            include_scaffolds = True, include_contigs = True,
+            refseq_only = False, force = False, retain_gbk = False, 
+            path = '.'):
+        '''
+        Download all genomes in the dict generated by queryEntrezAssembly()
+
+        A parallel version of repeated calls to downloadNextAssembly(): up to 
+        max_workers genomes are downloaded and parsed concurrently, each 
+        streamed as for downloadNextAssembly(). This is a generator which, 
+        as each genome is ready, sets the genome information as attributes 
+        (so `saveLocal()` can be called) and yields the genome identifier. 
+        Genomes are ready in the order they finish rather than sorted.
+
+        Parameters are as for downloadNextAssembly().
+
+        Raises
+        ------
+        As for downloadNextAssembly() except StopIteration: the generator 
+        ends when all genomes have been processed. Errors raised while 
+        fetching a genome are raised here when it would have been ready.
+        '''
+        to_fetch = sorted(self.assemblies_info.items())
+        self.assemblies_info = {}
+        # bounded so only a few parsed genomes wait in memory
+        ready = _Queue(max_workers)
+        lock = _threading.Lock()
+        
+        def worker():
+            while True:
+                with lock:
+                    if not to_fetch:
+                        return
+                    uid,info = to_fetch.pop(0)
+                try:
+                    ready.put((True, self._fetchAssembly(uid, info, 
+                            include_complete = include_complete, 
+                            include_scaffolds = include_scaffolds, 
+                            include_contigs = include_contigs, 
+                            refseq_only = refseq_only, force = force, 
+                            retain_gbk = retain_gbk, path = path)))
+                except Exception as e:
+                    ready.put((False, e))
+        
+        total = len(to_fetch)
+        threads = [_threading.Thread(target = worker) for i in \
+                range(min(max_workers, total))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        
+        for n in range(total):
+            success, fetched = ready.get()
+            if not success:
+                raise fetched
+            yield(self._useAssembly(fetched))
+
+    def _fetchAssembly(self, uid, info, include_complete = True, 
+            include_scaffolds = True, include_contigs = True,
+            refseq_only = False, force = False, retain_gbk = False,
+            use_genome_identifier = False, path = '.'):
+        '''
+        Download and parse a genome for downloadNextAssembly() and 
+        downloadAssemblies() without changing attributes so several can run 
+        at once.
+
+        returns dict of information for _useAssembly()
+        '''
         # this could be over-ridden
         if use_genome_identifier:
             genome_identifier = use_genome_identifier
         else:
             genome_identifier = info['AssemblyAccession']
 
+        fetched = {'genome_identifier': genome_identifier, 'file_name': False}
         if refseq_only and info['collection'] == 'GenBank':
             self.logger.info('Not downloading GenBank only assembly for uid:{}, '\
                     'accession:{}, organism:{}'.format(uid, 
                     info['AssemblyAccession'], info['Organism']))
-            self.file_name = False
-            return(genome_identifier)
+            return(fetched)
         elif any([
                 (not include_complete and info['AssemblyStatus'] == 'Complete Genome'),
                 (not include_scaffolds and info['AssemblyStatus'] == 'Scaffold'),
@@ -772,81 +928,117 @@ class Genome(_MetaSample):
             self.logger.info('Not downloading because AssemblyStatus is "{}" for '\
                     'uid:{}, accession:{}, organism:{}'.format(info['AssemblyStatus'], 
                     uid, info['AssemblyAccession'], info['Organism']))
-            self.file_name = False
-            return(genome_identifier)
-        else:
-            use_filename = '{}.{}-{}.baga'.format(__name__, type(self).__name__, 
-                    genome_identifier)
-            use_path = _os.path.sep.join([path,use_filename])
-            if _os.path.exists(use_path) and \
-                    _os.path.getsize(use_path) > 0 and not force:
-                self.logger.info('File for {} already exists and force = False: '\
-                        'not downloading. Use force = True to download again'\
-                        ''.format(use_path))
-                self.file_name = False
-                return(genome_identifier)
-            # download checksums
-            self.logger.info('Downloading checksum from: {}'.format(
-                    info['url'] + '/md5checksums.txt'))
-            data = self._DL(info['url'] + '/md5checksums.txt', verbose = False)
-            try:
-                checksum = [l.decode('utf-8').split('  ./') for l in \
-                        data.readlines() if '_genomic.gbff.gz' in \
-                        l.decode('utf-8')][0][0]
-            except ValueError as e:
-                error = 'Problem parsing checksum for {}: {}'\
-                        ''.format(uid, data.read().decode('utf-8'))
-                self.logger.error(error)
-                # return uid with error message as part of `args` attribute
-                raise IOError(error, uid)
-            
-            # download sequences and annotations
-            use_link = info['url'] + '/' + info['url'].split('/')[-1] + \
-                    '_genomic.gbff.gz'
-            self.logger.info('Downloading sequence data from:\n{}'.format(use_link))
-            data = self._DL(use_link, verbose = True)
-            hasher = _md5()
-            buff = data.read(65536)
-            while len(buff) > 0:
-                hasher.update(buff)
-                buff = data.read(65536)
-            
-            # raise some other error here? ValueError?
-            if hasher.hexdigest() != checksum:
-                error = 'checksum fail!'
-                self.logger.error(error)
-                self.file_name = False
-                raise ValueError(error, uid)
-            
-            self.logger.log(PROGRESS, '. . . checksum {} passed!'.format(checksum))
-            
+            return(fetched)
+
+        use_filename = '{}.{}-{}.baga'.format(__name__, type(self).__name__, 
+                genome_identifier)
+        use_path = _os.path.sep.join([path,use_filename])
+        if _os.path.exists(use_path) and \
+                _os.path.getsize(use_path) > 0 and not force:
+            self.logger.info('File for {} already exists and force = False: '\
+                    'not downloading. Use force = True to download again'\
+                    ''.format(use_path))
+            return(fetched)
+        # download checksums
+        self.logger.info('Downloading checksum from: {}'.format(
+                info['url'] + '/md5checksums.txt'))
+        data = self._DL(info['url'] + '/md5checksums.txt', verbose = False)
+        try:
+            checksum = [l.decode('utf-8').split('  ./') for l in \
+                    data.readlines() if '_genomic.gbff.gz' in \
+                    l.decode('utf-8')][0][0]
+        except (ValueError, IndexError) as e:
             data.seek(0)
+            error = 'Problem parsing checksum for {}: {}'\
+                    ''.format(uid, data.read().decode('utf-8'))
+            self.logger.error(error)
+            # return uid with error message as part of `args` attribute
+            raise IOError(error, uid)
+        
+        # download, check and parse sequences and annotations in one pass
+        use_link = info['url'] + '/' + info['url'].split('/')[-1] + \
+                '_genomic.gbff.gz'
+        self.logger.info('Downloading sequence data from:\n{}'.format(use_link))
+        if retain_gbk:
+            gbk_filename = use_link.split('/')[-1].replace('.gz','')
+            self.logger.info('Also writing genbank file to {}.'.format(
+                    gbk_filename))
+        else:
+            gbk_filename = False
+        try:
+            fetched['genome'] = self._streamGBK(use_link, checksum, 
+                    gbk_filename = gbk_filename)
+        except ValueError as e:
+            raise ValueError(e.args[0], uid)
+        
+        self.logger.log(PROGRESS, '. . . checksum {} passed!'.format(checksum))
+        fetched['file_name'] = use_filename
+        fetched['source'] = use_link
+        fetched['organism'] = info['Organism']
+        return(fetched)
+
+    def _useAssembly(self, fetched):
+        '''
+        Set attributes for a genome from _fetchAssembly() ready for saveLocal()
+
+        returns genome identifier
+        '''
+        self.file_name = fetched['file_name']
+        if fetched['file_name']:
+            self.sequence, self.annotations, self.names = fetched['genome']
+            self.logger.debug('will use filename: {}'.format(self.file_name))
+            self.sample_name = fetched['genome_identifier']
+            self.source = fetched['source']
+            self.organism = fetched['organism']
+        return(fetched['genome_identifier'])
+
+    def _streamGBK(self, url, checksum, gbk_filename = False):
+        '''
+        Download, check and parse a gzipped GenBank file in one pass
+
+        The download is passed through an MD5 hash, decompressed and parsed 
+        as it arrives, optionally writing the decompressed file to 
+        gbk_filename, so memory use does not depend on the size of the file.
+
+        returns (sequence, annotations, names) as set by loadFromGBK()
+
+        Raises
+        ------
+        ValueError
+            If the MD5 checksum does not match (after parsing)
+        _URLError
+            If a download fails
+        '''
+        hasher = _md5()
+        compressed = _StreamTee(_urlopen(url), [hasher.update], gunzip = True)
+        decompressed = _BufferedReader(compressed)
+        tees = [compressed]
+        fout = None
+        if gbk_filename:
+            fout = open(gbk_filename, 'wb')
+            tees.insert(0, _StreamTee(decompressed, [fout.write]))
+            decompressed = _BufferedReader(tees[0])
+        try:
             if _PY3:
-                gbk_content = _TextIOWrapper(_gzip.GzipFile(mode="rb", fileobj = data), 
-                        encoding = 'utf-8')
+                content = _TextIOWrapper(decompressed, encoding = 'utf-8')
             else:
-                gbk_content = _gzip.GzipFile(mode="rb", fileobj = data)
-                        #encoding = 'utf-8')
-            self.loadFromGBK(gbk_content)
-            if retain_gbk:
-                gbk_content.seek(0)
-                gbk_filename = use_link.split('/')[-1].replace('.gz','')
-                self.logger.info('Also writing {}'.format(gbk_filename))
-                try:
-                    self.logger.info('Writing genbank file to {}.'\
-                            ''.format(gbk_filename))
-                    open(gbk_filename, 'w').write(gbk_content.read())
-                except OSError:
-                    self.logger.warning('Seems like writing {} failed. '\
-                            'Continuing with any others for download.'\
-                            ''.format(gbk_filename))
-            
-            self.file_name = use_filename
-            self.logger.debug('will use filename: {}'.format(self.file_name))
-            self.sample_name = genome_identifier
-            self.source = use_link
-            self.organism = info['Organism']
-            return(genome_identifier)
+                content = decompressed
+            parsed = self._parseGBK(content)
+            # ensure all data has been hashed (and written)
+            for tee in tees:
+                tee.drain()
+        finally:
+            if fout is not None:
+                fout.close()
+        
+        if hasher.hexdigest() != checksum:
+            error = 'checksum fail!'
+            self.logger.error(error)
+            if gbk_filename:
+                _os.unlink(gbk_filename)
+            raise ValueError(error)
+        
+        return(parsed)
 
 
     def downloadFromList(self, accs_urls_dict, force = False, retain_gbk = False,
@@ -1015,48 +1207,29 @@ class Genome(_MetaSample):
                 self.logger.warning(error)
                 continue
             
-            # download sequences and annotations
+            # download, check and parse sequences and annotations in one pass
             self.logger.info('Downloading sequence data from: {}'.format(url))
+            if retain_gbk:
+                gbk_filename = url.split('/')[-1].replace('.gz','')
+                if path != '.':
+                    gbk_filename = _os.path.sep.join([path,gbk_filename])
+                self.logger.info('Also writing genbank file to {}.'.format(
+                        gbk_filename))
+            else:
+                gbk_filename = False
             try:
-                data = self._DL(url, verbose = True)
+                self.sequence, self.annotations, self.names = self._streamGBK(
+                        url, checksum, gbk_filename = gbk_filename)
             except _URLError:
                 self.logger.warning('Skipping {} - failed to download '\
-                        'sequence data from: {}'.format(accession, md5_url))
+                        'sequence data from: {}'.format(accession, url))
+                continue
+            except ValueError:
+                self.logger.warning('Skipping {} - checksum of data from {} '\
+                        'did not match'.format(accession, url))
                 continue
-            hasher = _md5()
-            buff = data.read(65536)
-            while len(buff) > 0:
-                hasher.update(buff)
-                buff = data.read(65536)
-            
-            # raise some other error here? ValueError?
-            if hasher.hexdigest() != checksum:
-                error = 'checksum fail!'
-                self.logger.error(error)
-                self.file_name = False
-                raise ValueError(error, uid)
             
             self.logger.log(PROGRESS, '. . . checksum {} passed!'.format(checksum))
-            data.seek(0)
-            gbk_content = _TextIOWrapper(_gzip.GzipFile(mode="rb", fileobj = data), 
-                    encoding = 'utf-8')
-            self.loadFromGBK(gbk_content)
-            if retain_gbk:
-                gbk_content.seek(0)
-                gbk_filename = url.split('/')[-1].replace('.gz','')
-                self.logger.info('Also writing {}'.format(gbk_filename))
-                try:
-                    self.logger.info('Writing genbank file to {}.'\
-                            ''.format(gbk_filename))
-                    open(gbk_filename, 'w').write(gbk_content.read())
-                    if path != '.':
-                        new_path = _os.path.sep([path,gbk_filename])
-                        self.logger.log(PROGRESS, 'Moving to new path: {}'.format(new_path))
-                        _os.rename(use_filename, new_path)
-                except OSError:
-                    self.logger.warning('Seems like writing {} failed. '\
-                            'Continuing with any others for download.'\
-                            ''.format(gbk_filename))
             self.file_name = use_filename
             self.logger.debug('will use filename: {}'.format(self.file_name))
             self.sample_name = accession
@@ -1132,7 +1305,7 @@ class Genome(_MetaSample):
         data.seek(0)
         loci = {}
         try:
-            for rec in _SeqIO.parse(data,'genbank'):
+            for rec in _Features.read_genbank(data):
                 accession = rec.id
                 loci[rec.id] = self._extractLoci(rec)
         except ValueError as error_message:
@@ -1153,10 +1326,10 @@ class Genome(_MetaSample):
         seqs = {}
         names = {}
         try:
-            for rec in _SeqIO.parse(data,'fasta'):
-                accession = rec.id.split('|')[3]
-                seqs[accession] = _array('u', str(rec.seq))
-                names[accession] = rec.description
+            for rec_id, description, seq in _Features.read_fasta(data):
+                accession = rec_id.split('|')[3]
+                seqs[accession] = _GenomeSequence(seq)
+                names[accession] = description
         except ValueError as error_message:
             error = "There was a problem with the genome sequence as fasta "\
                     "(accession: {}) downloaded from NCBI via Entrez: {}. Retry "\
@@ -1198,10 +1371,12 @@ class Genome(_MetaSample):
 
     def loadFromGBK(self, data):
         '''
-        Load an annotated genome sequence from a genbank file-like object.
+        Load an annotated genome sequence from a genbank (or GFF3 with 
+        sequences in a ##FASTA section) file-like object.
 
         The attributes: "sequence", "annotations" and "names" are populated 
-        which are dicts with an entry for each replicon or contig. The 
+        which are dicts with an entry for each replicon or contig, sequences 
+        being Sequence.GenomeSequence objects. The 
         attributes "file_name", "source" and "sample_name" are not populated
         but are required by most other methods and functions so should be 
         defined.
@@ -1212,31 +1387,33 @@ class Genome(_MetaSample):
         Parameters
         ----------
         data: str or file
-            The file-like object can be a local path, a file handle or a 
-            file-like object such as generated by the io or StringIO modules
-            because BioPython deals with that internally.
+            The file-like object can be a local path (optionally gzipped), a 
+            file handle or a file-like object such as generated by the io or 
+            StringIO modules.
         '''
-        records = _SeqIO.parse(data, 'genbank')
+        self.sequence, self.annotations, self.names = self._parseGBK(data)
+
+    def _parseGBK(self, data):
+        '''
+        Parse a genbank file-like object for loadFromGBK()
+
+        returns (sequence, annotations, names) dicts
+        '''
+        records = _Features.read_features(data)
         seqs = {}
         loci = {}
         names = {}
         c = 0
-        #could catch UnicodeDecodeError and maybe others for failed BioPython parsing?
-        if _PY3:
-            arraytype = 'u'
-        else:
-            arraytype = 'c'
-
         for seq_record in records:
             ORF_ranges, rRNA_ranges, large_mobile_element_ranges, \
                     ordinate_offset = self._extractLoci(seq_record)
             if ordinate_offset:
                 # shift starting character so as not to span a feature
-                use_seq = str(seq_record.seq[-ordinate_offset:]) + \
-                        str(seq_record.seq[:-ordinate_offset])
-                seqs[seq_record.id] = _array(arraytype, use_seq)
+                use_seq = seq_record.seq[-ordinate_offset:] + \
+                        seq_record.seq[:-ordinate_offset]
+                seqs[seq_record.id] = _GenomeSequence(use_seq)
             else:
-                seqs[seq_record.id] = _array(arraytype, str(seq_record.seq))
+                seqs[seq_record.id] = _GenomeSequence(seq_record.seq)
             loci[seq_record.id] = ORF_ranges, rRNA_ranges, \
                     large_mobile_element_ranges
             names[seq_record.id] = seq_record.description
@@ -1245,9 +1422,7 @@ class Genome(_MetaSample):
             c += 1
 
         self.logger.log(PROGRESS, '{} records in genbank data {}'.format(c,data))
-        self.sequence = seqs
-        self.annotations = loci
-        self.names = names
+        return(seqs, loci, names)
 
     def loadFrombaga(self, local_path):
         '''
@@ -1268,7 +1443,7 @@ class Genome(_MetaSample):
 
     def _extractLoci(self, seq_record):
         '''
-        Extract some ORF and rRNA locus information from genbank record 
+        Extract some ORF and rRNA locus information from a Features.Record
         and put into convenient dictionaries. Checks for features spanning
         start/end of circular sequences and applies an offset so the 
         start < end and start == 0.
@@ -1294,18 +1469,16 @@ class Genome(_MetaSample):
                 except KeyError:
                     thisgene = ''
                 
-                if len(f.location.parts) == 2:
-                    if f.location.parts[0].start.position == 0 and \
-                            f.location.parts[1].end.position == len(seq_record.seq):
+                if len(f.parts) == 2:
+                    (s0, e0, strand0), (s1, e1, strand1) = f.parts
+                    if s0 == 0 and e1 == len(seq_record.seq):
                         # this feature spans 0 on chromosome sequence in file
                         # will use an offset to simplify feature access
                         # by removing overlap <== not currently implemented for
                         # rRNA or misc_features
-                        s = f.location.parts[1].start.position
-                        e = f.location.parts[1].end.position
-                        ordinate_offset = e - s
+                        ordinate_offset = e1 - s1
                         s = 0
-                        e = f.location.parts[0].end.position + ordinate_offset
+                        e = e0 + ordinate_offset
                         self.logger.info('Compound feature ({}) across start '\
                                 'of sequence {} detected. All ordinates will '\
                                 'include an offset'.format(
@@ -1316,10 +1489,10 @@ class Genome(_MetaSample):
                                 f.qualifiers['locus_tag'][0]))
                         continue
                 else:
-                    s = f.location.start.position + ordinate_offset
-                    e = f.location.end.position + ordinate_offset
+                    s = f.start + ordinate_offset
+                    e = f.end + ordinate_offset
                 ORF_ranges[f.qualifiers['locus_tag'][0]] = (s, e, 
-                        f.location.strand, thisgene)
+                        f.strand, thisgene)
             
             if f.type == 'rRNA':
                 try:
@@ -1329,8 +1502,8 @@ class Genome(_MetaSample):
                 except KeyError:
                     thisgene = ''
                 
-                rRNA_ranges[f.qualifiers['locus_tag'][0]] = (f.location.start.position,
-                        f.location.end.position,f.location.strand, thisgene)
+                rRNA_ranges[f.qualifiers['locus_tag'][0]] = (f.start, f.end, 
+                        f.strand, thisgene)
             
             if f.type == 'misc_feature':
                 try:
@@ -1340,26 +1513,36 @@ class Genome(_MetaSample):
                     continue
                 
                 if _re.search(GI_prophage, feature_note) and \
-                        f.location.nofuzzy_end - f.location.nofuzzy_start > 10000:
+                        f.end - f.start > 10000:
                     large_mobile_element_ranges[f.qualifiers['note'][0]] = (
-                            f.location.nofuzzy_start + ordinate_offset, 
-                            f.location.nofuzzy_end + ordinate_offset)
+                            f.start + ordinate_offset, 
+                            f.end + ordinate_offset)
         
         # filter ORFs within ORFs (artifacts? PLES_21351 and PLES_21361 in LESB58)
+        # single sweep in order of start: an ORF is within another if an ORF 
+        # starting strictly before it ends strictly after it
         ORF_ranges_sorted = sorted(ORF_ranges.items(), key = lambda x: x[1][0])
         inner_ORFs = set()
-        for n, (ORF1, (s1, e1, strnd1, genename1)) in enumerate(ORF_ranges_sorted[:-1]):
-            for ORF2, (s2, e2, strnd2, genename2) in ORF_ranges_sorted[(n+1):]:
-                if s1 < s2 and e2 < e1:
+        # furthest reaching ORF among those starting before the current start
+        outer = None
+        n = 0
+        while n < len(ORF_ranges_sorted):
+            start = ORF_ranges_sorted[n][1][0]
+            same_start = []
+            while n < len(ORF_ranges_sorted) and \
+                    ORF_ranges_sorted[n][1][0] == start:
+                same_start += [ORF_ranges_sorted[n]]
+                n += 1
+            for ORF2, (s2, e2, strnd2, genename2) in same_start:
+                if outer is not None and e2 < outer[1][1]:
+                    ORF1, (s1, e1, strnd1, genename1) = outer
                     self.logger.log(PROGRESS, '{} ({}, {}-{}) is within {} '\
                             '({}, {}-{}); dumping former'.format(ORF2, genename2, 
                             s2, e2, ORF1, genename1, s1, e1))
                     inner_ORFs.add(ORF2)
-                if s2 < s1 and e1 < e2:
-                    self.logger.log(PROGRESS, '{} ({}, {}-{}) is within {} '\
-                            '({}, {}-{}); dumping former'.format(ORF1, genename1, 
-                            s1, e1, ORF2, genename2, s2, e2))
-                    inner_ORFs.add(ORF1)
+            for ORF_range in same_start:
+                if outer is None or ORF_range[1][1] > outer[1][1]:
+                    outer = ORF_range
         
         for ORF in inner_ORFs:
             del ORF_ranges[ORF]
@@ -1371,14 +1554,13 @@ class Genome(_MetaSample):
 
     def _DL(self, url, verbose = True):
         CHUNK = 16 * 1024 * 32
+        req = _urlopen(url)
         if _PY3:
-            req = _request.urlopen(url)
             data = _BytesIO()
         else:
-            req = _urllib2.urlopen(url)
             data = _StringIO()
         c = 0
-        for chunk in iter(lambda: req.read(CHUNK), ''):
+        for chunk in iter(lambda: req.read(CHUNK), b''):
             if c == 0:
                 self.logger.info('Download started: {}'.format(url))
             c += CHUNK
@@ -1392,6 +1574,244 @@ class Genome(_MetaSample):
             self.logger.info('Download complete . . .')
         data.seek(0)
         return(data)
+class Downloader(object):
+    '''
+    Download files concurrently, resuming partial downloads
+
+    Up to max_transfers files are transferred at once, each by its own 
+    thread and connection. ftp:// URLs are fetched with REST offsets, 
+    http(s):// URLs with Range requests and file:// URLs (e.g., a local 
+    stand-in for a server when testing) by seeking. MD5 checksums are 
+    calculated while streaming so completed files are not read again.
+
+    Progress is kept in a JSON manifest so if a batch of downloads is 
+    interrupted, completed files are skipped and partial files resumed 
+    when run again.
+    '''
+    def __init__(self, manifest_path, max_transfers = 4, retries = 3, 
+            block_size = 2**16):
+        self.manifest_path = manifest_path
+        self.max_transfers = max_transfers
+        self.retries = retries
+        self.block_size = block_size
+        self.downloads = []
+        self.lock = _threading.Lock()
+        try:
+            with open(manifest_path) as fin:
+                self.manifest = _json.load(fin)
+        except (IOError, ValueError):
+            self.manifest = {}
+    
+    def add(self, url, local_path, expected_checksum = None):
+        '''Queue a URL to download to local_path'''
+        self.downloads += [(url, local_path, expected_checksum)]
+    
+    def _saveManifest(self):
+        # called with lock held
+        tmp_path = '{}.{}.tmp'.format(self.manifest_path, _os.getpid())
+        with open(tmp_path, 'w') as fout:
+            _json.dump(self.manifest, fout, indent = 1, sort_keys = True)
+        _os.rename(tmp_path, self.manifest_path)
+    
+    def _record(self, local_path, **info):
+        with self.lock:
+            self.manifest.setdefault(local_path, {}).update(info)
+            self._saveManifest()
+    
+    def _isComplete(self, url, local_path, expected_checksum):
+        entry = self.manifest.get(local_path, {})
+        if not _os.path.exists(local_path):
+            return(False)
+        # same file from a different mirror is fine
+        if entry.get('status') == 'complete' and \
+                entry.get('size') == _os.path.getsize(local_path) and \
+                expected_checksum in (entry.get('md5'), None):
+            return(True)
+        if not entry and expected_checksum:
+            # e.g., downloaded before there was a manifest
+            hasher = _md5()
+            with open(local_path, 'rb') as fin:
+                for block in iter(lambda: fin.read(2**20), b''):
+                    hasher.update(block)
+            if hasher.hexdigest() == expected_checksum:
+                self._record(local_path, url = url, status = 'complete', 
+                        md5 = expected_checksum, 
+                        size = _os.path.getsize(local_path))
+                return(True)
+        return(False)
+    
+    def _stream(self, url, offset, write, restart):
+        '''
+        Pass blocks of url from offset to write().
+        
+        If the server cannot resume from offset, restart() is called before 
+        any blocks are written and the whole file is passed to write(). If 
+        the file is offset long already, nothing is passed.
+        '''
+        parsed = _urlparse(url)
+        if parsed.scheme == 'ftp':
+            ftp = _FTP(parsed.hostname)
+            try:
+                ftp.login(parsed.username or 'anonymous', parsed.password or '')
+                ftp.voidcmd('TYPE I')
+                if offset:
+                    try:
+                        size = ftp.size(parsed.path)
+                    except (_error_reply, _error_perm, _error_temp):
+                        size = None
+                    if size == offset:
+                        # already complete
+                        return
+                command = 'RETR {}'.format(parsed.path)
+                received = [0]
+                def count(block):
+                    received[0] += len(block)
+                    write(block)
+                try:
+                    ftp.retrbinary(command, count, blocksize = self.block_size, 
+                            rest = offset or None)
+                except (_error_reply, _error_perm, _error_temp):
+                    # a 4xx or 5xx reply to REST or RETR: if not part way 
+                    # through, assume REST is not supported and start again
+                    if not offset or received[0]:
+                        raise
+                    restart()
+                    ftp.retrbinary(command, write, blocksize = self.block_size)
+            finally:
+                try:
+                    ftp.quit()
+                except Exception:
+                    ftp.close()
+            return
+        
+        if parsed.scheme == 'file':
+            fin = open(parsed.path, 'rb')
+            fin.seek(offset)
+        else:
+            request = _urllib2.Request(url)
+            if offset:
+                request.add_header('Range', 'bytes={}-'.format(offset))
+            try:
+                fin = _urllib2.urlopen(request)
+            except _urllib2.HTTPError as e:
+                if not offset or e.code != 416:
+                    raise
+                # range not satisfiable: complete if offset is the size 
+                # (Content-Range: bytes */size) else start again
+                if e.info().get('Content-Range', '').split('/')[-1] == \
+                        str(offset):
+                    return
+                restart()
+                fin = _urllib2.urlopen(_urllib2.Request(url))
+            if offset and fin.getcode() != 206:
+                # range not supported: start again with the whole file sent
+                restart()
+        try:
+            for block in iter(lambda: fin.read(self.block_size), b''):
+                write(block)
+        finally:
+            fin.close()
+    
+    def _download(self, url, local_path, expected_checksum):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                print('Retrying {} ({} of {})'.format(url, attempt, self.retries))
+                _sleep(2 ** attempt)
+            
+            hasher = _md5()
+            offset = 0
+            entry = self.manifest.get(local_path, {})
+            if _os.path.exists(local_path) and (entry.get('url') == url or \
+                    expected_checksum and entry.get('md5') == expected_checksum):
+                # resume: hash what is already there
+                with open(local_path, 'rb') as fin:
+                    for block in iter(lambda: fin.read(2**20), b''):
+                        hasher.update(block)
+                        offset += len(block)
+                if expected_checksum and hasher.hexdigest() == expected_checksum:
+                    # completed but not recorded e.g., if interrupted after
+                    self._record(local_path, url = url, status = 'complete', 
+                            md5 = expected_checksum, size = offset)
+                    print('Found complete download: {}'.format(local_path))
+                    return(True)
+            
+            self._record(local_path, url = url, status = 'partial', 
+                    md5 = expected_checksum)
+            if offset:
+                print('Resuming {} from {:,} bytes'.format(url, offset))
+            else:
+                print('Downloading {}'.format(url))
+            
+            state = {'hasher': hasher, 
+                     'fout': open(local_path, 'ab' if offset else 'wb')}
+            def write(block):
+                state['hasher'].update(block)
+                state['fout'].write(block)
+            def restart():
+                # server will send whole file: rewrite from the start
+                print('Cannot resume {}: downloading from the start'.format(url))
+                state['fout'].close()
+                state['fout'] = open(local_path, 'wb')
+                state['hasher'] = _md5()
+            try:
+                self._stream(url, offset, write, restart)
+            except Exception as e:
+                print('Download of {} interrupted: {}'.format(url, e))
+                continue
+            finally:
+                state['fout'].close()
+            
+            checksum = state['hasher'].hexdigest()
+            if expected_checksum is None or checksum == expected_checksum:
+                self._record(local_path, status = 'complete', md5 = checksum, 
+                        size = _os.path.getsize(local_path))
+                print('Downloaded {} (md5 {})'.format(local_path, checksum))
+                return(True)
+            
+            print('Checksum mismatch for {}: expected {}, got {}'.format(
+                    local_path, expected_checksum, checksum))
+            # corrupt rather than partial so start again
+            _os.unlink(local_path)
+        
+        self._record(local_path, status = 'failed')
+        return(False)
+    
+    def run(self):
+        '''
+        Download all queued files with up to max_transfers at once
+
+        returns dict of local_path => True if complete and checksum matched
+        '''
+        results = {}
+        to_do = []
+        for url, local_path, expected_checksum in self.downloads:
+            if self._isComplete(url, local_path, expected_checksum):
+                print('Found complete download: {}'.format(local_path))
+                results[local_path] = True
+            else:
+                to_do += [(url, local_path, expected_checksum)]
+        
+        def worker():
+            while True:
+                with self.lock:
+                    if not to_do:
+                        return
+                    url, local_path, expected_checksum = to_do.pop(0)
+                results[local_path] = self._download(url, local_path, 
+                        expected_checksum)
+        
+        threads = [_threading.Thread(target = worker) for i in \
+                range(min(self.max_transfers, len(to_do)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.downloads = []
+        return(results)
+
+
 class Reads:
     '''
     Download reads from your local read archive
@@ -1401,14 +1821,24 @@ class Reads:
 
     def getFromENA(self, run_acc_list, 
                          ftp_server_url = 'ftp.sra.ebi.ac.uk', 
-                         local_reads_path = ['reads']):
+                         local_reads_path = ['reads'], 
+                         collect_stats = True, 
+                         max_cpus = -1, 
+                         max_transfers = 4):
         '''
         Given a list of 'run' accession numbers for paired end short read analyses, 
         download the read files from the European Nucleotide Archive.
 
-        If using a mirror server, supply an alternative for 'ftp_server_url'.
+        If using a mirror server, supply an alternative for 'ftp_server_url'. 
+        This may include a scheme e.g., 'http://...' or 'file:///...' for a 
+        local copy.
 
         'local_reads_path' can be a path string or list or folder names.
+
+        Up to max_transfers files are downloaded at once and interrupted 
+        downloads are resumed if run again: see Downloader.
+
+        If collect_stats, read counts etc are collected: see collectStats().
         '''
         if isinstance(local_reads_path, list):
             local_reads_path = _os.path.sep.join(local_reads_path)
@@ -1416,36 +1846,17 @@ class Reads:
         if not _os.path.exists(local_reads_path):
             _os.makedirs(local_reads_path)
 
-        print('Logging in to %s' % ftp_server_url)
-        ftp = _FTP(ftp_server_url)
-        # anonymous login
-        print(ftp.login())
-
-        def check_connection(ftp):
-            try:
-                print('FTP: %s' % ftp.voidcmd("NOOP"))
-                # http://docs.python.org/2/library/ftplib.html
-                return(True)
-            except IOError as e:
-                print('Seems to be a problem with the connection to FTP server:')
-                print('I/O error({0}): {1}'.format(e.errno, e.strerror) )
-                return(False)
-
-        def calc_checksum(filepath):
-            hasher = _md5()
-            handle = open(filepath, 'rb')
-            buff = handle.read(65536)
-            while len(buff) > 0:
-                hasher.update(buff)
-                buff = handle.read(65536)
-            
-            return(hasher.hexdigest())
+        if '://' in ftp_server_url:
+            server_url = ftp_server_url.rstrip('/')
+        else:
+            server_url = 'ftp://' + ftp_server_url
 
-        downloaded_read_files = {}
+        downloader = Downloader(_os.path.sep.join([local_reads_path, 
+                'baga_downloads.json']), max_transfers = max_transfers)
 
-        start_time = _time.time()
+        local_reads_pair_paths_by_run = {}
         failed = []
-        for cnum,run_acc in enumerate(run_acc_list):
+        for run_acc in run_acc_list:
             
             query_url_base = 'http://www.ebi.ac.uk/ena/data/warehouse/search?query='
             success = False
@@ -1455,6 +1866,8 @@ class Reads:
                 rest_req = '"run_accession=%s"&result=read_run&fields=fastq_ftp,fastq_md5&display=report' % run_acc
                 print('Sending query to ENA:\n%s' % rest_req)
                 result = _urllib2.urlopen(query_url_base + rest_req).read()
+                if _PY3:
+                    result = result.decode('utf-8')
                 print('ENA accession numbers query result:\n%s' % result)
                 if result.count('ERR') == 7:
                     success = True
@@ -1475,60 +1888,30 @@ class Reads:
             
             ENA_paths = result.split('\n')[-2].split('\t')[-2][:-1].split(';')
             
-            ENA_reads_pair_paths = {}
-            ENA_reads_pair_paths[1] = ENA_paths[0].replace(ftp_server_url, '')
-            ENA_reads_pair_paths[2] = ENA_paths[1].replace(ftp_server_url, '')
-            
             local_reads_pair_paths = {}
-            local_reads_pair_paths[1] = local_reads_path + \
-                                        _os.path.sep + \
-                                        ENA_reads_pair_paths[1].split('/')[-1]
-            local_reads_pair_paths[2] = local_reads_path + \
-                                        _os.path.sep + \
-                                        ENA_reads_pair_paths[2].split('/')[-1]
+            for f in (1,2):
+                # path on server without host name
+                ENA_path = '/' + ENA_paths[f - 1].split('/', 1)[-1]
+                local_reads_pair_paths[f] = local_reads_path + \
+                                            _os.path.sep + \
+                                            ENA_path.split('/')[-1]
+                downloader.add(server_url + ENA_path, local_reads_pair_paths[f], 
+                        md5s[f - 1])
             
+            local_reads_pair_paths_by_run[run_acc] = local_reads_pair_paths
+
+        print('Downloading {} files with up to {} at once . . .'.format(
+                len(downloader.downloads), max_transfers))
+        downloaded = downloader.run()
+
+        downloaded_read_files = {}
+        for run_acc,local_reads_pair_paths in local_reads_pair_paths_by_run.items():
             downloaded_read_files[run_acc] = {}
-            
             for f in (1,2):
-                # ensure connection is still open
-                while not check_connection(ftp):
-                    _sleep(0.5)
-                    print('Attempting to re-establish connection . . .')
-                    ftp = _FTP(ftp_server_url)
-                    # anonymous login
-                    print(ftp.login())
-                    pass
-                
-                expected_checksum = md5s[f - 1]
-                
-                exists = _os.path.exists(local_reads_pair_paths[f])
-                if exists:
-                    print('File %s for %s exists locally: %s' % (f, run_acc, local_reads_pair_paths[f]))
-                    actual_checksum = calc_checksum(local_reads_pair_paths[f])
-                    if actual_checksum == expected_checksum:
-                        print('File checksum matches: %s. Skipping download' % (expected_checksum))
-                        downloaded_read_files[run_acc][f] = local_reads_pair_paths[f]
-                        continue
-                    else:
-                        print('Checksum mismatch')
-                
-                print('Downloading via %s: %s' % (ftp_server_url, ENA_reads_pair_paths[f]))
-                res = ftp.retrbinary('RETR %s' % ENA_reads_pair_paths[f], 
-                                     open(local_reads_pair_paths[f], 'wb').write)
-                print('FTP: %s' % res)
-                
-                print('Calculating checksum . . .')
-                actual_checksum = calc_checksum(local_reads_pair_paths[f])
-                
-                if actual_checksum == expected_checksum:
-                    print('File checksum matches: %s.' % (expected_checksum))
+                if downloaded.get(local_reads_pair_paths[f]):
                     downloaded_read_files[run_acc][f] = local_reads_pair_paths[f]
                 else:
-                    print('Checksum mismatch for: %s')
-            
-            if len(run_acc_list) > 1:
-                # report durations, time left etc
-                _report_time(start_time, cnum, len(run_acc_list))
+                    print('Download failed for %s' % local_reads_pair_paths[f])
 
         if len(failed) > 0:
             print('WARNING: some accession numbers did not return a result from ENA')
@@ -1537,10 +1920,15 @@ class Reads:
 
         self.read_files = downloaded_read_files
 
-    def getFromPath(self, path_to_fastq):
+        if collect_stats:
+            self.collectStats(max_cpus = max_cpus)
+
+    def getFromPath(self, path_to_fastq, collect_stats = True, max_cpus = -1):
         '''
         Given a path to pairs of fastq short read files, parse them ready for analysis 
         with the Bacteria and Archaea Genome (BAG) Analyser.
+
+        If collect_stats, read counts etc are collected: see collectStats().
         '''    
 
         use_files = []
@@ -1715,6 +2103,30 @@ class Reads:
 
         self.read_files = checked_read_files
 
+        if collect_stats:
+            self.collectStats(max_cpus = max_cpus)
+
+    def collectStats(self, max_cpus = -1, force = False):
+        '''
+        Count reads and summarise read lengths, base composition and quality 
+        scores for each read file in one pass, using up to max_cpus processes.
+
+        Statistics are kept beside each read file (see baga.ReadStats) for 
+        downstream steps and are only collected again if a file changes (or 
+        if force). They are also stored by file path in self.read_stats.
+        '''
+        max_processes = _decide_max_processes( max_cpus )
+        paths = sorted([f for files in self.read_files.values() for f in \
+                files.values()])
+        print('Collecting read statistics for {} files . . .'.format(len(paths)))
+        self.read_stats = _ReadStatsIndex().getStats(paths, 
+                max_processes = max_processes, force = force)
+        for path in paths:
+            stats = self.read_stats[path]
+            print('{}: {:,} reads, mostly {} bp, mean quality {:.1f}'.format(
+                    path, stats['reads'], stats['mode_length'], 
+                    stats['mean_quality']))
+
     def saveLocal(self, name):
         '''
         Save a downloaded read info to a local compressed pickle file.
@@ -50,6 +50,7 @@ from Bio import AlignIO as _AlignIO
 from baga import get_exe_path as _get_exe_path
 from baga import report_time as _report_time
 from baga import CallVariants
+from baga.Depths import DepthStore as _DepthStore
 
 # for non-stdlib modules that are only required by certain Classes
 # issue warnings here if not found
@@ -213,8 +214,8 @@ class MultipleSequenceAlignment:
         InDels = _defaultdict(dict)
         filtered_log = []
         for VCF_path in self.paths_to_VCFs:
-            header, header_section_order, colnames, these_variants = CallVariants.parseVCF(VCF_path)
-            headerdict = CallVariants.dictify_vcf_header(header)
+            vcf = CallVariants.VCFReader(VCF_path)
+            headerdict = CallVariants.dictify_vcf_header(vcf.header)
             FILTERfilters = set()
             if 'FILTER' in headerdict:
                 for FILTER in headerdict['FILTER']:
@@ -230,9 +231,9 @@ class MultipleSequenceAlignment:
             genome_ids[headerdict['contig'][0]['ID']] = VCF_path
             genome_lengths[headerdict['contig'][0]['length']] = VCF_path
             
-            sample_names = colnames[9:]
-            for line in these_variants:
-                bits = line.split('\t')
+            sample_names = vcf.sample_names
+            for record in vcf:
+                bits = record.cells
                 chromosome, pos1, ID, ref, query, qual, FILTER, INFO, FORMAT = bits[:9]
                 # (polymorphisms separated with commas)
                 query_char_states = query.split(',')
@@ -573,13 +574,16 @@ class MultipleSequenceAlignment:
         '''
     collect per position along genome, aligned read coverage depth that pass a 
     quality standard and return ranges without reads.
-    Defaults to trying load a previous set of scanned missing regions if possible.
+    Defaults to trying load a previous set of scanned coverage depths from the 
+    depth track store shared with the Structure module if possible. Scanned 
+    depths are always added to the store: save is retained for compatibility.
     path_to_BAMs can be a string describing folder of BAMs or a list of strings for
     each BAM.
         '''
         
         if len(path_to_BAMs):
             BAMs = {}
+            BAM_paths = {}
             reference = {}
             if isinstance(path_to_BAMs, str):
                 checkBAMs = []
@@ -592,6 +596,7 @@ class MultipleSequenceAlignment:
             for BAM in checkBAMs:
                 thisBAM = _pysam.Samfile(BAM)
                 BAMs[thisBAM.header['RG'][0]['ID']] = thisBAM
+                BAM_paths[thisBAM.header['RG'][0]['ID']] = BAM
                 reference[thisBAM.header['SQ'][0]['SN']] = thisBAM.header['RG'][0]['ID']
             
             missing = set(self.SNPs) - set(BAMs)
@@ -603,105 +608,23 @@ class MultipleSequenceAlignment:
             # only use BAMs for which we have SNPs
             BAMs = dict([(k,v) for k,v in BAMs.items() if k in self.SNPs])
         
-        # start by collecting coverages: 
-        # either done previously with Structure module
-        # or by scanning here and saving
+        # start by collecting coverages from the depth track store shared 
+        # with the Structure module, scanning any BAMs not found there
         missing_regions = {}
+        if not load:
+            print('Scanning coverages from BAM files . . .')
+        depths = _DepthStore().getDepths(
+                sorted([BAM_paths[sample] for sample in BAMs]), 
+                resolution = resolution, 
+                min_mapping_quality = min_mapping_quality, 
+                force = not load)
         start_time = _time.time()
         for snum,(sample,BAM) in enumerate(BAMs.items()):
-            found_depths = False
-            depths = {}
-            if load:
-                use_name = BAM.filename[:-4] + '_depths.baga'
-                # this is a hack to save time: previous depths not found in _baserecal version
-                filein = use_name.replace('_baserecal','')
-                try:
-                    with _tarfile.open(filein, "r:gz") as tar:
-                        for member in tar:
-                            contents = _StringIO(tar.extractfile(member).read())
-                            depths[member.name] = _array('i', contents.getvalue())
-                    
-                    print("Found and loaded previously scanned coverage depths from {} which saves time!".format(filein))
-                    found_depths = True
-                except IOError:
-                    print("Couldn't find previously scanned coverages at {}".format(filein))
-            
-            if not found_depths:
-                indexfile = _os.path.extsep.join([BAM.filename,'bai'])
-                if not(_os.path.exists(indexfile) and _os.path.getsize(indexfile) > 0):
-                    print('indexing {}'.format(BAM.filename))
-                    # try:
-                        # print('Using pySAM')
-                        # _pysam.index(BAM)
-                    # except TypeError:
-                        # print("pysam didn't like something about this bam . . . "\
-                                # "trying 'samtools index {}' instead.".format(BAM))
-                    try:
-                        print('Using SAMTools')
-                        _subprocess.call(['samtools','index',BAM.filename])
-                    except OSError:
-                        raise OSError("pysam and samtools didn't like something about "\
-                                "this bam . . . ")
-                print('Scanning coverages from BAM file . . .')
-                # also collect proper pair depths to maintain compatibility with Structure module
-                num_ref_positions = BAM.header['SQ'][0]['LN']
-                depth_total = _array('i', (0,) * (int(num_ref_positions / resolution) + 1))
-                depth_proper = _array('i', (0,) * (int(num_ref_positions / resolution) + 1))
-                # reload to include index
-                BAM = _pysam.Samfile(BAM.filename)
-                pl_iter = BAM.pileup( BAM.references[0] )
-                for x in pl_iter:
-                    # Coordinates in pysam are always 0-based.
-                    # SAM text files use 1-based coordinates.
-                    if x.pos % resolution == 0:
-                        read_count_proper_pair = 0
-                        read_count_non_dup = 0
-                        for r in x.pileups:
-                            if \
-                              not r.alignment.is_qcfail and \
-                              not r.alignment.is_duplicate and \
-                              not r.alignment.is_secondary and \
-                              r.alignment.mapping_quality >= min_mapping_quality:
-                                
-                                read_count_non_dup += 1
-                                
-                                if r.alignment.is_proper_pair:
-                                    
-                                    read_count_proper_pair += 1
-                        
-                        pos_in_arrays = x.pos / resolution
-                        depth_total[pos_in_arrays] = read_count_non_dup
-                        depth_proper[pos_in_arrays] = read_count_proper_pair
-                
-                depths['depth_total'] = depth_total
-                depths['depth_proper'] = depth_proper
-            
-            if save and not found_depths:
-                use_name = BAM.filename[:-4] + '_depths.baga'
-                # this is a hack to save time: previous depths not found in _baserecal version
-                fileout = use_name.replace('_baserecal','')
-                try:
-                    print("Saving scanned coverage depths at {} to save time if reanalysing".format(fileout))
-                    def add_array(obj, name):
-                        io = _StringIO(obj.tostring())
-                        io.seek(0, _os.SEEK_END)
-                        length = io.tell()
-                        io.seek(0)
-                        info = _tarfile.TarInfo(name = name)
-                        info.size = length
-                        tar.addfile(tarinfo = info, fileobj = io)
-                    
-                    with _tarfile.open(fileout, "w:gz") as tar:
-                        print('Writing to {} . . . '.format(fileout))
-                        add_array(depths['depth_total'], 'depth_total')
-                        add_array(depths['depth_proper'], 'depth_proper')
-                        
-                except IOError:
-                    print("Attempt to save scanned coverage depths at {} failed . . .".format(fileout))
+            depth_total, depth_proper = depths[BAM_paths[sample]][BAM.references[0]]
             
             these_missing_regions = []
             collecting = False
-            for pos,depth in enumerate(depths['depth_total']):
+            for pos,depth in enumerate(depth_total.tolist()):
                 if depth == 0:
                     if not collecting:
                         # zero depth, not collecting so start
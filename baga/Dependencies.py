@@ -684,6 +684,19 @@ dependencies['pysam'] = {
                 'arguments': {}}
     }
 
+dependencies['numpy'] = {
+    'name': 'numpy',
+    'description': 'fast arrays for per position and per variant data',
+    'source': 'download',
+    'url': 'https://pypi.python.org/packages/source/n/numpy/numpy-1.11.1.tar.gz',
+    'commit': None,
+    'checksum': None,
+    'destination': destination_packages,
+    'preparation': None,
+    'checker': {'function': check_python_package,
+                'arguments': {'maj_version':1}}
+    }
+
 dependencies['clonalframeml'] = {
     'name': 'clonalframeml',
     'description': 'Recombination Detection',
@@ -851,6 +864,10 @@ dependencies_notes['pysam'] = {
 ''
     }
 
+dependencies_notes['numpy'] = {
+''
+    }
+
 dependencies_notes['clonalframeml'] = {
 ''
     }
@@ -872,7 +889,7 @@ dependencies_by_task['CollectData'] = [
 dependencies_by_task['PrepareReads'] = [
 'sickle',
 'cutadapt',
-'biopython',
+'numpy',
 ]
 
 dependencies_by_task['AlignReads'] = [
@@ -886,7 +903,7 @@ dependencies_by_task['Repeats'] = [
 'bwa',
 'samtools',
 'biopython',
-'seq-align',
+'numpy',
 'svgwrite',
 'pysam',
 'mummer'
@@ -898,15 +915,17 @@ dependencies_by_task['Structure'] = [
 'svgwrite',
 'spades',
 'seq-align',
+'numpy',
 ]
 
 dependencies_by_task['CallVariants'] = [
 # 'GATK' checked separately when path specified to GATK
-'pysam'
+'pysam',
+'numpy',
 ]
 
 dependencies_by_task['FilterVariants'] = [
-
+'numpy',
 ]
 
 dependencies_by_task['ComparativeAnalysis'] = [
@@ -915,6 +934,7 @@ dependencies_by_task['ComparativeAnalysis'] = [
 'dendropy',
 'biopython',
 'svgwrite',
+'numpy',
 ]
 
 dependencies_by_task['SimulateReads'] = [
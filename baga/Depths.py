@@ -0,0 +1,323 @@
+#! /usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Bacterial and Archaeal Genome Analyser
+# Copyright (C) 2015-2016 David Williams
+# david.williams.at.liv.d-dub.org.uk
+# License GPLv3+: GNU GPL version 3 or later
+# This is free software: you are free to change and redistribute it
+# There is NO WARRANTY, to the extent permitted by law
+# 
+# Work on this software was started at The University of Liverpool, UK 
+# with funding from The Wellcome Trust (093306/Z/10) awarded to:
+# Dr Steve Paterson (The University of Liverpool, UK)
+# Dr Craig Winstanley (The University of Liverpool, UK)
+# Dr Michael A Brockhurst (The University of York, UK)
+#
+'''
+Depths module from the Bacterial and Archaeal Genome Analyzer (BAGA).
+
+This module contains functions to collect aligned read coverage depths from 
+BAM files and a store which keeps them on disk so each BAM is scanned once per 
+combination of mapping quality threshold and resolution however many analyses 
+(e.g., the Structure and ComparativeAnalysis modules) make use of them.
+'''
+
+# stdlib
+from baga import _os
+from baga import _json
+from baga import _logging
+from baga import _multiprocessing
+from baga import _md5
+
+from array import array as _array
+import struct as _struct
+
+# external Python modules
+import pysam as _pysam
+import numpy as _np
+
+def main():
+    pass
+
+# reads excluded from coverage depths: unmapped, secondary, QC fail, duplicate
+_depth_exclude_flags = 0x4 | 0x100 | 0x200 | 0x400
+
+def _region_depths(args):
+    '''
+    Read depths at every resolution-th position of a region of a sequence.
+
+    Depths are built from the aligned span of each read fetched from the BAM 
+    using a difference array and cumulative sum instead of a pileup. start 
+    should be a multiple of resolution. Module level for multiprocessing.
+
+    returns (depth_total, depth_proper) as NumPy arrays
+    '''
+    path_to_bam, seq_name, start, end, resolution, min_mapping_quality = args
+    length = end - start
+    total_starts = _array('i')
+    total_ends = _array('i')
+    proper_starts = _array('i')
+    proper_ends = _array('i')
+    reads = _pysam.Samfile(path_to_bam, 'rb')
+    for r in reads.fetch(seq_name, start, end):
+        if r.flag & _depth_exclude_flags or \
+                r.mapping_quality < min_mapping_quality or \
+                r.reference_end is None:
+            continue
+        # clip to this region: reads spanning a boundary are fetched for both
+        s = max(r.reference_start, start) - start
+        e = min(r.reference_end, end) - start
+        total_starts.append(s)
+        total_ends.append(e)
+        if r.is_proper_pair:
+            proper_starts.append(s)
+            proper_ends.append(e)
+    reads.close()
+    depths = []
+    for starts,ends in ((total_starts, total_ends), (proper_starts, proper_ends)):
+        steps = _np.bincount(_np.asarray(starts, dtype = _np.int32), 
+                minlength = length + 1).astype(_np.int32) - \
+                _np.bincount(_np.asarray(ends, dtype = _np.int32), 
+                minlength = length + 1).astype(_np.int32)
+        depths += [_np.cumsum(steps[:length], dtype = _np.int32)[::resolution]]
+    return(tuple(depths))
+
+def collectDepths(sequences, resolution = 10, min_mapping_quality = 30, 
+        max_processes = 1, chunk_size = 1000000):
+    '''
+    Total and proper-pair read depths for sequences in one or more BAMs.
+
+    sequences is a list of (path_to_bam, seq_name, length). Each sequence is 
+    divided into chunks which are shared among max_processes processes so 
+    many BAMs and long sequences are processed concurrently.
+
+    returns dict of (path_to_bam, seq_name) => (depth_total, depth_proper) 
+    as array.array('i') of int(length / resolution) + 1 positions
+    '''
+    # chunks must start at a multiple of resolution
+    chunk_size = max(resolution, chunk_size - chunk_size % resolution)
+    chunks = []
+    for path_to_bam, seq_name, length in sequences:
+        for start in range(0, length, chunk_size):
+            chunks += [(path_to_bam, seq_name, start, min(start + chunk_size, length), 
+                    resolution, min_mapping_quality)]
+    
+    if max_processes > 1 and len(chunks) > 1:
+        pool = _multiprocessing.Pool(min(max_processes, len(chunks)))
+        chunk_depths = pool.map(_region_depths, chunks)
+        pool.close()
+        pool.join()
+    else:
+        chunk_depths = map(_region_depths, chunks)
+    
+    by_sequence = {}
+    for (path_to_bam, seq_name, start, end, r, q), depths in zip(chunks, chunk_depths):
+        by_sequence.setdefault((path_to_bam, seq_name), []).append(depths)
+    
+    collected = {}
+    for path_to_bam, seq_name, length in sequences:
+        arrays = []
+        for n in (0, 1):
+            depth = _np.zeros(int(length / resolution) + 1, dtype = _np.int32)
+            # chunks were listed in order along each sequence
+            these = _np.concatenate([d[n] for d in by_sequence.get((path_to_bam, 
+                    seq_name), [])] or [depth[:0]])
+            depth[:len(these)] = these
+            arrays += [_array('i', depth.tobytes())]
+        collected[path_to_bam, seq_name] = tuple(arrays)
+    
+    return(collected)
+
+class DepthStore(object):
+    '''
+    A folder of read coverage depth tracks shared among baga analyses.
+
+    Tracks are keyed by the MD5 checksum of the BAM file contents, the minimum 
+    mapping quality and the resolution, so renamed or copied BAMs are not 
+    rescanned but a realigned BAM is. Checksums are remembered against path, 
+    size and modification time to save reading unchanged BAMs again.
+
+    Each track is one binary file: an eight byte magic string, the length of 
+    a JSON header as a little-endian unsigned int, the header describing each 
+    sequence and then, from the next multiple of eight bytes, little-endian 
+    int32 total and proper-pair depths for each sequence in turn. Tracks are 
+    opened as read-only numpy.memmap arrays and are written to a temporary 
+    file before renaming so concurrent analyses never read a partial track.
+    '''
+    magic = b'BAGADPT1'
+    
+    def __init__(self, path = 'baga_depth_tracks'):
+        self.path = path
+        self.logger = _logging.getLogger(__name__)
+        self.checksums_file = _os.path.sep.join([self.path, 'checksums.json'])
+    
+    def _write_atomically(self, path, chunks):
+        tmp_path = '{}.{}.tmp'.format(path, _os.getpid())
+        with open(tmp_path, 'wb') as fout:
+            for chunk in chunks:
+                fout.write(chunk)
+        _os.rename(tmp_path, path)
+    
+    def bamChecksum(self, path_to_bam, block_size = 2**20):
+        '''MD5 of BAM file contents, remembered while size and mtime unchanged'''
+        real_path = _os.path.realpath(path_to_bam)
+        info = _os.stat(real_path)
+        try:
+            with open(self.checksums_file) as fin:
+                checksums = _json.load(fin)
+        except (IOError, ValueError):
+            checksums = {}
+        
+        if real_path in checksums:
+            size, mtime, checksum = checksums[real_path]
+            if size == info.st_size and mtime == info.st_mtime:
+                return(checksum)
+        
+        self.logger.debug('Calculating checksum of {}'.format(path_to_bam))
+        hasher = _md5()
+        with open(real_path, 'rb') as fin:
+            for block in iter(lambda: fin.read(block_size), b''):
+                hasher.update(block)
+        
+        checksum = hasher.hexdigest()
+        checksums[real_path] = [info.st_size, info.st_mtime, checksum]
+        if not _os.path.exists(self.path):
+            _os.makedirs(self.path)
+        self._write_atomically(self.checksums_file, 
+                [_json.dumps(checksums).encode('utf-8')])
+        return(checksum)
+    
+    def trackPath(self, checksum, min_mapping_quality, resolution):
+        return(_os.path.sep.join([self.path, '{}_q{}_r{}.depths'.format(
+                checksum, min_mapping_quality, resolution)]))
+    
+    def load(self, path_to_bam, min_mapping_quality = 30, resolution = 10):
+        '''
+        Depths for a BAM from a previous scan, if any.
+        
+        returns dict of seq_name => (depth_total, depth_proper) as read-only 
+        numpy.memmap int32 arrays or None if not in the store
+        '''
+        track_path = self.trackPath(self.bamChecksum(path_to_bam), 
+                min_mapping_quality, resolution)
+        try:
+            with open(track_path, 'rb') as fin:
+                magic = fin.read(len(self.magic))
+                header_length, = _struct.unpack('<I', fin.read(4))
+                header = _json.loads(fin.read(header_length).decode('utf-8'))
+        except IOError:
+            return(None)
+        
+        if magic != self.magic:
+            self.logger.warning('Ignoring unrecognised depth track: {}'.format(
+                    track_path))
+            return(None)
+        
+        data_start = header['data_start']
+        depths = {}
+        if not header['sequences']:
+            return(depths)
+        
+        data = _np.memmap(track_path, dtype = '<i4', mode = 'r', 
+                offset = data_start)
+        for seq_name, length, start, num_positions in header['sequences']:
+            depths[seq_name] = (data[start : start + num_positions], 
+                    data[start + num_positions : start + 2 * num_positions])
+        
+        return(depths)
+    
+    def save(self, path_to_bam, depths, min_mapping_quality = 30, 
+            resolution = 10, lengths = None):
+        '''
+        Store depths for a BAM as collected by collectDepths() i.e., a dict of 
+        seq_name => (depth_total, depth_proper).
+        '''
+        if not _os.path.exists(self.path):
+            _os.makedirs(self.path)
+        
+        checksum = self.bamChecksum(path_to_bam)
+        sequences = []
+        arrays = []
+        start = 0
+        for seq_name in sorted(depths):
+            total, proper = [_np.asarray(a, dtype = '<i4') for a in depths[seq_name]]
+            sequences += [[seq_name, lengths[seq_name] if lengths else None, 
+                    start, len(total)]]
+            arrays += [total, proper]
+            start += 2 * len(total)
+        
+        header = {'checksum': checksum, 
+                  'min_mapping_quality': min_mapping_quality, 
+                  'resolution': resolution, 
+                  'sequences': sequences}
+        # header includes where data starts so pad to fixed width with spaces
+        header['data_start'] = 0
+        header_bytes = _json.dumps(header).encode('utf-8')
+        prefix_length = len(self.magic) + 4 + len(header_bytes) + 16
+        header['data_start'] = prefix_length + (-prefix_length % 8)
+        header_bytes = _json.dumps(header).encode('utf-8')
+        header_bytes += b' ' * (header['data_start'] - len(self.magic) - 4 - \
+                len(header_bytes))
+        
+        track_path = self.trackPath(checksum, min_mapping_quality, resolution)
+        self._write_atomically(track_path, [self.magic, 
+                _struct.pack('<I', len(header_bytes)), header_bytes] + \
+                [a.tobytes() for a in arrays])
+        self.logger.debug('Saved depths for {} to {}'.format(path_to_bam, 
+                track_path))
+    
+    def getDepths(self, BAMs, resolution = 10, min_mapping_quality = 30, 
+            max_processes = 1, force = False):
+        '''
+        Depths for every sequence in each BAM, scanning only those not 
+        already in the store (or all if force). BAMs not yet in the store 
+        share one pool of max_processes processes: see collectDepths().
+        
+        returns dict of path_to_bam => seq_name => (depth_total, depth_proper)
+        '''
+        collected = {}
+        lengths = {}
+        for path_to_bam in BAMs:
+            reads = _pysam.Samfile(path_to_bam, 'rb')
+            lengths[path_to_bam] = dict(zip(reads.references, reads.lengths))
+            reads.close()
+            if not force:
+                depths = self.load(path_to_bam, min_mapping_quality, resolution)
+                if depths is not None and sorted(depths) == \
+                        sorted(lengths[path_to_bam]):
+                    self.logger.info('Found read coverage depths for {} '\
+                            'from previous analysis'.format(path_to_bam))
+                    collected[path_to_bam] = depths
+        
+        sequences = []
+        for path_to_bam in BAMs:
+            if path_to_bam in collected:
+                continue
+            indexfile = _os.path.extsep.join([path_to_bam, 'bai'])
+            if not(_os.path.exists(indexfile) and _os.path.getsize(indexfile) > 0):
+                self.logger.info('Indexing {}'.format(path_to_bam))
+                _pysam.index(path_to_bam)
+            sequences += [(path_to_bam, seq_name, length) for seq_name,length \
+                    in sorted(lengths[path_to_bam].items())]
+        
+        if len(sequences):
+            self.logger.info('Scanning {} sequences in {} BAMs for read '\
+                    'coverage depths using {} processes'.format(len(sequences), 
+                    len(set([s[0] for s in sequences])), max_processes))
+            depths = collectDepths(sequences, resolution = resolution, 
+                    min_mapping_quality = min_mapping_quality, 
+                    max_processes = max_processes)
+            for path_to_bam in set([s[0] for s in sequences]):
+                these = dict([(seq_name, depths[path_to_bam, seq_name]) for \
+                        seq_name in lengths[path_to_bam]])
+                self.save(path_to_bam, these, min_mapping_quality, resolution, 
+                        lengths = lengths[path_to_bam])
+                collected[path_to_bam] = self.load(path_to_bam, 
+                        min_mapping_quality, resolution)
+        
+        return(collected)
+
+
+if __name__ == '__main__':
+    main()
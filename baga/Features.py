@@ -0,0 +1,343 @@
+#! /usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Bacterial and Archaeal Genome Analyser
+# Copyright (C) 2015-2016 David Williams
+# david.williams.at.liv.d-dub.org.uk
+# License GPLv3+: GNU GPL version 3 or later
+# This is free software: you are free to change and redistribute it
+# There is NO WARRANTY, to the extent permitted by law
+#
+# Work on this software was started at The University of Liverpool, UK
+# with funding from The Wellcome Trust (093306/Z/10) awarded to:
+# Dr Steve Paterson (The University of Liverpool, UK)
+# Dr Craig Winstanley (The University of Liverpool, UK)
+# Dr Michael A Brockhurst (The University of York, UK)
+#
+'''
+Features module from the Bacterial and Archaeal Genome Analyzer (BAGA).
+
+This module contains lightweight readers for GenBank and GFF3 (with FASTA)
+files which stream through a file once, keeping the sequence of each record
+and the locations and qualifiers of only those feature types baga uses,
+e.g., when CollectData.Genome loads a genome. Locations follow BioPython's
+conventions: zero-based, end exclusive, and parts of complement(join())
+locations in reverse order.
+'''
+
+# stdlib
+from baga import _gzip
+from baga import _re
+
+def main():
+    pass
+
+# features used by CollectData.Genome._extractLoci()
+default_feature_types = ('CDS', 'rRNA', 'misc_feature')
+
+class Feature(object):
+    '''
+    A feature's type, location parts as (start, end, strand) and qualifiers
+    as a dict of lists of values.
+    '''
+    def __init__(self, feature_type, parts, qualifiers = None):
+        self.type = feature_type
+        self.parts = parts
+        self.qualifiers = qualifiers if qualifiers is not None else {}
+
+    @property
+    def start(self):
+        return(min([s for s,e,strand in self.parts]))
+
+    @property
+    def end(self):
+        return(max([e for s,e,strand in self.parts]))
+
+    @property
+    def strand(self):
+        '''strand if all parts are on the same strand else None'''
+        strands = set([strand for s,e,strand in self.parts])
+        if len(strands) == 1:
+            return(strands.pop())
+        return(None)
+
+class Record(object):
+    '''A sequence with its id, description and features'''
+    def __init__(self, record_id, description, seq, features):
+        self.id = record_id
+        self.description = description
+        self.seq = seq
+        self.features = features
+
+def _open(data):
+    '''a path (optionally gzipped), an open text file or other iterable of lines'''
+    if not hasattr(data, 'endswith'):
+        return(data, False)
+    if data.endswith('.gz'):
+        return(_gzip.open(data, 'rt'), True)
+    return(open(data), True)
+
+_position = _re.compile('[<>]?(\d+)')
+
+def _split_top_level(text):
+    '''split text at commas not within brackets'''
+    parts = []
+    depth = 0
+    last = 0
+    for i,c in enumerate(text):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            parts += [text[last:i]]
+            last = i + 1
+    return(parts + [text[last:]])
+
+def parse_location(text, strand = 1):
+    '''
+    Parse a GenBank location string
+
+    returns list of (start, end, strand) parts, zero-based and end exclusive
+    in BioPython's order. Parts in other records (e.g., "J00194.1:100..202")
+    are omitted.
+    '''
+    text = text.replace(' ', '')
+    if text.startswith('complement(') and text.endswith(')'):
+        parts = parse_location(text[11:-1], -strand)
+        # as BioPython: complement(join(a,b)) == join(complement(b),complement(a))
+        return(parts[::-1])
+    for operator in ('join(', 'order('):
+        if text.startswith(operator) and text.endswith(')'):
+            parts = []
+            for part in _split_top_level(text[len(operator):-1]):
+                parts += parse_location(part, strand)
+            return(parts)
+    if ':' in text:
+        return([])
+    if '..' in text:
+        start, end = text.split('..')
+        start = int(_position.search(start).group(1)) - 1
+        end = int(_position.findall(end)[-1])
+    elif '^' in text:
+        # between two bases
+        start = end = int(_position.search(text).group(1))
+    else:
+        end = int(_position.search(text).group(1))
+        start = end - 1
+    return([(start, end, strand)])
+
+def _qualifier_value(value):
+    value = value.strip()
+    if value.startswith('"'):
+        value = value[1:]
+        if value.endswith('"'):
+            value = value[:-1]
+        value = value.replace('""', '"')
+    return(value)
+
+def _feature(feature_type, location, qualifiers):
+    '''
+    a Feature from the text of a location and [name, value] qualifiers
+
+    returns list of the Feature, or an empty list if any part of it is in 
+    another record (e.g., "J00194.1:100..202" or 
+    "join(J00194.1:100..202,1..245)"), which the BioPython based parsing 
+    also left out
+    '''
+    if ':' in location:
+        return([])
+    parts = parse_location(location)
+    values = {}
+    for name, value in qualifiers:
+        values.setdefault(name, []).append(_qualifier_value(value))
+    return([Feature(feature_type, parts, values)])
+
+def read_genbank(data, feature_types = default_feature_types):
+    '''
+    Iterate over records in a GenBank file without BioPython
+
+    Only the sequence, id (ACCESSION.VERSION from VERSION else the LOCUS
+    name), description (DEFINITION without a final '.') and the features of
+    feature_types located wholly in the record are kept. Multi-line
+    qualifier values are joined with a space, or without for /translation.
+
+    data is a path (optionally gzipped) or a text file-like object
+
+    yields Record objects
+    '''
+    handle, close = _open(data)
+    try:
+        record = None
+        section = None
+        # feature currently being read: [type, location text, qualifiers]
+        feature = None
+        seq = []
+        for line in handle:
+            line = line.rstrip('\r\n')
+            if line.startswith('LOCUS'):
+                record = Record(line.split()[1], '', '', [])
+                section = 'LOCUS'
+                seq = []
+                continue
+            if record is None:
+                continue
+            if line[:1] not in (' ', ''):
+                # a new top level section or the end of the record
+                if feature is not None:
+                    record.features += _feature(*feature)
+                    feature = None
+                if line.startswith('//'):
+                    record.seq = ''.join(seq).upper()
+                    if record.description.endswith('.'):
+                        record.description = record.description[:-1]
+                    yield(record)
+                    record = None
+                    continue
+                section = line.split()[0]
+                if section == 'DEFINITION':
+                    record.description = line[12:].strip()
+                elif section == 'VERSION':
+                    version = line[12:].split()
+                    if version:
+                        record.id = version[0]
+                continue
+            if section == 'DEFINITION':
+                record.description += ' ' + line.strip()
+            elif section == 'ORIGIN':
+                seq += line.split()[1:]
+            elif section == 'FEATURES':
+                key = line[5:21].strip()
+                if key:
+                    if feature is not None:
+                        record.features += _feature(*feature)
+                    if key in feature_types:
+                        feature = [key, line[21:].strip(), []]
+                    else:
+                        feature = None
+                    continue
+                if feature is None:
+                    continue
+                content = line[21:].strip()
+                # a '/' within a quoted value (e.g., a wrapped URL) is not 
+                # a new qualifier
+                in_quotes = feature[2] and feature[2][-1][1].count('"') % 2
+                if content.startswith('/') and not in_quotes:
+                    name, equals, value = content[1:].partition('=')
+                    feature[2] += [[name, value]]
+                elif not feature[2]:
+                    # location continues
+                    feature[1] += content
+                else:
+                    qualifier = feature[2][-1]
+                    join = '' if qualifier[0] == 'translation' else ' '
+                    qualifier[1] += join + content
+    finally:
+        if close:
+            handle.close()
+
+def read_fasta(data):
+    '''
+    Iterate over (id, description, sequence) in a FASTA file
+
+    data is a path (optionally gzipped) or a text file-like object
+    '''
+    handle, close = _open(data)
+    try:
+        header = None
+        seq = []
+        for line in handle:
+            line = line.strip()
+            if line.startswith('>'):
+                if header is not None:
+                    yield(header.split()[0], header, ''.join(seq))
+                header = line[1:]
+                seq = []
+            elif header is not None:
+                seq += [line]
+        if header is not None:
+            yield(header.split()[0], header, ''.join(seq))
+    finally:
+        if close:
+            handle.close()
+
+_gff_unescape = _re.compile('%([0-9A-Fa-f]{2})')
+
+def read_gff3(data, feature_types = default_feature_types):
+    '''
+    Iterate over records in a GFF3 file with sequences in a ##FASTA section
+
+    Features of the same type and ID on several lines become one feature
+    with several parts. Attributes become qualifiers, with "Note" as "note".
+
+    data is a path (optionally gzipped) or a text file-like object
+
+    yields Record objects in the order of the FASTA sequences
+    '''
+    handle, close = _open(data)
+    features = {}
+    by_id = {}
+    try:
+        for line in handle:
+            if line.startswith('##FASTA'):
+                break
+            if line.startswith('#') or not line.strip():
+                continue
+            columns = line.rstrip('\r\n').split('\t')
+            if len(columns) != 9 or columns[2] not in feature_types:
+                continue
+            seqid, source, feature_type, start, end, score, strand, phase, \
+                    attributes = columns
+            qualifiers = {}
+            for attribute in attributes.strip(';').split(';'):
+                name, equals, values = attribute.partition('=')
+                name = 'note' if name == 'Note' else name
+                qualifiers[name] = [_gff_unescape.sub(lambda m:
+                        chr(int(m.group(1), 16)), v) for v in values.split(',')]
+            part = (int(start) - 1, int(end), {'+': 1, '-': -1}.get(strand))
+            feature_id = qualifiers.get('ID', [None])[0]
+            if feature_id is not None and (seqid, feature_type, feature_id) in by_id:
+                feature = by_id[seqid, feature_type, feature_id]
+                feature.parts += [part]
+                continue
+            feature = Feature(feature_type, [part], qualifiers)
+            features.setdefault(seqid, []).append(feature)
+            if feature_id is not None:
+                by_id[seqid, feature_type, feature_id] = feature
+
+        for feature in by_id.values():
+            # as BioPython: reverse strand parts in reverse order
+            feature.parts.sort(reverse = feature.strand == -1)
+
+        for seqid, description, seq in read_fasta(handle):
+            yield(Record(seqid, description, seq.upper(),
+                    features.get(seqid, [])))
+    finally:
+        if close:
+            handle.close()
+
+def read_features(data, feature_types = default_feature_types):
+    '''
+    Iterate over records in a GenBank or GFF3 file, detected from the first
+    line, as Record objects: see read_genbank() and read_gff3().
+    '''
+    handle, close = _open(data)
+    first = handle.readline()
+    def lines():
+        yield(first)
+        for line in handle:
+            yield(line)
+    try:
+        if first.startswith('##gff-version'):
+            reader = read_gff3
+        else:
+            reader = read_genbank
+        for record in reader(lines(), feature_types):
+            yield(record)
+    finally:
+        if close:
+            handle.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+#! /usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Bacterial and Archaeal Genome Analyser
+# Copyright (C) 2015-2016 David Williams
+# david.williams.at.liv.d-dub.org.uk
+# License GPLv3+: GNU GPL version 3 or later
+# This is free software: you are free to change and redistribute it
+# There is NO WARRANTY, to the extent permitted by law
+#
+# Work on this software was started at The University of Liverpool, UK
+# with funding from The Wellcome Trust (093306/Z/10) awarded to:
+# Dr Steve Paterson (The University of Liverpool, UK)
+# Dr Craig Winstanley (The University of Liverpool, UK)
+# Dr Michael A Brockhurst (The University of York, UK)
+#
+'''
+Pairwise module from the Bacterial and Archaeal Genome Analyzer (BAGA).
+
+This module contains a Needleman-Wunsch global aligner with affine gap
+penalties which runs in process, each row of the dynamic programming matrices
+computed at once with NumPy, and a batch interface to align many pairs of
+sequences across a pool of processes. It replaces calls to seq-align's
+needleman_wunsch in the Repeats and Structure modules and uses the same
+default scores.
+'''
+
+# stdlib
+from baga import _multiprocessing
+
+# external Python modules
+import numpy as _np
+
+def main():
+    pass
+
+# lower than any reachable score, but safe to add scores to
+_NEG = -(2**40)
+
+# states of an alignment column and where each is kept in the traceback
+_MATCH, _GAP_B, _GAP_A = 0, 1, 2
+
+def _encode(seq):
+    '''a sequence as an array of upper case bytes for comparisons'''
+    return(_np.frombuffer(seq.upper().encode('ascii'), dtype = _np.uint8))
+
+def _align(seqA, seqB, match, mismatch, gap_open, gap_extend, free_end_gaps):
+    '''
+    Align seqA (one row of matrices per character) to seqB by Gotoh's
+    algorithm: see align()
+    '''
+    m, n = len(seqA), len(seqB)
+    a = _encode(seqA)
+    b = _encode(seqB)
+    cols = _np.arange(n + 1, dtype = _np.int64)
+    first_gap = gap_open + gap_extend
+
+    # best scores ending in each state at each column of the current row:
+    # M: seqA[i-1] aligned to seqB[j-1]
+    # X: seqA[i-1] aligned to a gap (a gap in B)
+    # Y: seqB[j-1] aligned to a gap (a gap in A)
+    M = _np.full(n + 1, _NEG, dtype = _np.int64)
+    M[0] = 0
+    X = _np.full(n + 1, _NEG, dtype = _np.int64)
+    if free_end_gaps:
+        Y = _np.zeros(n + 1, dtype = _np.int64)
+    else:
+        Y = gap_open + gap_extend * cols
+    Y[0] = _NEG
+
+    # previous state of each state in each cell, two bits per state
+    trace = _np.zeros((m + 1, n + 1), dtype = _np.uint8)
+    # scores at the last column for ending in it with free end gaps
+    last_column = [(M[n], X[n], Y[n])]
+    substitutions = {}
+    for i in range(1, m + 1):
+        c = a[i - 1]
+        try:
+            substitution = substitutions[c]
+        except KeyError:
+            substitution = _np.where(b == c, match, mismatch).astype(_np.int64)
+            substitutions[c] = substitution
+
+        # M from any state in the previous row and column
+        best = _np.maximum(M[:-1], X[:-1])
+        from_M = (X[:-1] > M[:-1]).astype(_np.uint8)
+        from_Y = Y[:-1] > best
+        best[from_Y] = Y[:-1][from_Y]
+        from_M[from_Y] = _GAP_A
+        new_M = _np.empty(n + 1, dtype = _np.int64)
+        new_M[0] = _NEG
+        new_M[1:] = best + substitution
+
+        # X from the previous row: open from M or Y, or extend X
+        opened = _np.maximum(M, Y) + first_gap
+        from_X = _np.where(Y > M, _GAP_A, _MATCH).astype(_np.uint8)
+        extended = X + gap_extend
+        new_X = _np.maximum(opened, extended)
+        from_X[extended > opened] = _GAP_B
+        if free_end_gaps:
+            new_X[0] = 0
+
+        # Y from this row: the best gap opened at any earlier column, found
+        # as a running maximum instead of column by column
+        S = _np.maximum(new_M, new_X)
+        from_S = _np.where(new_X > new_M, _GAP_B, _MATCH).astype(_np.uint8)
+        new_Y = _np.empty(n + 1, dtype = _np.int64)
+        new_Y[0] = _NEG
+        new_Y[1:] = _np.maximum.accumulate(S - gap_extend * cols)[:-1] + \
+                first_gap + gap_extend * (cols[1:] - 1)
+        from_Y = from_S.copy()
+        from_Y[1:] = _np.where(new_Y[:-1] + gap_extend > S[:-1] + first_gap,
+                _GAP_A, from_S[:-1])
+
+        trace[i, 1:] = from_M | (from_X[1:] << 2) | (from_Y[1:] << 4)
+        trace[i, 0] = _GAP_B << 2
+        M, X, Y = new_M, new_X, new_Y
+        last_column += [(M[n], X[n], Y[n])]
+
+    # where the alignment ends: the last cell or, if end gaps are free, the
+    # best cell of the last row or column
+    i, j = m, n
+    scores = [M[n], X[n], Y[n]]
+    if free_end_gaps:
+        last_row = _np.maximum(_np.maximum(M, X), Y)
+        j = n - int(_np.argmax(last_row[::-1]))
+        scores = [M[j], X[j], Y[j]]
+        last_column = _np.array(last_column, dtype = _np.int64)
+        best_in_column = last_column.max(axis = 1)
+        end_i = m - int(_np.argmax(best_in_column[::-1]))
+        if best_in_column[end_i] > last_row[j]:
+            i, j = end_i, n
+            scores = list(last_column[i])
+    state = int(_np.argmax(scores))
+
+    # built in reverse from the end
+    alignedA = []
+    alignedB = []
+    if i < m:
+        alignedA += [seqA[i:][::-1]]
+        alignedB += ['-' * (m - i)]
+    if j < n:
+        alignedA += ['-' * (n - j)]
+        alignedB += [seqB[j:][::-1]]
+
+    while i > 0 and j > 0:
+        previous = (int(trace[i, j]) >> (2 * state)) & 3
+        if state == _MATCH:
+            i -= 1
+            j -= 1
+            alignedA += [seqA[i]]
+            alignedB += [seqB[j]]
+        elif state == _GAP_B:
+            i -= 1
+            alignedA += [seqA[i]]
+            alignedB += ['-']
+        else:
+            j -= 1
+            alignedA += ['-']
+            alignedB += [seqB[j]]
+        state = previous
+
+    if i > 0:
+        alignedA += [seqA[:i][::-1]]
+        alignedB += ['-' * i]
+    if j > 0:
+        alignedA += ['-' * j]
+        alignedB += [seqB[:j][::-1]]
+
+    return(''.join(alignedA)[::-1], ''.join(alignedB)[::-1])
+
+def align(seqA, seqB, match = 1, mismatch = -2, gap_open = -4, 
+        gap_extend = -1, free_end_gaps = False):
+    '''
+    Needleman-Wunsch global alignment of two sequences with affine gaps
+
+    seqA and seqB can be str or anything that str() makes into a sequence
+    e.g., BioPython Seq or baga's GenomeSequence. Characters are compared
+    ignoring case. A gap of length n scores gap_open + n * gap_extend. If
+    free_end_gaps, gaps at either end of either sequence are not penalised
+    (as seq-align's --freestartgap --freeendgap).
+
+    returns two str of aligned sequences with '-' for gaps
+    '''
+    seqA = str(seqA)
+    seqB = str(seqB)
+    scores = match, mismatch, gap_open, gap_extend, free_end_gaps
+    # matrices are computed a row at a time: fewer, longer rows are quicker
+    if len(seqA) > len(seqB):
+        alignedB, alignedA = _align(seqB, seqA, *scores)
+    else:
+        alignedA, alignedB = _align(seqA, seqB, *scores)
+    return(alignedA, alignedB)
+
+def _align_pair(args):
+    '''align() for multiprocessing'''
+    seqA, seqB, options = args
+    return(align(seqA, seqB, **options))
+
+def align_pairs(pairs, max_processes = 1, pool = None, **options):
+    '''
+    Align each of a list of (seqA, seqB) pairs as align() with the same
+    options, shared among the processes of pool or else max_processes new 
+    processes. For many small batches, pass a pool made once by the caller 
+    so processes are not started for each batch.
+
+    returns list of (alignedA, alignedB) in the same order as pairs
+    '''
+    args = [(str(seqA), str(seqB), options) for seqA,seqB in pairs]
+    num_processes = max(1, min(max_processes, len(args)))
+    if len(args) > 1 and (pool is not None or num_processes > 1):
+        own_pool = pool is None
+        if own_pool:
+            pool = _multiprocessing.Pool(num_processes)
+        # longest first so a long alignment is not left until last
+        order = sorted(range(len(args)), key = lambda i: 
+                -len(args[i][0]) * len(args[i][1]))
+        results = pool.map(_align_pair, [args[i] for i in order], 
+                chunksize = 1)
+        if own_pool:
+            pool.close()
+            pool.join()
+        aligned = [None] * len(args)
+        for i,result in zip(order, results):
+            aligned[i] = result
+        return(aligned)
+    return([_align_pair(a) for a in args])
+
+
+if __name__ == '__main__':
+    main()
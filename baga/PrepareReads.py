@@ -30,16 +30,22 @@ from baga import _pickle
 from baga import _gzip
 from baga import _time
 from baga import _re
-from cStringIO import StringIO as _StringIO
-from random import sample as _sample
+from baga import _threading
+import random as _random
+try:
+    from queue import Queue as _Queue
+except ImportError:
+    from Queue import Queue as _Queue
 
 # external Python modules
-from Bio import SeqIO as _SeqIO
+import numpy as _np
 
 # package functions
 from baga import decide_max_processes as _decide_max_processes
 from baga import get_exe_path as _get_exe_path
 from baga import report_time as _report_time
+from baga import JobScheduler as _JobScheduler
+from baga.ReadStats import ReadStatsIndex as _ReadStatsIndex
 def main():
     pass
 def cpu_count():
@@ -76,6 +82,357 @@ def insert_suffix(path, insert_suffix, known_suffixes = ['.fastq.gz','.fq.gz','.
     assert this_suffix, 'Could not find any known suffixes in {} . . . please report this as a bug.'.format(path)
     processed_path = _re.sub(this_suffix+'$', insert_suffix+this_suffix, path)
     return(processed_path)
+class _BackgroundWriter(object):
+    '''
+    Write to a gzip file from a separate thread
+
+    Compression (which releases the GIL) overlaps with reading and sampling 
+    in the calling thread. Data are passed via a bounded queue.
+    '''
+    def __init__(self, path, max_chunks = 64):
+        self.fout = _gzip.open(path, 'wb')
+        self.queue = _Queue(max_chunks)
+        self.thread = _threading.Thread(target = self._write)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def _write(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            self.fout.write(chunk)
+        self.fout.close()
+    
+    def write(self, chunk):
+        self.queue.put(chunk)
+    
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def _open_fastq(path):
+    if path.endswith('gz'):
+        return(_gzip.open(path, 'rb'))
+    else:
+        return(open(path, 'rb'))
+
+
+def _fastq_pairs(fh1, fh2):
+    '''
+    Yield pairs of FASTQ records (each the bytes of four lines) from two file 
+    handles read in lockstep, checking each record is well formed.
+    '''
+    while True:
+        read1 = b''.join([fh1.readline() for i in range(4)])
+        read2 = b''.join([fh2.readline() for i in range(4)])
+        if not read1 and not read2:
+            break
+        for read,fh in ((read1,fh1),(read2,fh2)):
+            lines = read.split(b'\n')
+            if len(lines) < 4 or lines[0][:1] != b'@' or lines[2][:1] != b'+' or \
+                    len(lines[1]) != len(lines[3]):
+                raise ValueError('Malformed or truncated FASTQ record in {}: '\
+                        '{}'.format(fh.name, read[:200]))
+        yield(read1, read2)
+
+
+def subsample_pair(args):
+    '''
+    Uniformly subsample a pair of FASTQ files in a single pass
+
+    args is a tuple of (pairname, path to reads 1, path to reads 2, path for 
+    subsampled reads 1, path for subsampled reads 2, genome_size, 
+    read_cov_depth, pc_loss, cov_closeness, seed, total read pairs, read 
+    length) as used by Reads.subsample(), the last two being None if not 
+    known. A single tuple allows use with multiprocessing.Pool.
+
+    If the number of read pairs is known (e.g., from baga.ReadStats), 
+    whether to sample at all is decided without reading the files. 
+    Otherwise the read pairs are counted in a first pass. Pairs are then 
+    selected as read (Algorithm S) and streamed to background gzip writers 
+    so memory use does not depend on the number of reads kept. If sampling 
+    is not worthwhile, the original files are kept.
+
+    returns (pairname, read length, total read pairs, read pairs kept, 
+    {1: path, 2: path} to use)
+    '''
+    (pairname, path1, path2, out_path1, out_path2, genome_size, 
+            read_cov_depth, pc_loss, cov_closeness, seed, totalreads, 
+            read_len) = args
+    
+    def to_keep(read_len):
+        return(int( round(genome_size * read_cov_depth / \
+                float(read_len * 2) / (1 - pc_loss), 0) ))
+    
+    def worthwhile(read_len, totalreads, numreads2keep):
+        full_depth_coverage = read_len * 2 * totalreads * (1 - pc_loss) / \
+                float(genome_size)
+        return(numreads2keep < totalreads and \
+                full_depth_coverage >= read_cov_depth + cov_closeness)
+    
+    if seed is None:
+        rng = _random.Random()
+    else:
+        # distinct but reproducible per pair
+        rng = _random.Random('{}:{}'.format(seed, pairname))
+    
+    if totalreads is None:
+        # count read pairs so they can be selected as read in a second pass
+        read_len = 0
+        totalreads = 0
+        fh1 = _open_fastq(path1)
+        fh2 = _open_fastq(path2)
+        for read1,read2 in _fastq_pairs(fh1, fh2):
+            if not totalreads:
+                read_len = len(read1.split(b'\n')[1])
+            totalreads += 1
+        
+        fh1.close()
+        fh2.close()
+        if not totalreads:
+            return(pairname, read_len, totalreads, 0, {1: path1, 2: path2})
+    
+    numreads2keep = to_keep(read_len)
+    if not worthwhile(read_len, totalreads, numreads2keep):
+        return(pairname, read_len, totalreads, numreads2keep, 
+                {1: path1, 2: path2})
+    
+    fh1 = _open_fastq(path1)
+    fh2 = _open_fastq(path2)
+    batch_size = 10000
+    
+    # Algorithm S: selection sampling of exactly numreads2keep pairs
+    fout1 = _BackgroundWriter(out_path1)
+    fout2 = _BackgroundWriter(out_path2)
+    selected = 0
+    batch1, batch2 = [], []
+    for seen,(read1,read2) in enumerate(_fastq_pairs(fh1, fh2)):
+        if (totalreads - seen) * rng.random() < numreads2keep - selected:
+            batch1 += [read1]
+            batch2 += [read2]
+            selected += 1
+            if len(batch1) == batch_size:
+                fout1.write(b''.join(batch1))
+                fout2.write(b''.join(batch2))
+                batch1, batch2 = [], []
+            if selected == numreads2keep:
+                break
+    
+    fout1.write(b''.join(batch1))
+    fout2.write(b''.join(batch2))
+    fout1.close()
+    fout2.close()
+    fh1.close()
+    fh2.close()
+    return(pairname, read_len, totalreads, selected, 
+            {1: out_path1, 2: out_path2})
+
+
+# Illumina TruSeq library preparation sequences: see Reads.cutAdaptors()
+adaptor_seqs = [
+    'AGATCGGAAGAGCACACGTCTGAACTCCAGTCAC',
+    'AGATCGGAAGAGCACACGTCT',
+    'AGATCGGAAGAGC',
+    'GATCGGAAGAGCGGTTCAGCAGGAATGCCGAG',
+    'ACACTCTTTCCCTACACGACGCTCTTCCGATCT',
+]
+
+
+def _by_length(strings):
+    '''dict of length => indices of strings of that length'''
+    groups = {}
+    for i,string in enumerate(strings):
+        groups.setdefault(len(string), []).append(i)
+    return(groups)
+
+
+def adaptor_cuts(seqs, adaptors = adaptor_seqs, max_error_rate = 0.1, 
+        min_overlap = 3, batch_size = 2000):
+    '''
+    Where to cut each read to remove 3' adaptor sequences
+
+    As for a 3' adaptor in cutadapt (-a), an adaptor may occur anywhere in a 
+    read or overlap its 3' end by at least min_overlap bases, with up to 
+    max_error_rate mismatches per aligned base. Each read is cut at the 
+    earliest such match of any adaptor. Reads of the same length are 
+    compared with every offset of each adaptor at once as NumPy arrays.
+
+    seqs is a list of sequences as bytes
+
+    returns NumPy array of lengths to keep
+    '''
+    cuts = _np.array([len(seq) for seq in seqs], dtype = _np.int64)
+    adaptors = [_np.frombuffer(a.encode('ascii'), dtype = _np.uint8) for a in \
+            adaptors]
+    for length,indices in _by_length(seqs).items():
+        if length < min_overlap:
+            continue
+        offsets = _np.arange(length - min_overlap + 1)
+        for b in range(0, len(indices), batch_size):
+            these = indices[b:b+batch_size]
+            reads = _np.frombuffer(b''.join([seqs[i] for i in these]), 
+                    dtype = _np.uint8).reshape(len(these), length)
+            these_cuts = _np.full(len(these), length, dtype = _np.int64)
+            for adaptor in adaptors:
+                alen = len(adaptor)
+                # zero padding never matches and is outside the overlap
+                padded = _np.zeros((len(these), length + alen), dtype = _np.uint8)
+                padded[:, :length] = reads
+                windows = _np.lib.stride_tricks.as_strided(padded, 
+                        shape = (len(these), len(offsets), alen), 
+                        strides = (padded.strides[0], padded.strides[1], 
+                        padded.strides[1]))
+                overlaps = _np.minimum(alen, length - offsets)
+                in_overlap = _np.arange(alen)[None,:] < overlaps[:,None]
+                errors = ((windows != adaptor) & in_overlap).sum(axis = 2)
+                allowed = _np.floor(overlaps * max_error_rate)
+                matches = errors <= allowed
+                found = matches.any(axis = 1)
+                first = matches.argmax(axis = 1)
+                these_cuts = _np.where(found, _np.minimum(these_cuts, first), 
+                        these_cuts)
+            cuts[these] = these_cuts
+    return(cuts)
+
+
+def quality_trims(quals, lengths, threshold = 25, min_length = 50, offset = 33):
+    '''
+    Where to trim each read by quality score
+
+    As for sickle (sliding window): windows are one tenth of the read length. 
+    The 5' end is trimmed to the first base of at least threshold in the 
+    first window of mean quality of at least threshold and the 3' end at the 
+    first base below threshold in the first window of lower mean quality. 
+    Reads with a window of lower mean quality before any good window, 
+    without a good window or shorter than min_length after trimming are 
+    discarded. Reads of the same length are trimmed together with 
+    window means from cumulative sums.
+
+    quals is a list of quality strings as bytes, lengths the number of bases 
+    to consider in each e.g., after adaptor_cuts()
+
+    returns NumPy arrays of start, end and whether to keep each read
+    '''
+    starts = _np.zeros(len(quals), dtype = _np.int64)
+    ends = _np.zeros(len(quals), dtype = _np.int64)
+    keep = _np.zeros(len(quals), dtype = bool)
+    quals = [q[:l] for q,l in zip(quals, lengths)]
+    for length,indices in _by_length(quals).items():
+        if length == 0:
+            continue
+        scores = _np.frombuffer(b''.join([quals[i] for i in indices]), 
+                dtype = _np.uint8).reshape(len(indices), length).astype(
+                _np.int64) - offset
+        window = int(0.1 * length) or length
+        sums = _np.zeros((len(indices), length + 1), dtype = _np.int64)
+        _np.cumsum(scores, axis = 1, out = sums[:, 1:])
+        good_windows = sums[:, window:] - sums[:, :-window] >= \
+                threshold * window
+        five_window = good_windows.argmax(axis = 1)
+        positions = _np.arange(length)
+        # first good base in the first good window
+        in_window = (positions[None,:] >= five_window[:,None]) & \
+                (positions[None,:] < five_window[:,None] + window)
+        five_cut = ((scores >= threshold) & in_window).argmax(axis = 1)
+        # first bad base in the first bad window
+        bad_windows = ~good_windows
+        has_three = bad_windows.any(axis = 1)
+        three_window = bad_windows.argmax(axis = 1)
+        # sickle stops at the first bad window even if no good window was 
+        # found before it
+        has_five = good_windows.any(axis = 1) & \
+                (~has_three | (five_window < three_window))
+        in_window = (positions[None,:] >= three_window[:,None]) & \
+                (positions[None,:] < three_window[:,None] + window)
+        three_cut = _np.where(has_three, ((scores < threshold) & \
+                in_window).argmax(axis = 1), length)
+        starts[indices] = five_cut
+        ends[indices] = three_cut
+        keep[indices] = has_five & (three_cut - five_cut >= min_length)
+    return(starts, ends, keep)
+
+
+def cut_and_trim_pair(args):
+    '''
+    Remove adaptors and trim by quality a pair of FASTQ files in one pass
+
+    args is a tuple of (pairname, path to reads 1, path to reads 2, path for 
+    trimmed reads 1, path for trimmed reads 2, path for singletons, 
+    adaptors, quality threshold, minimum length) as used by 
+    Reads.cutAndTrim(). A single tuple allows use with multiprocessing.Pool.
+
+    Batches of read pairs are processed with adaptor_cuts() then 
+    quality_trims(). Pairs with both reads kept are written to the paired 
+    outputs and those with one kept to the singletons, by background gzip 
+    writers.
+
+    returns (pairname, read pairs, pairs kept, singletons kept)
+    '''
+    (pairname, path1, path2, out_path1, out_path2, out_path_s, adaptors, 
+            threshold, min_length) = args
+    
+    fh1 = _open_fastq(path1)
+    fh2 = _open_fastq(path2)
+    outs = [_BackgroundWriter(out_path1), _BackgroundWriter(out_path2)]
+    out_s = _BackgroundWriter(out_path_s)
+    
+    def process(batch):
+        trimmed = []
+        for reads in zip(*batch):
+            records = [read.split(b'\n') for read in reads]
+            cuts = adaptor_cuts([r[1] for r in records], adaptors)
+            starts, ends, keep = quality_trims([r[3] for r in records], cuts, 
+                    threshold, min_length)
+            trimmed += [(records, starts, ends, keep)]
+        
+        paired = ([], [])
+        singles = []
+        num_paired = num_singles = 0
+        for i in range(len(batch)):
+            kept = [(m, these[0][i], these[1][i], these[2][i]) for m,these \
+                    in enumerate(trimmed) if these[3][i]]
+            if len(kept) == 2:
+                use = paired
+                num_paired += 1
+            else:
+                use = None
+                num_singles += len(kept)
+            for m,record,start,end in kept:
+                text = b'\n'.join([record[0], record[1][start:end], record[2], 
+                        record[3][start:end]]) + b'\n'
+                if use is None:
+                    singles += [text]
+                else:
+                    use[m].append(text)
+        
+        outs[0].write(b''.join(paired[0]))
+        outs[1].write(b''.join(paired[1]))
+        out_s.write(b''.join(singles))
+        return(num_paired, num_singles)
+    
+    totals = [0, 0, 0]
+    batch = []
+    for pair in _fastq_pairs(fh1, fh2):
+        batch += [pair]
+        if len(batch) == 20000:
+            totals[0] += len(batch)
+            totals[1:] = [a + b for a,b in zip(totals[1:], process(batch))]
+            batch = []
+    
+    if batch:
+        totals[0] += len(batch)
+        totals[1:] = [a + b for a,b in zip(totals[1:], process(batch))]
+    
+    for fout in outs + [out_s]:
+        fout.close()
+    fh1.close()
+    fh2.close()
+    
+    return(tuple([pairname] + totals))
+
+
 class Reads:
     '''
     Prepare reads for alignment to genome sequence by removing adaptor sequences 
@@ -119,7 +476,9 @@ class Reads:
                         read_cov_depth = 80, 
                         pc_loss = 0.2, 
                         force = False, 
-                        cov_closeness = 5):
+                        cov_closeness = 5, 
+                        seed = None, 
+                        max_cpus = -1):
         '''
         Given the size in basepairs of a genome sequence, downsample fastq files to a 
         desired average read coverage depth predicted after read alignment. Read lengths
@@ -128,11 +487,22 @@ class Reads:
         used in coverage depth estimation. cov_closeness, which defaults to 5, will prevent
         subsampling if within 5x coverage: avoids time consuming subsampling that will only 
         make a small difference.
+
+        Each pair of files is read in lockstep, streaming a uniform random 
+        sample of read pairs to the output (see subsample_pair()) so memory 
+        use does not depend on the number of reads. Read counts saved by 
+        CollectData.Reads.collectStats() are used if available so files are 
+        read once, or not at all if no sampling is needed. Otherwise they are 
+        counted in a first pass. Pairs of files are processed in parallel 
+        by up to max_cpus processes. Provide a seed for reproducible samples.
         '''
 
+        max_processes = _decide_max_processes( max_cpus )
+        stats_index = _ReadStatsIndex()
+
         subsampled_read_files = {}
-        start_time = _time.time()
-        for cnum,(pairname,files) in enumerate(self.read_files.items()):
+        to_subsample = []
+        for pairname,files in self.read_files.items():
             
             processed_path_1 = insert_suffix(files[1], '_subsmp')
             processed_path_2 = insert_suffix(files[2], '_subsmp')
@@ -140,221 +510,63 @@ class Reads:
             if not all([_os.path.exists(processed_path_1), 
                         _os.path.exists(processed_path_2)]) \
                     or force:
-                
-                if files[1][-2:] == 'gz':
-                    fh1 = _gzip.open(files[1])
-                else:
-                    fh1 = open(files[1])
-                
-                aread = _SeqIO.parse(fh1, 'fastq').next()
-                read_len = len(aread.seq)
-                
-                print('Counting reads in %s' % files[1])
-                fh1.seek(0)
-                lines = 0
-                # report per half million reads
-                interval = 2000000
-                nextreport = interval
-                for line in fh1:
-                    lines += 1
-                    if lines == nextreport:
-                        print('{:,} reads'.format(lines/4))
-                        nextreport += interval
-                
-                totalreads = lines / 4.0
-                print('Found %s reads' % totalreads)
-                full_depth_coverage = read_len * 2 * totalreads * (1 - pc_loss) / genome_size
-                print('These paired read files would provide approximately {:.1f}x coverage depth'.format(full_depth_coverage))
-                numreads2keep = int( round(genome_size * read_cov_depth / (read_len * 2) /  (1 - pc_loss), 0) )
-                
-                if numreads2keep >= totalreads:
-                    print('This pair of read files is estimated to provide only {:.1f}x coverage, but {}x requested.'.format(full_depth_coverage, read_cov_depth))
-                    print('No sampling performed. Original files will be used')
-                    # pass original files over with subsampled
-                    subsampled_read_files[pairname] = {}
-                    subsampled_read_files[pairname][1] = files[1]
-                    subsampled_read_files[pairname][2] = files[2]
-                    fh1.close()
-                    if len(self.read_files) > 1:
-                        # report durations, time left etc
-                        _report_time(start_time, cnum, len(self.read_files))
-                    
-                    continue
-                elif full_depth_coverage < read_cov_depth + cov_closeness:
-                    print('This pair of read files is estimated to provide {:.1f}x coverage which is within {}x of {}x requested.'.format(full_depth_coverage, cov_closeness, read_cov_depth))
-                    print('No sampling performed. Original files will be used')
-                    # pass original files over with subsampled
-                    subsampled_read_files[pairname] = {}
-                    subsampled_read_files[pairname][1] = files[1]
-                    subsampled_read_files[pairname][2] = files[2]
-                    fh1.close()
-                    if len(self.read_files) > 1:
-                        # report durations, time left etc
-                        _report_time(start_time, cnum, len(self.read_files))
-                    
-                    continue
+                # read counts from CollectData.Reads.collectStats() if available
+                stats = stats_index.load(files[1])
+                if stats is not None:
+                    totalreads, read_len = stats['reads'], stats['mode_length']
                 else:
-                    print('For approximately {}x read coverage, will retain {} of {} {}bp read pairs'.format(
-                                    read_cov_depth, numreads2keep, totalreads, read_len))
-                    
-                    fh1.seek(0)
-                    if files[2][-2:] == 'gz':
-                        fh2 = _gzip.open(files[2])
-                    else:
-                        fh2 = open(files[2])
-                    
-                    fout1 = _gzip.open(processed_path_1, 'wb')
-                    fout2 = _gzip.open(processed_path_2, 'wb')
-                    
-                    batch_size = 200000
-                    keep_per_pop = int(numreads2keep / float(totalreads) * batch_size) + 1
-                    nextwrite = batch_size
-                    written = 0
-                    n1 = 0
-                    n2 = 0
-                    these_lines1 = []
-                    these_lines2 = []
-                    reportfreq = 10
-                    thisreport = 0
-                    print('Subsampling . . .')
-                    for line in fh1:
-                        these_lines1 += [line]
-                        if len(these_lines1) % 4 == 0:
-                            n1 += 1
-                            
-                        if n1 == nextwrite:
-                            keep_indices = sorted(_sample(xrange(batch_size), keep_per_pop))
-                            keep_these = []
-                            for i in keep_indices:
-                                i1 = i * 4
-                                i2 = i * 4 + 4
-                                keep_these += these_lines1[i1:i2]
-                            
-                            # try parsing a read for QC
-                            assert _SeqIO.read(_StringIO(''.join(keep_these[:4])), 'fastq')
-                            fout1.write(''.join(keep_these))
-                            these_lines1 = []
-                            written += keep_per_pop
-                            thisreport += 1
-                            if thisreport == reportfreq or written == keep_per_pop:
-                                # report first time and at intevals
-                                print('Written {:,} reads ({:.1%}) to {}'.format(written,
-                                                                                 written/float(numreads2keep),
-                                                                                 processed_path_1))
-                            
-                            for line2 in fh2:
-                                these_lines2 += [line2]
-                                if len(these_lines2) % 4 == 0:
-                                    n2 += 1
-                                
-                                if n2 == nextwrite:
-                                    keep_these = []
-                                    for i in keep_indices:
-                                        i1 = i * 4
-                                        i2 = i * 4 + 4
-                                        keep_these += these_lines2[i1:i2]
-                                    
-                                    assert _SeqIO.read(_StringIO(''.join(keep_these[:4])), 'fastq')
-                                    fout2.write(''.join(keep_these))
-                                    these_lines2 = []
-                                    if thisreport == reportfreq or written == keep_per_pop:
-                                        thisreport = 0
-                                        print('Written {:,} reads ({:.1%}) to {}'.format(written,
-                                                                                         written/float(numreads2keep),
-                                                                                         processed_path_2))
-                                    nextwrite += batch_size
-                                    break
-                    
-                    # write remainder
-                    remainder = nextwrite - n1
-                    keep_in_remainder = int(keep_per_pop * (remainder / float(batch_size))) + 1
-                    keep_indices = sorted(_sample(xrange(remainder), keep_in_remainder))
-                    keep_these = []
-                    for i in keep_indices:
-                        i1 = i * 4
-                        i2 = i * 4 + 4
-                        keep_these += these_lines1[i1:i2]
-                    
-                    # try parsing a read for QC
-                    assert _SeqIO.read(_StringIO(''.join(keep_these[:4])), 'fastq')
-                    fout1.write(''.join(keep_these))
-                    written += keep_in_remainder
-                    print('Written {:,} reads ({:.1%}) to {}'.format(written,
-                                                                             written/float(numreads2keep),
-                                                                             processed_path_1))
-                    
-                    # get remainder
-                    for line2 in fh2:
-                        these_lines2 += [line2]
-                    
-                    # write remainder
-                    keep_these = []
-                    for i in keep_indices:
-                        i1 = i * 4
-                        i2 = i * 4 + 4
-                        keep_these += these_lines2[i1:i2]
-                    
-                    assert _SeqIO.read(_StringIO(''.join(keep_these[:4])), 'fastq') ###### check why keep_these was empty
-                    fout2.write(''.join(keep_these))
-                    print('Written {:,} reads ({:.1%}) to {}'.format(written,
-                                                                             written/float(numreads2keep),
-                                                                             processed_path_2))
-                    
-                    # not sure if this is quicker/slower (more calls to .join())
-                    # this_read = []
-                    # for line in fh1:
-                        # this_read += [line]
-                        # if len(this_read) == 4:
-                            # these_reads1 += [''.join(this_read)]
-                            # #these_reads1 += this_read
-                            # this_read = []
-                            # n1 += 1
-                            
-                        # if n1 == nextwrite:
-                            # keep_indices = sorted(_sample(xrange(batch_size), keep_per_pop))
-                            # # try parsing a read for QC
-                            # assert _SeqIO.read(_StringIO(these_reads1[0]), 'fastq')
-                            # fout1.write(''.join([these_reads1[i] for i in keep_indices]))
-                            # these_reads1 = []
-                            # written += keep_per_pop
-                            # print('Written {:,} reads ({:.2%}) to {}'.format(written,
-                                                                             # written/float(numreads2keep),
-                                                                             # processed_path_1))
-                            # for line2 in fh2:
-                                # this_read += [line2]
-                                # if len(this_read) == 4:
-                                    # these_reads2 += [''.join(this_read)]
-                                    # this_read = []
-                                    # n2 += 1
-                                
-                                # if n2 == nextwrite:
-                                    # assert _SeqIO.read(_StringIO(these_reads2[0]), 'fastq')
-                                    # fout2.write(''.join([these_reads2[i] for i in keep_indices]))
-                                    # these_reads2 = []
-                                    # print('Written {:,} reads ({:.2%}) to {}'.format(written,
-                                                                                     # written/float(numreads2keep),
-                                                                                     # processed_path_2))
-                                    # nextwrite += batch_size
-                                    # break
-                    
-                    fout1.close()
-                    fout2.close()
-                    fh1.close()
-                    fh2.close()
-                
+                    totalreads, read_len = None, None
+                to_subsample += [(pairname, files[1], files[2], 
+                        processed_path_1, processed_path_2, genome_size, 
+                        read_cov_depth, pc_loss, cov_closeness, seed, 
+                        totalreads, read_len)]
             else:
                 print('Found:')
                 print(processed_path_1)
                 print(processed_path_2)
                 print('use "force = True" to overwrite')
+                subsampled_read_files[pairname] = {}
+                subsampled_read_files[pairname][1] = processed_path_1
+                subsampled_read_files[pairname][2] = processed_path_2
+
+        if to_subsample:
+            print('Subsampling {} pairs of read files . . .'.format(len(to_subsample)))
+            start_time = _time.time()
+            if max_processes > 1 and len(to_subsample) > 1:
+                pool = _multiprocessing.Pool(min(max_processes, len(to_subsample)))
+                results = pool.imap_unordered(subsample_pair, to_subsample)
+            else:
+                pool = None
+                results = (subsample_pair(args) for args in to_subsample)
             
-            if len(self.read_files) > 1:
-                # report durations, time left etc
-                _report_time(start_time, cnum, len(self.read_files))
+            for cnum,(pairname, read_len, totalreads, numreads2keep, 
+                    outfiles) in enumerate(results):
+                full_depth_coverage = read_len * 2 * totalreads * \
+                        (1 - pc_loss) / float(genome_size)
+                print('{}: {:,} {}bp read pairs would provide approximately '\
+                        '{:.1f}x coverage depth'.format(pairname, totalreads, 
+                        read_len, full_depth_coverage))
+                if numreads2keep >= totalreads:
+                    print('This is less than the {}x requested. No sampling '\
+                            'performed. Original files will be used'.format(
+                            read_cov_depth))
+                elif full_depth_coverage < read_cov_depth + cov_closeness:
+                    print('This is within {}x of {}x requested. No sampling '\
+                            'performed. Original files will be used'.format(
+                            cov_closeness, read_cov_depth))
+                else:
+                    print('For approximately {}x read coverage, retained {:,} of '\
+                            '{:,} read pairs in:\n{}\n{}'.format(read_cov_depth, 
+                            numreads2keep, totalreads, outfiles[1], outfiles[2]))
+                
+                subsampled_read_files[pairname] = outfiles
+                if len(to_subsample) > 1:
+                    # report durations, time left etc
+                    _report_time(start_time, cnum, len(to_subsample))
             
-            subsampled_read_files[pairname] = {}
-            subsampled_read_files[pairname][1] = processed_path_1
-            subsampled_read_files[pairname][2] = processed_path_2
+            if pool is not None:
+                pool.close()
+                pool.join()
 
         # replace here as this step is optional
         self.fullsized_read_files = list(self.read_files)
@@ -366,13 +578,6 @@ class Reads:
             path_to_exe = _get_exe_path('cutadapt')
 
         adaptorcut_read_files = {}
-        adaptor_seqs = [
-            'AGATCGGAAGAGCACACGTCTGAACTCCAGTCAC',
-            'AGATCGGAAGAGCACACGTCT',
-            'AGATCGGAAGAGC',
-            'GATCGGAAGAGCGGTTCAGCAGGAATGCCGAG',
-            'ACACTCTTTCCCTACACGACGCTCTTCCGATCT',
-        ]
 
 
         cmds = []
@@ -418,38 +623,22 @@ class Reads:
 
 
         if len(cmds):
-            max_processes = _decide_max_processes(max_cpus)
-            
-            processes = {}
-            
-            ### how to combine this which hangs on _os.wait()
-            for pairname,cmd in cmds:
-                
-                print('Called: "%s"' % ' '.join(cmd))
-                # process is key, open file being piped to is value
+            scheduler = _JobScheduler(max_cpus = max_cpus)
+            for (pairname,cmd),processed_paths in zip(cmds,processed_paths_to_do):
                 # baga CollectReads currently includes path in pairname
-                this_stdout_file = open(pairname+'_cutadapt.log',"w")
-                thisprocess = _subprocess.Popen(cmd, shell=False, stdout = this_stdout_file)
-                processes[thisprocess] = this_stdout_file
-                
-                if len(processes) >= max_processes:
-                    _os.wait()
-                    finished = dict([(p,f) for p,f in processes.items() if p.poll() is not None])
-                    # close files for finished processes
-                    for process,stdout_file in finished.items():
-                        stdout_file.close()
-                        # update active processes
-                        del processes[process]
+                scheduler.add(cmd, pairname, outputs = processed_paths, 
+                        stdout_filename = pairname+'_cutadapt.log')
             
-            # Check if all the child processes were closed
-            for p in processes:
-                if p.poll() is None:
-                    p.wait()
+            failed_pairnames = scheduler.run()
+        else:
+            failed_pairnames = []
 
 
         fails = []
         for (pairname,cmd),(processed_path_1,processed_path_2) in zip(cmds,processed_paths_to_do):
-            if _os.path.exists(processed_path_1) and _os.path.exists(processed_path_2):
+            if pairname not in failed_pairnames and \
+                    _os.path.exists(processed_path_1) and \
+                    _os.path.exists(processed_path_2):
                 print('Found:')
                 print(processed_path_1)
                 print(processed_path_2)
@@ -466,6 +655,70 @@ class Reads:
 
         self.adaptorcut_read_files = adaptorcut_read_files
 
+    def cutAndTrim(self, force = False, max_cpus = -1, adaptors = adaptor_seqs, 
+            quality = 25, min_length = 50):
+        '''
+        Remove adaptor sequences and trim by quality score within baga
+
+        An alternative to cutAdaptors() then trim() which reads and writes 
+        each pair of files once without the intermediate adaptor-cut files: 
+        see cut_and_trim_pair(). Adaptors are the same as for cutAdaptors() 
+        and quality trimming follows sickle as run by trim() (-q 25 -l 50). 
+        Pairs of files are processed in parallel by up to max_cpus processes.
+        Outputs are named as if from cutAdaptors() then trim().
+        '''
+        max_processes = _decide_max_processes( max_cpus )
+
+        trimmed_read_files = {}
+        to_process = []
+        for pairname,files in self.read_files.items():
+            processed_path_1 = insert_suffix(files[1], '_adpt_qual')
+            processed_path_2 = insert_suffix(files[2], '_adpt_qual')
+            processed_path_s = insert_suffix(files[2], '_adpt_singletons_qual')
+            
+            if not all([_os.path.exists(processed_path_1), 
+                        _os.path.exists(processed_path_2),
+                        _os.path.exists(processed_path_s)]) \
+                    or force:
+                to_process += [(pairname, files[1], files[2], processed_path_1, 
+                        processed_path_2, processed_path_s, adaptors, quality, 
+                        min_length)]
+            else:
+                print('Found:')
+                print(processed_path_1)
+                print(processed_path_2)
+                print(processed_path_s)
+                print('use "force = True" to overwrite')
+            
+            trimmed_read_files[pairname] = {}
+            trimmed_read_files[pairname][1] = processed_path_1
+            trimmed_read_files[pairname][2] = processed_path_2
+
+        if to_process:
+            print('Removing adaptors and trimming {} pairs of read files . . .'\
+                    ''.format(len(to_process)))
+            start_time = _time.time()
+            if max_processes > 1 and len(to_process) > 1:
+                pool = _multiprocessing.Pool(min(max_processes, len(to_process)))
+                results = pool.imap_unordered(cut_and_trim_pair, to_process)
+            else:
+                pool = None
+                results = (cut_and_trim_pair(args) for args in to_process)
+            
+            for cnum,(pairname, total, paired, singles) in enumerate(results):
+                print('{}: kept {:,} of {:,} read pairs ({:.1%}) and {:,} '\
+                        'singletons'.format(pairname, paired, total, 
+                        paired / float(total or 1), singles))
+                if len(to_process) > 1:
+                    # report durations, time left etc
+                    _report_time(start_time, cnum, len(to_process))
+            
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.trimmed_read_files = trimmed_read_files
+
     def trim(self, path_to_exe = False, 
                    force = False, 
                    max_cpus = -1):
@@ -533,38 +786,22 @@ class Reads:
 
 
         if len(cmds):
-            max_processes = _decide_max_processes(max_cpus)
-            
-            processes = {}
-            
-            ### how to combine this which hangs on _os.wait()
-            for pairname,cmd in cmds:
-                
-                print('Called: "%s"' % ' '.join(cmd))
-                # process is key, open file being piped to is value
+            scheduler = _JobScheduler(max_cpus = max_cpus)
+            for (pairname,cmd),processed_paths in zip(cmds,processed_paths_to_do):
                 # baga CollectReads currently includes path in pairname
-                this_stdout_file = open(pairname+'_sickle.log',"w")
-                thisprocess = _subprocess.Popen(cmd, shell = False, stdout = this_stdout_file)
-                processes[thisprocess] = this_stdout_file
-                
-                if len(processes) >= max_processes:
-                    _os.wait()
-                    finished = dict([(p,f) for p,f in processes.items() if p.poll() is not None])
-                    # close files for finished processes
-                    for process,stdout_file in finished.items():
-                        stdout_file.close()
-                        # update active processes
-                        del processes[process]
+                scheduler.add(cmd, pairname, outputs = processed_paths, 
+                        stdout_filename = pairname+'_sickle.log')
             
-            # Check if all the child processes were closed
-            for p in processes:
-                if p.poll() is None:
-                    p.wait()
+            failed_pairnames = scheduler.run()
+        else:
+            failed_pairnames = []
 
 
         fails = []
         for (pairname,cmd),(processed_path_1,processed_path_2,processed_path_s) in zip(cmds,processed_paths_to_do):
-            if _os.path.exists(processed_path_1) and _os.path.exists(processed_path_2):
+            if pairname not in failed_pairnames and \
+                    _os.path.exists(processed_path_1) and \
+                    _os.path.exists(processed_path_2):
                 print('Found:')
                 print(processed_path_1)
                 print(processed_path_2)
@@ -0,0 +1,289 @@
+#! /usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Bacterial and Archaeal Genome Analyser
+# Copyright (C) 2015-2016 David Williams
+# david.williams.at.liv.d-dub.org.uk
+# License GPLv3+: GNU GPL version 3 or later
+# This is free software: you are free to change and redistribute it
+# There is NO WARRANTY, to the extent permitted by law
+#
+# Work on this software was started at The University of Liverpool, UK
+# with funding from The Wellcome Trust (093306/Z/10) awarded to:
+# Dr Steve Paterson (The University of Liverpool, UK)
+# Dr Craig Winstanley (The University of Liverpool, UK)
+# Dr Michael A Brockhurst (The University of York, UK)
+#
+'''
+ReadStats module from the Bacterial and Archaeal Genome Analyzer (BAGA).
+
+This module contains functions to count reads and summarise read lengths, base
+composition and quality scores in FASTQ files in a single pass, and an index
+which keeps these statistics in a small file beside each FASTQ file so
+downstream steps (e.g., subsampling in the PrepareReads module) need not scan
+large gzipped files again.
+'''
+
+# stdlib
+from baga import _os
+from baga import _json
+from baga import _logging
+from baga import _multiprocessing
+from baga import _md5
+from baga import _struct
+from baga import _zlib
+
+from collections import Counter as _Counter
+from multiprocessing.pool import ThreadPool as _ThreadPool
+
+def main():
+    pass
+
+def _is_bgzf(header):
+    '''
+    True if the first bytes of a file are a gzip member header with the 'BC'
+    extra subfield of blocked GNU zip format (BGZF) as written by bgzip.
+    '''
+    return(len(header) >= 18 and header[:4] == b'\x1f\x8b\x08\x04' and \
+            header[12:14] == b'BC')
+
+def _bgzf_blocks(fin, hasher):
+    '''
+    Yield the raw bytes of each BGZF block in a file, updating hasher
+    '''
+    while True:
+        header = fin.read(18)
+        if not header:
+            break
+        if not _is_bgzf(header):
+            raise ValueError('Not a BGZF block in {} at offset {}'.format(
+                    fin.name, fin.tell() - len(header)))
+        xlen, = _struct.unpack('<H', header[10:12])
+        block_size, = _struct.unpack('<H', header[16:18])
+        block = header + fin.read(block_size + 1 - 18)
+        hasher.update(block)
+        yield(block)
+
+def _inflate_bgzf_block(block):
+    xlen, = _struct.unpack('<H', block[10:12])
+    return(_zlib.decompress(block[12 + xlen:-8], -15))
+
+def _chunks(path, hasher, threads = 1, block_size = 2**20, blocks_per_batch = 256):
+    '''
+    Yield decompressed chunks of a plain, gzipped or BGZF file, updating
+    hasher with the file's bytes as read.
+
+    BGZF blocks are independent so batches of them are decompressed by
+    threads (zlib releases the GIL). Other gzip files, which may have
+    several members, are decompressed serially.
+    '''
+    with open(path, 'rb') as fin:
+        start = fin.read(18)
+        fin.seek(0)
+        if _is_bgzf(start) and threads > 1:
+            pool = _ThreadPool(threads)
+            try:
+                batch = []
+                for block in _bgzf_blocks(fin, hasher):
+                    batch += [block]
+                    if len(batch) == blocks_per_batch:
+                        yield(b''.join(pool.map(_inflate_bgzf_block, batch)))
+                        batch = []
+                if batch:
+                    yield(b''.join(pool.map(_inflate_bgzf_block, batch)))
+            finally:
+                pool.close()
+                pool.join()
+        elif start[:2] == b'\x1f\x8b':
+            inflater = _zlib.decompressobj(16 + _zlib.MAX_WBITS)
+            for raw in iter(lambda: fin.read(block_size), b''):
+                hasher.update(raw)
+                while raw:
+                    yield(inflater.decompress(raw))
+                    raw = inflater.unused_data
+                    if raw:
+                        # concatenated gzip members e.g., BGZF
+                        yield(inflater.flush())
+                        inflater = _zlib.decompressobj(16 + _zlib.MAX_WBITS)
+            yield(inflater.flush())
+        else:
+            for raw in iter(lambda: fin.read(block_size), b''):
+                hasher.update(raw)
+                yield(raw)
+
+def fastqStats(path, threads = 1):
+    '''
+    Read count and summaries of read lengths, base composition and quality
+    scores of a FASTQ file in one pass, plus the MD5 checksum of the file.
+
+    threads are used to decompress BGZF files.
+
+    returns (checksum, dict of statistics)
+    '''
+    hasher = _md5()
+    reads = 0
+    lengths = _Counter()
+    composition = _Counter()
+    qualities = _Counter()
+    leftover = b''
+    for chunk in _chunks(path, hasher, threads = threads):
+        if not chunk:
+            continue
+        lines = (leftover + chunk).split(b'\n')
+        # only whole records: the rest is carried over to the next chunk
+        complete = (len(lines) - 1) // 4 * 4
+        leftover = b'\n'.join(lines[complete:])
+        if not complete:
+            continue
+        seqs = lines[1:complete:4]
+        reads += len(seqs)
+        lengths.update(map(len, seqs))
+        seqs = b''.join(seqs)
+        for base in 'ACGTN':
+            composition[base] += seqs.count(base.encode('ascii'))
+        qualities.update(bytearray(b''.join(lines[3:complete:4])))
+
+    # a final record may lack a trailing newline
+    lines = leftover.rstrip(b'\n').split(b'\n')
+    if len(lines) == 4:
+        reads += 1
+        lengths[len(lines[1])] += 1
+        for base in 'ACGTN':
+            composition[base] += lines[1].count(base.encode('ascii'))
+        qualities.update(bytearray(lines[3]))
+    elif leftover.strip():
+        raise ValueError('Truncated FASTQ record at end of {}'.format(path))
+
+    bases = sum([l * n for l,n in lengths.items()])
+    composition['other'] = bases - sum(composition.values())
+    if qualities:
+        # Sanger/Illumina 1.8+ unless none below '@' and some above 'J'
+        offset = 64 if min(qualities) >= 64 and max(qualities) > 74 else 33
+        quality_sum = sum([(q - offset) * n for q,n in qualities.items()])
+        q30 = sum([n for q,n in qualities.items() if q - offset >= 30])
+    else:
+        offset, quality_sum, q30 = 33, 0, 0
+
+    stats = {'reads': reads,
+             'bases': bases,
+             'lengths': dict([(str(l), n) for l,n in lengths.items()]),
+             'mode_length': lengths.most_common(1)[0][0] if lengths else 0,
+             'composition': dict(composition),
+             'phred_offset': offset,
+             'quality_counts': dict([(str(q - offset), n) for q,n in \
+                    qualities.items()]),
+             'mean_quality': quality_sum / float(bases) if bases else 0,
+             'q30_fraction': q30 / float(bases) if bases else 0}
+    return(hasher.hexdigest(), stats)
+
+def _file_checksum(path, block_size = 2**20):
+    hasher = _md5()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            hasher.update(block)
+    return(hasher.hexdigest())
+
+def _collect(args):
+    '''fastqStats() and sidecar writing for multiprocessing'''
+    path, threads = args
+    index = ReadStatsIndex()
+    return(path, index.collect(path, threads = threads))
+
+class ReadStatsIndex(object):
+    '''
+    FASTQ statistics kept in a small JSON file beside each FASTQ file.
+
+    Each sidecar records the size, modification time and MD5 checksum of the
+    FASTQ file it describes. Statistics are used while size and mtime are
+    unchanged, or if only mtime changed but the checksum still matches (e.g.,
+    after copying) so reads are only counted again if the file changed.
+    '''
+    suffix = '.baga_stats.json'
+
+    def __init__(self):
+        self.logger = _logging.getLogger(__name__)
+
+    def sidecarPath(self, path):
+        return(path + self.suffix)
+
+    def load(self, path):
+        '''
+        Statistics for a FASTQ file from a previous scan, if still valid.
+
+        returns dict of statistics as made by fastqStats() or None
+        '''
+        try:
+            info = _os.stat(path)
+            with open(self.sidecarPath(path)) as fin:
+                sidecar = _json.load(fin)
+        except (IOError, OSError, ValueError):
+            return(None)
+
+        if sidecar.get('size') != info.st_size:
+            return(None)
+
+        if sidecar.get('mtime') != info.st_mtime:
+            if _file_checksum(path) != sidecar.get('checksum'):
+                return(None)
+            sidecar['mtime'] = info.st_mtime
+            self._save(path, sidecar)
+
+        return(sidecar['stats'])
+
+    def _save(self, path, sidecar):
+        sidecar_path = self.sidecarPath(path)
+        tmp_path = '{}.{}.tmp'.format(sidecar_path, _os.getpid())
+        try:
+            with open(tmp_path, 'w') as fout:
+                _json.dump(sidecar, fout, sort_keys = True)
+            _os.rename(tmp_path, sidecar_path)
+        except (IOError, OSError) as e:
+            self.logger.warning('Could not save read statistics for {}: {}'\
+                    ''.format(path, e))
+
+    def collect(self, path, threads = 1):
+        '''Scan a FASTQ file and save its statistics beside it'''
+        info = _os.stat(path)
+        self.logger.info('Collecting read statistics for {}'.format(path))
+        checksum, stats = fastqStats(path, threads = threads)
+        self._save(path, {'size': info.st_size,
+                          'mtime': info.st_mtime,
+                          'checksum': checksum,
+                          'stats': stats})
+        return(stats)
+
+    def getStats(self, paths, max_processes = 1, force = False):
+        '''
+        Statistics for each FASTQ file, scanning only those without valid
+        sidecars (or all if force). Files are shared among max_processes
+        processes, any spare being used to decompress BGZF files.
+
+        returns dict of path => dict of statistics
+        '''
+        collected = {}
+        to_scan = []
+        for path in paths:
+            stats = None if force else self.load(path)
+            if stats is None:
+                to_scan += [path]
+            else:
+                collected[path] = stats
+
+        if to_scan:
+            num_processes = max(1, min(max_processes, len(to_scan)))
+            threads = max(1, max_processes // num_processes)
+            args = [(path, threads) for path in to_scan]
+            if num_processes > 1:
+                pool = _multiprocessing.Pool(num_processes)
+                results = pool.map(_collect, args)
+                pool.close()
+                pool.join()
+            else:
+                results = map(_collect, args)
+            collected.update(results)
+
+        return(collected)
+
+
+if __name__ == '__main__':
+    main()
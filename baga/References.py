@@ -0,0 +1,229 @@
+#! /usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Bacterial and Archaeal Genome Analyser
+# Copyright (C) 2015-2016 David Williams
+# david.williams.at.liv.d-dub.org.uk
+# License GPLv3+: GNU GPL version 3 or later
+# This is free software: you are free to change and redistribute it
+# There is NO WARRANTY, to the extent permitted by law
+#
+# Work on this software was started at The University of Liverpool, UK
+# with funding from The Wellcome Trust (093306/Z/10) awarded to:
+# Dr Steve Paterson (The University of Liverpool, UK)
+# Dr Craig Winstanley (The University of Liverpool, UK)
+# Dr Michael A Brockhurst (The University of York, UK)
+#
+'''
+References module from the Bacterial and Archaeal Genome Analyzer (BAGA).
+
+This module contains a cache of reference genome FASTA files and the indexes
+built from them by BWA, samtools and Picard, so each is only written again
+when the genome sequence changes, however many analyses use it.
+'''
+
+# stdlib
+from baga import _os
+from baga import _json
+from baga import _logging
+from baga import _md5
+from baga import _subprocess
+from contextlib import contextmanager as _contextmanager
+try:
+    import fcntl as _fcntl
+except ImportError:
+    # not available on Windows: no locking between processes
+    _fcntl = None
+
+from baga.Sequence import GenomeSequence as _GenomeSequence
+from baga.Sequence import writeFASTA as _writeFASTA
+
+def main():
+    pass
+
+def sequencesChecksum(sequences, descriptions = {}):
+    '''
+    MD5 checksum of the ids, descriptions and sequences in a dict of
+    sequences as would be written to a FASTA file by Sequence.writeFASTA()
+    '''
+    hasher = _md5()
+    for seq_id in sorted(sequences):
+        sequence = sequences[seq_id]
+        if not isinstance(sequence, _GenomeSequence):
+            sequence = _GenomeSequence(sequence)
+        hasher.update('{}\0{}\0'.format(seq_id,
+                descriptions.get(seq_id, '')).encode('utf-8'))
+        hasher.update(sequence.tobytes())
+        hasher.update(b'\0')
+    return(hasher.hexdigest())
+
+def _file_checksum(path, block_size = 2**20):
+    hasher = _md5()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            hasher.update(block)
+    return(hasher.hexdigest())
+
+class ReferenceCache(object):
+    '''
+    Reference genome FASTA files and their indexes kept in a folder.
+
+    A small JSON manifest beside each FASTA file records the checksum of the
+    sequences it contains and, for each index, the checksum of the sequences
+    it was built from. FASTA files are only rewritten, and indexes rebuilt,
+    when the checksum changes. Writing is done under a lock on a file beside
+    each FASTA so concurrent analyses of the same genome build each index
+    once and never see it half written.
+    '''
+    suffix = '.baga_ref.json'
+
+    def __init__(self, folder = 'genome_sequences'):
+        self.folder = folder
+        self.logger = _logging.getLogger(__name__)
+
+    def fastaPath(self, name):
+        return(_os.path.sep.join([self.folder, '{}.fna'.format(name)]))
+
+    def manifestPath(self, fasta):
+        return(fasta + self.suffix)
+
+    @staticmethod
+    def indexPaths(fasta, index):
+        '''paths of files written for each kind of index'''
+        if index == 'bwa':
+            return([fasta + ext for ext in ('.amb', '.ann', '.bwt', '.pac',
+                    '.sa')])
+        elif index == 'faidx':
+            return([fasta + '.fai'])
+        elif index == 'dict':
+            # Picard (and GATK) replace the extension
+            return([_os.path.splitext(fasta)[0] + '.dict'])
+        raise ValueError('Unknown index type: "{}"'.format(index))
+
+    @_contextmanager
+    def _locked(self, fasta):
+        '''hold an exclusive lock for fasta among processes'''
+        if _fcntl is None:
+            yield
+            return
+        with open(fasta + '.lock', 'a') as lock:
+            _fcntl.flock(lock.fileno(), _fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                _fcntl.flock(lock.fileno(), _fcntl.LOCK_UN)
+
+    def _loadManifest(self, fasta):
+        try:
+            with open(self.manifestPath(fasta)) as fin:
+                return(_json.load(fin))
+        except (IOError, OSError, ValueError):
+            return(None)
+
+    def _saveManifest(self, fasta, manifest):
+        manifest_path = self.manifestPath(fasta)
+        tmp_path = '{}.{}.tmp'.format(manifest_path, _os.getpid())
+        with open(tmp_path, 'w') as fout:
+            _json.dump(manifest, fout, sort_keys = True)
+        _os.rename(tmp_path, manifest_path)
+
+    def fasta(self, name, sequences, descriptions = {}):
+        '''
+        Path to a FASTA file of a dict of sequences, written only if missing
+        or if the sequences have changed, in which case indexes of any
+        previous version are removed.
+
+        returns path to FASTA file
+        '''
+        if not _os.path.exists(self.folder):
+            try:
+                _os.makedirs(self.folder)
+            except OSError:
+                # made concurrently
+                pass
+
+        fasta = self.fastaPath(name)
+        checksum = sequencesChecksum(sequences, descriptions)
+        with self._locked(fasta):
+            manifest = self._loadManifest(fasta)
+            if manifest is not None and manifest['checksum'] == checksum and \
+                    _os.path.exists(fasta) and \
+                    _os.path.getsize(fasta) == manifest['size']:
+                self.logger.debug('{} is up to date'.format(fasta))
+                return(fasta)
+
+            self.logger.info('Writing {}'.format(fasta))
+            for index in (manifest or {}).get('indexes', {}):
+                for path in self.indexPaths(fasta, index):
+                    if _os.path.exists(path):
+                        _os.unlink(path)
+
+            tmp_fasta = '{}.{}.tmp'.format(fasta, _os.getpid())
+            _writeFASTA(tmp_fasta, sequences, descriptions)
+            _os.rename(tmp_fasta, fasta)
+            self._saveManifest(fasta, {'checksum': checksum,
+                                       'size': _os.path.getsize(fasta),
+                                       'indexes': {}})
+        return(fasta)
+
+    def _index(self, fasta, index, cmd):
+        '''
+        Run cmd to build an index of fasta unless already built from the
+        current sequences.
+
+        returns True if the index is up to date
+        '''
+        paths = self.indexPaths(fasta, index)
+        with self._locked(fasta):
+            manifest = self._loadManifest(fasta)
+            if manifest is None or manifest.get('size') != \
+                    _os.path.getsize(fasta):
+                # a FASTA file not written by this cache
+                manifest = {'checksum': _file_checksum(fasta),
+                            'size': _os.path.getsize(fasta),
+                            'indexes': {}}
+                self._saveManifest(fasta, manifest)
+
+            if manifest['indexes'].get(index) == manifest['checksum'] and \
+                    all([_os.path.exists(path) for path in paths]):
+                self.logger.debug('{} index of {} is up to date'.format(index,
+                        fasta))
+                return(True)
+
+            for path in paths:
+                if _os.path.exists(path):
+                    _os.unlink(path)
+
+            self.logger.info('Building {} index of {}'.format(index, fasta))
+            self.logger.debug('Called: {}'.format(' '.join(cmd)))
+            try:
+                returncode = _subprocess.call(cmd)
+            except OSError as e:
+                self.logger.error('Could not run {}: {}'.format(cmd[0], e))
+                return(False)
+
+            if returncode != 0 or \
+                    not all([_os.path.exists(path) for path in paths]):
+                self.logger.error('Building {} index of {} failed'.format(
+                        index, fasta))
+                return(False)
+
+            manifest['indexes'][index] = manifest['checksum']
+            self._saveManifest(fasta, manifest)
+        return(True)
+
+    def bwaIndex(self, fasta, bwa_exe):
+        return(self._index(fasta, 'bwa', [bwa_exe, 'index', fasta]))
+
+    def faidx(self, fasta, samtools_exe):
+        return(self._index(fasta, 'faidx', [samtools_exe, 'faidx', fasta]))
+
+    def sequenceDict(self, fasta, picard_jar, use_java = 'java'):
+        return(self._index(fasta, 'dict', [use_java, '-jar', picard_jar,
+                'CreateSequenceDictionary',
+                'R=', fasta,
+                'O=', self.indexPaths(fasta, 'dict')[0]]))
+
+
+if __name__ == '__main__':
+    main()
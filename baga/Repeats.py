@@ -33,9 +33,10 @@ from baga import _gzip
 from baga import _tarfile
 from baga import _json
 from baga import _StringIO
+from baga import _multiprocessing
 
 from collections import defaultdict as _defaultdict
-from cStringIO import StringIO as _StringIO
+from bisect import bisect_left as _bisect_left
 
 # external Python modules
 import pysam as _pysam
@@ -46,10 +47,170 @@ from Bio.SeqRecord import SeqRecord as _SeqRecord
 # svgwrite imported within Plotter
 
 from baga import MetaSample as _MetaSample
+from baga import decide_max_processes as _decide_max_processes
+from baga.Sequence import writeFASTA as _writeFASTA
+from baga.References import ReferenceCache as _ReferenceCache
+from baga import Pairwise as _Pairwise
 from baga import PROGRESS
 from baga import PY3 as _PY3
 def main():
     pass
+
+class _LocusIndex(object):
+    '''
+    Loci sorted by start with the running maximum end so all loci 
+    overlapping a range are found by bisection instead of checking each
+    '''
+    def __init__(self, loci_info):
+        self.loci = sorted([(s, e, locus) for locus,(s,e,strand,gene_name) in \
+                loci_info.items()])
+        self.starts = [s for s,e,locus in self.loci]
+        self.max_ends = []
+        max_end = None
+        for s,e,locus in self.loci:
+            max_end = e if max_end is None else max(max_end, e)
+            self.max_ends += [max_end]
+
+    def overlapping(self, start, end):
+        '''(s, e, locus) for each locus with s < end and start < e'''
+        found = []
+        i = _bisect_left(self.starts, end) - 1
+        # no locus at or before i reaches start once max_ends[i] <= start
+        while i >= 0 and self.max_ends[i] > start:
+            s, e, locus = self.loci[i]
+            if start < e:
+                found += [(s, e, locus)]
+            i -= 1
+        return(found[::-1])
+
+def _aligned_in_range(blocks, s, e):
+    '''number of reference positions in aligned blocks within s to e'''
+    return(sum([max(0, min(block_e, e) - max(block_s, s)) for \
+            block_s,block_e in blocks]))
+
+def _doubleHits(args):
+    '''
+    Loci that each query locus in a BAM file aligned to, apart from itself, 
+    with over half of both covered: for Finder.parseBamForDoubleHits()
+    '''
+    filename, loci_info = args
+    index = _LocusIndex(loci_info)
+    locus_hit_ranges = _defaultdict(dict)
+    non_self_non_secondary = _defaultdict(list)
+    alns = _pysam.Samfile(filename)
+    for aln in alns:
+        if aln.is_unmapped:
+            continue
+        s_q, e_q, strand, gene_name = loci_info[aln.query_name]
+        blocks = None
+        for s,e,locus in index.overlapping(aln.reference_start, 
+                aln.reference_end):
+            # exclude self
+            if locus == aln.query_name:
+                continue
+            if blocks is None:
+                blocks = aln.get_blocks()
+            # check how much of ORF was aligned,
+            # only accept if >50% covered
+            aligned_in_hit_locus = _aligned_in_range(blocks, s, e)
+            if aligned_in_hit_locus > (e-s) * 0.5 and \
+               aligned_in_hit_locus > (e_q-s_q) * 0.5:
+                locus_hit_ranges[aln.query_name][locus] = \
+                    aln.reference_start, aln.reference_end
+                if not aln.is_secondary:
+                    non_self_non_secondary[aln.query_name] += [locus]
+    alns.close()
+    return(dict(locus_hit_ranges), dict(non_self_non_secondary))
+
+# what each process aligning homologous groups for Finder.align_blocks() 
+# needs: a Finder with only the loci and tandem repeats, the groups, genome 
+# strands and options
+_group_aligner = {}
+
+def _initGroupAligner(replicon_id, loci_info, tandem_repeats, 
+        homologous_groups, genome_seq, options):
+    # not a whole Finder which would be pickled when processes are spawned
+    finder = Finder.__new__(Finder)
+    finder.genome_loci_info = {replicon_id: loci_info}
+    finder.tandem_repeats = {replicon_id: tandem_repeats}
+    genome_strands = {1: _Seq(genome_seq)}
+    genome_strands[-1] = genome_strands[1].reverse_complement()
+    _group_aligner['finder'] = finder
+    _group_aligner['homologous_groups'] = homologous_groups
+    _group_aligner['genome_strands'] = genome_strands
+    _group_aligner['options'] = options
+
+def _alignHomologousGroup(args):
+    '''Finder.alignHomologousGroup() for multiprocessing'''
+    replicon_id, g_n = args
+    groups = _group_aligner['homologous_groups'][g_n]
+    return(_group_aligner['finder'].alignHomologousGroup(replicon_id, g_n, 
+            groups, _group_aligner['genome_strands'], 
+            **_group_aligner['options']))
+
+class _HomologyGraph(object):
+    '''
+    Loci linked by hits in either direction, with the connected components 
+    of loci that are homologous via any chain of hits kept by a disjoint-set 
+    (union-find) so each hit is added in near constant time
+    '''
+    def __init__(self, hits = {}):
+        self.parent = {}
+        self.size = {}
+        self.edges = _defaultdict(set)
+        for query,hit_loci in hits.items():
+            self.addLocus(query)
+            for hit in hit_loci:
+                self.addHit(query, hit)
+
+    def addLocus(self, locus):
+        if locus not in self.parent:
+            self.parent[locus] = locus
+            self.size[locus] = 1
+
+    def find(self, locus):
+        '''representative locus of the component containing locus'''
+        parent = self.parent
+        while parent[locus] != locus:
+            # path halving
+            parent[locus] = parent[parent[locus]]
+            locus = parent[locus]
+        return(locus)
+
+    def addHit(self, locus1, locus2):
+        self.addLocus(locus1)
+        self.addLocus(locus2)
+        if locus1 != locus2:
+            self.edges[locus1].add(locus2)
+            self.edges[locus2].add(locus1)
+        root1 = self.find(locus1)
+        root2 = self.find(locus2)
+        if root1 == root2:
+            return
+        # union by size
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+
+    def components(self):
+        '''representative locus => set of loci in each component'''
+        components = _defaultdict(set)
+        for locus in self.parent:
+            components[self.find(locus)].add(locus)
+        return(dict(components))
+
+    def homologs(self):
+        '''
+        dict of each locus => set of all loci in its component, including 
+        itself, as Finder.hits
+        '''
+        homologs = {}
+        for component in self.components().values():
+            for locus in component:
+                homologs[locus] = set(component)
+        return(homologs)
+
 class Finder(_MetaSample):
     '''
     The Finder class of the Repeats module contains the methods to infer 
@@ -106,29 +267,13 @@ class Finder(_MetaSample):
         than themselves
         '''
 
-        alns = _pysam.Samfile(filename)
-        locus_hit_ranges = _defaultdict(dict)
-        non_self_non_secondary = _defaultdict(list)
-        for aln in alns:
-            # get ORF that was hit
-            for locus,(s,e,strand,gene_name) in self.genome_loci_info[replicon_id].items():
-                if s < aln.reference_end and aln.reference_start < e:
-                    # exclude self
-                    if locus != aln.query_name:
-                        s_q, e_q, strand, gene_name = \
-                                self.genome_loci_info[replicon_id][aln.query_name]
-                        # check how much of ORF was aligned,
-                        # only accept if >50% covered
-                        aligned_positions_in_hit_locus = sorted(
-                                        set(range(s,e)) & set(aln.positions)
-                                                              )
-                        if len(aligned_positions_in_hit_locus) > (e-s) * 0.5 and \
-                           len(aligned_positions_in_hit_locus) > (e_q-s_q) * 0.5:
-                            locus_hit_ranges[aln.query_name][locus] = \
-                                aln.reference_start, aln.reference_end
-                            if not aln.is_secondary:
-                                non_self_non_secondary[aln.query_name] += [locus]
+        locus_hit_ranges, non_self_non_secondary = _doubleHits((filename, 
+                self.genome_loci_info[replicon_id]))
+        self._storeDoubleHits(replicon_id, locus_hit_ranges, 
+                non_self_non_secondary)
 
+    def _storeDoubleHits(self, replicon_id, locus_hit_ranges, 
+            non_self_non_secondary):
         try:
             self.hit_ranges[replicon_id] = dict(locus_hit_ranges)
             self.non_self_non_secondary[replicon_id] = dict(non_self_non_secondary)
@@ -138,6 +283,27 @@ class Finder(_MetaSample):
             self.non_self_non_secondary = {}
             self.non_self_non_secondary[replicon_id] = dict(non_self_non_secondary)
 
+    def parseBamsForDoubleHits(self, filenames, max_processes = 1):
+        '''
+        As parseBamForDoubleHits() for a dict of replicon_id => BAM file, 
+        one replicon per process
+        '''
+        replicon_ids = sorted(filenames)
+        args = [(filenames[replicon_id], self.genome_loci_info[replicon_id]) \
+                for replicon_id in replicon_ids]
+        num_processes = max(1, min(max_processes, len(args)))
+        if num_processes > 1:
+            pool = _multiprocessing.Pool(num_processes)
+            results = pool.map(_doubleHits, args)
+            pool.close()
+            pool.join()
+        else:
+            results = map(_doubleHits, args)
+        for replicon_id,(locus_hit_ranges, non_self_non_secondary) in \
+                zip(replicon_ids, results):
+            self._storeDoubleHits(replicon_id, locus_hit_ranges, 
+                    non_self_non_secondary)
+
     def followHitsAndAdd(self, replicon_id):
         '''
         make all hits symmetric:
@@ -146,51 +312,64 @@ class Finder(_MetaSample):
         
         and generate hits dict from ORF_hit_ranges or update it if it 
         already exists
+
+        Loci are joined into groups homologous by any chain of hits via a 
+        _HomologyGraph, kept as self.homology_graphs for 
+        getHomologousContiguousBlocks(), so one call makes all hits 
+        symmetric and transitive.
         '''
 
         if hasattr(self, 'hits') and replicon_id in self.hits:
-            hits_dict_in = dict(self.hits[replicon_id].items())
+            hits_dict_in = self.hits[replicon_id]
         else:
-            hits_dict_in = dict(self.hit_ranges[replicon_id].items())
+            hits_dict_in = self.hit_ranges[replicon_id]
 
-        hits_dict_out = {}
-        # first fix one-way asymmetries
-        hit_no_hits = set([a for b in hits_dict_in.values() for a in b]) - set(hits_dict_in)
-        for query,hits in hits_dict_in.items():
-            for hit in hit_no_hits.intersection(hits):
-                try:
-                    hits_dict_out[hit].add(query)
-                except KeyError:
-                    hits_dict_out[hit] = set([query])
+        graph = _HomologyGraph(hits_dict_in)
+        # keep any previous hits, e.g., between loci of an earlier graph
+        if hasattr(self, 'homology_graphs') and \
+                replicon_id in self.homology_graphs:
+            for locus,hit_loci in self.homology_graphs[replicon_id].edges.items():
+                for hit in hit_loci:
+                    graph.addHit(locus, hit)
 
-        # then fix multi-way asymmetries
-        for locus in hits_dict_in:
-            to_add = set([a for a,b in hits_dict_in.items() if \
-                    len(set(b) & set(hits_dict_in[locus])) > 0])
-            to_add.update([a for a,b in hits_dict_in.items() if locus in b])
-            try:
-                hits_dict_out[locus].update(to_add)
-            except KeyError:
-                hits_dict_out[locus] = to_add
+        try:
+            self.homology_graphs[replicon_id] = graph
+        except AttributeError:
+            self.homology_graphs = {}
+            self.homology_graphs[replicon_id] = graph
 
         try:
-            self.hits[replicon_id] = hits_dict_out
+            self.hits[replicon_id] = graph.homologs()
         except AttributeError:
             self.hits = {}
-            self.hits[replicon_id] = hits_dict_out
+            self.hits[replicon_id] = graph.homologs()
     def orderLocusHits(self):
+        '''
+        Order loci with hits along each replicon and record the rank of each 
+        locus in loci_ordered and loci_with_hits_ordered so 
+        getAdjacentsWithHit() and getLociInTandemRepeats() need not search 
+        these lists
+        '''
 
         self.loci_with_hits_ordered = {}
+        self.loci_rank = {}
+        self.loci_with_hits_rank = {}
+        for replicon_id,these_loci_ordered in self.loci_ordered.items():
+            self.loci_rank[replicon_id] = dict([(locus,n) for n,locus in \
+                    enumerate(these_loci_ordered)])
         for replicon_id,these_hits in self.hits.items():
             all_hits = set(a for b in these_hits.values() for a in b)
             self.loci_with_hits_ordered[replicon_id] = sorted(
                     all_hits, key = self.genome_loci_info[replicon_id].get)
+            self.loci_with_hits_rank[replicon_id] = dict([(locus,n) for \
+                    n,locus in enumerate(
+                    self.loci_with_hits_ordered[replicon_id])])
     def getAdjacentsWithHit(self, locus, replicon_id, maxdist = 3, 
             direction = 1, getall = False):
         '''return next ORF with a paralog and num ORFs to it within maxdist'''
 
-        this_n_hits = self.loci_with_hits_ordered[replicon_id].index(locus)
-        this_n_all = self.loci_ordered[replicon_id].index(locus)
+        this_n_hits = self.loci_with_hits_rank[replicon_id][locus]
+        this_n_all = self.loci_rank[replicon_id][locus]
         if direction == -1:
             maxdist -= 1
             s = this_n_all + maxdist * direction
@@ -199,7 +378,10 @@ class Finder(_MetaSample):
             s = this_n_all
             e = this_n_all + maxdist * direction
 
-        to_check = self.loci_ordered[replicon_id][s:e][::direction]
+        # loci_ordered[s:e][::direction] are checked: find their positions 
+        # from ranks rather than slicing and searching
+        s, e, step = slice(s, e).indices(len(self.loci_ordered[replicon_id]))
+        loci_rank = self.loci_rank[replicon_id]
         next_hits = {}
         for n in range(1,maxdist):
             if this_n_hits + n * direction == \
@@ -211,11 +393,12 @@ class Finder(_MetaSample):
                 print('WARNING: this_n_hits > loci_with_hits_ordered')
                 continue
             next_hit = self.loci_with_hits_ordered[replicon_id][this_n_hits + n * direction]
-            try:
-                next_hit_index = to_check.index(next_hit)
-                next_hits[next_hit] = next_hit_index
-            except ValueError:
-                pass
+            next_hit_rank = loci_rank[next_hit]
+            if s <= next_hit_rank < e:
+                if direction == 1:
+                    next_hits[next_hit] = next_hit_rank - s
+                else:
+                    next_hits[next_hit] = e - 1 - next_hit_rank
 
         if len(next_hits) == 0:
             if getall:
@@ -355,7 +538,7 @@ class Finder(_MetaSample):
             tandems = []
             for a,b in block_to_homoblocks.items():
                 if len(b) > 1:
-                    if self.loci_ordered[replicon_id].index(b[0][0]) + 1 == self.loci_ordered[replicon_id].index(b[1][0]):
+                    if self.loci_rank[replicon_id][b[0][0]] + 1 == self.loci_rank[replicon_id][b[1][0]]:
                         print('A tandem repeated: {}'.format(b))
                         tandems += [b]
             
@@ -421,50 +604,14 @@ class Finder(_MetaSample):
               to "extended" dict, if no extensions were done, store all continuously extended
               homologous in "block_to_homoblocks" dict and reset "this_block" to trigger (I)
         '''
-        # some sanity checks
+        # loci homologous via any chain of hits share one set of hits: take 
+        # them from the homology graph (made from the hits if not yet built)
         for replicon_id in self.genome_names:
-            f1 = False
-            for n,locus1 in enumerate(self.loci_with_hits_ordered[replicon_id][:-1]):
-                for locus2 in self.loci_with_hits_ordered[replicon_id][(n+1):]:
-                    if self.hits[replicon_id][locus1] & self.hits[replicon_id][locus2]:
-                        # if there is an intersection, it should be a union
-                        if self.hits[replicon_id][locus1] != \
-                                self.hits[replicon_id][locus1] | \
-                                self.hits[replicon_id][locus2]:
-                            f1 = True
-            
-            for n,locus1 in enumerate(self.loci_with_hits_ordered[replicon_id][:-1]):
-                for locus2 in self.loci_with_hits_ordered[replicon_id][(n+1):]:
-                    if self.hits[replicon_id][locus1] & self.hits[replicon_id][locus2]:
-                        self.hits[replicon_id][locus1] = \
-                                self.hits[replicon_id][locus1] | \
-                                self.hits[replicon_id][locus2]
-                        self.hits[replicon_id][locus2] = \
-                                self.hits[replicon_id][locus1] | \
-                                self.hits[replicon_id][locus2]
-            
-            for n,locus1 in enumerate(self.loci_with_hits_ordered[replicon_id][::-1][:-1]):
-                for locus2 in self.loci_with_hits_ordered[replicon_id][::-1][(n+1):]:
-                    if self.hits[replicon_id][locus1] & \
-                            self.hits[replicon_id][locus2]:
-                        self.hits[replicon_id][locus1] = \
-                                self.hits[replicon_id][locus1] | \
-                                self.hits[replicon_id][locus2]
-                        self.hits[replicon_id][locus2] = \
-                                self.hits[replicon_id][locus1] | \
-                                self.hits[replicon_id][locus2]
-            
-            f2 = False
-            for n,locus1 in enumerate(self.loci_with_hits_ordered[replicon_id][:-1]):
-                for locus2 in self.loci_with_hits_ordered[replicon_id][(n+1):]:
-                    if self.hits[replicon_id][locus1] & self.hits[replicon_id][locus2]:
-                        if self.hits[replicon_id][locus1] != \
-                                self.hits[replicon_id][locus1] | \
-                                self.hits[replicon_id][locus2]:
-                            print(locus1,locus2)
-                            f2 = True
-            
-            assert not f2
+            if not hasattr(self, 'homology_graphs') or \
+                    replicon_id not in self.homology_graphs:
+                self.followHitsAndAdd(replicon_id)
+            self.hits[replicon_id] = \
+                    self.homology_graphs[replicon_id].homologs()
 
         # below, we'll be building "homoblocks": contiguous blocks
         # of homologous loci
@@ -776,44 +923,41 @@ class Finder(_MetaSample):
         self.tandem_repeats = {}
         for replicon_id,these_homologous_groups in self.homologous_groups.items():
             tandem_repeats = set()
+            loci_rank = self.loci_rank[replicon_id]
             for groups in these_homologous_groups:
                 # if any of these ORFs are involved in any tandem repeats
                 tandem = False
                 for n,group1 in enumerate(groups[:-1]):
                     for group2 in groups[(n+1):]:
                         # allow up to 2 ORFs between tandem repeated contiguous groups of ORFs
-                        if self.loci_ordered[replicon_id].index(group1[-1]) + 1 == \
-                                self.loci_ordered[replicon_id].index(group2[0]) \
-                        or self.loci_ordered[replicon_id].index(group2[-1]) + 1 == \
-                                self.loci_ordered[replicon_id].index(group1[0]) \
-                        or self.loci_ordered[replicon_id].index(group1[-1]) + 2 == \
-                                self.loci_ordered[replicon_id].index(group2[0]) \
-                        or self.loci_ordered[replicon_id].index(group2[-1]) + 2 == \
-                                self.loci_ordered[replicon_id].index(group1[0]) \
-                        or self.loci_ordered[replicon_id].index(group1[-1]) + 3 == \
-                                self.loci_ordered[replicon_id].index(group2[0]) \
-                        or self.loci_ordered[replicon_id].index(group2[-1]) + 3 == \
-                                self.loci_ordered[replicon_id].index(group1[0]):
+                        if loci_rank[group2[0]] - loci_rank[group1[-1]] \
+                                in (1, 2, 3) \
+                        or loci_rank[group1[0]] - loci_rank[group2[-1]] \
+                                in (1, 2, 3):
                             tandem_repeats.update(group1)
                             tandem_repeats.update(group2)
             
             self.tandem_repeats[replicon_id] = tandem_repeats
 
 
-    def align_blocks(self, extend_len = 200,
+    def alignHomologousGroup(self, replicon_id, g_n, groups, genome_strands, 
+                                extend_len = 200,
                                 max_extensions = 10,
                                 min_pID = 0.95,
-                                num_terminal_window_steps = 5):
+                                num_terminal_window_steps = 5,
+                                pool = None):
         
         '''
-        Align homologous blocks using the Needleman Wunch pairwise global alignment
-        
-        extension options:
-            extend_len: initial extension length
-            max_extensions: maximum extension iterations
-            min_pID: min percent ID over . . .
-            num_terminal_window_steps: . . . this number of moving window steps, 
-        to continue extension
+        Align homologous blocks of one group using the Needleman Wunch pairwise 
+        global alignment: see align_blocks()
+
+        groups: homologous blocks in homologous_groups[replicon_id][g_n]
+        genome_strands: dict of 1 and -1 to the replicon's sequence on each 
+        strand
+        pool: optional multiprocessing.Pool to align the ORFs and inter-ORF 
+        regions of each pair of blocks in
+
+        returns dict of (blockA, blockB) pairs to aligned ranges and sequences
         '''
 
         def countGaps(seq_str, from_end = False):
@@ -829,39 +973,29 @@ class Finder(_MetaSample):
                     break
             return(num_gaps)
 
-        def alignNW(seqrecords, exe_aligner = self.exe_aligner):
-            '''Needleman-Wunsch alignment using seqalign
+        def alignNW(seqrecords):
+            '''Needleman-Wunsch alignment in process: see Pairwise.align()
             
             seqrecords must be a list of two BioPython SeqRecord instances
             '''
-            out_handle = _StringIO()
-            _SeqIO.write(seqrecords, out_handle, 'fasta')
-            cmd = [exe_aligner]
-            cmd += ['--stdin']
-            # because expected to deteriorate?
-            # cmd += ['--freeendgap']
-            proc = _subprocess.Popen(
-                cmd, stdout = _subprocess.PIPE,
-                stdin = _subprocess.PIPE)
-            
-            proc.stdin.write(out_handle.getvalue())
-            proc.stdin.close()
-            result = proc.stdout.read()
-            proc.wait()
-            A, B = result.split('\n')[:2]
+            A, B = _Pairwise.align(seqrecords[0].seq, seqrecords[1].seq)
             # put aligned amino acids into a SeqRecord
             A = _SeqRecord(_Seq(A), id = 'A')
             B = _SeqRecord(_Seq(B), id = 'B')
             return([A,B])
 
-        def alignNW_Nuc_as_AA(nuc_A_seq, nuc_B_seq):
+        def alignCodons(nuc_A_seq, nuc_B_seq, A_aa_alnd, B_aa_alnd):
+            '''align nucleotides as codons to aligned amino acid strings'''
             A_nuc, B_nuc = _SeqRecord(nuc_A_seq, id = 'A'), _SeqRecord(nuc_B_seq, id = 'B')
-            A_aa, B_aa = _SeqRecord(nuc_A_seq.translate(), id = 'A'), _SeqRecord(nuc_B_seq.translate(), id = 'B')
-            A_aa, B_aa = alignNW([A_aa, B_aa])
-            # align nucleotides as codons to aligned amino acids
+            A_aa, B_aa = _SeqRecord(_Seq(A_aa_alnd), id = 'A'), _SeqRecord(_Seq(B_aa_alnd), id = 'B')
             alnd = self.Nuc2AA([A_nuc, B_nuc], [A_aa, B_aa])
             return(alnd['A'], alnd['B'])
 
+        def alignNW_Nuc_as_AA(nuc_A_seq, nuc_B_seq):
+            A_aa, B_aa = _Pairwise.align(nuc_A_seq.translate(), nuc_B_seq.translate())
+            # align nucleotides as codons to aligned amino acids
+            return(alignCodons(nuc_A_seq, nuc_B_seq, A_aa, B_aa))
+
         # for inter-ORF nucleotides:
         # alignNW(seqrecords)
         # for ORFs
@@ -1077,279 +1211,363 @@ class Finder(_MetaSample):
 
         pID_window_size = 200
 
-        self.homologous_groups_alnd = {}
-        for replicon_id,these_homologous_groups in self.homologous_groups.items():
-            genome_strands = {}
-            genome_strands[1] = _Seq(self.genome_sequence[replicon_id].tostring())
-            genome_strands[-1] = genome_strands[1].reverse_complement()
-            homologous_groups_alnd = []
-            for g_n,groups in enumerate(these_homologous_groups):
-                print('\n\nHomologous Group {}'.format(g_n))
-                # for each group, align pairwise combinations of homologous, contiguous blocks
-                alignment_combos = {}
-                for n,repeated_loci_A in enumerate(groups[:-1]):
-                    print('A: {}'.format(' - '.join(repeated_loci_A)))
-                    strandA = self.genome_loci_info[replicon_id][repeated_loci_A[0]][2]
-                    # print(repeated_loci_A, strandA)
-                    genome_use_A = genome_strands[strandA]
-                    # collect ranges for these loci
-                    # locus|inter-locus|locus etc
-                    loci_ranges_use_A, ORF_overlaps_A = collectLociRanges(repeated_loci_A,
-                                                                          self.genome_loci_info[replicon_id], 
-                                                                          genome_use_A,
-                                                                          strandA)
-                    # print(loci_ranges_use_A, ORF_overlaps_A)
-                    for repeated_loci_B in groups[(n+1):]:
-                        print('vs. B: {}'.format(' - '.join(repeated_loci_B)))
-                        strandB = self.genome_loci_info[replicon_id][repeated_loci_B[0]][2]
-                        # print(repeated_loci_B, strandB)
-                        genome_use_B = genome_strands[strandB]
-                        # collect ranges for these loci
-                        # locus|inter-locus|locus etc
-                        loci_ranges_use_B, ORF_overlaps_B = collectLociRanges(repeated_loci_B,
-                                                                              self.genome_loci_info[replicon_id], 
-                                                                              genome_use_B,
-                                                                              strandB)
-                        # print(loci_ranges_use_B, ORF_overlaps_B)
-                        if len(repeated_loci_B) > 1:
-                            # more than one consecutive ORF means there might be overlaps
-                            # (some nucleotides appearing in two different ORFs - but
-                            # should only be aligned once for moving window percent identity)
-                            loci_ranges_updated_A = [loci_ranges_use_A[0]]
-                            loci_ranges_updated_B = [loci_ranges_use_B[0]]
-                            for i in range(len(repeated_loci_A)-1):
-                                # i is this ORF, i+1 is next
-                                # pre- and post- is relative to the inter-ORF region
-                                # (which doesn't really exist in the case of the ORF overlap)
-                                preORFA_start, preORFA_end = loci_ranges_use_A[(i)*2:(i)*2+2]
-                                preORFB_start, preORFB_end = loci_ranges_use_B[(i)*2:(i)*2+2]
-                                postORFA_start, postORFA_end = loci_ranges_use_A[(i+1)*2:(i+1)*2+2]
-                                postORFB_start, postORFB_end = loci_ranges_use_B[(i+1)*2:(i+1)*2+2]
-                                if i not in ORF_overlaps_A and i not in ORF_overlaps_B:
-                                    # neither homologous block A nor block B overlap between these
-                                    # ORFs: nothing to adjust
-                                    # add current ORF ranges and move on
-                                    loci_ranges_updated_A += [preORFA_end, postORFA_start]  # [preORFA_end, new_postORFA_start]
-                                    loci_ranges_updated_B += [preORFB_end, postORFB_start]
-                                else:
-                                    # get overlap lengths (positive means overlapping)
-                                    overlap_nuc_len_A = preORFA_end - postORFA_start
-                                    overlap_nuc_len_B = preORFB_end - postORFB_start
+        print('\n\nHomologous Group {}'.format(g_n))
+        # for each group, align pairwise combinations of homologous, contiguous blocks
+        alignment_combos = {}
+        for n,repeated_loci_A in enumerate(groups[:-1]):
+            print('A: {}'.format(' - '.join(repeated_loci_A)))
+            strandA = self.genome_loci_info[replicon_id][repeated_loci_A[0]][2]
+            # print(repeated_loci_A, strandA)
+            genome_use_A = genome_strands[strandA]
+            # collect ranges for these loci
+            # locus|inter-locus|locus etc
+            loci_ranges_use_A, ORF_overlaps_A = collectLociRanges(repeated_loci_A,
+                                                                  self.genome_loci_info[replicon_id], 
+                                                                  genome_use_A,
+                                                                  strandA)
+            # print(loci_ranges_use_A, ORF_overlaps_A)
+            for repeated_loci_B in groups[(n+1):]:
+                print('vs. B: {}'.format(' - '.join(repeated_loci_B)))
+                strandB = self.genome_loci_info[replicon_id][repeated_loci_B[0]][2]
+                # print(repeated_loci_B, strandB)
+                genome_use_B = genome_strands[strandB]
+                # collect ranges for these loci
+                # locus|inter-locus|locus etc
+                loci_ranges_use_B, ORF_overlaps_B = collectLociRanges(repeated_loci_B,
+                                                                      self.genome_loci_info[replicon_id], 
+                                                                      genome_use_B,
+                                                                      strandB)
+                # print(loci_ranges_use_B, ORF_overlaps_B)
+                if len(repeated_loci_B) > 1:
+                    # more than one consecutive ORF means there might be overlaps
+                    # (some nucleotides appearing in two different ORFs - but
+                    # should only be aligned once for moving window percent identity)
+                    loci_ranges_updated_A = [loci_ranges_use_A[0]]
+                    loci_ranges_updated_B = [loci_ranges_use_B[0]]
+                    for i in range(len(repeated_loci_A)-1):
+                        # i is this ORF, i+1 is next
+                        # pre- and post- is relative to the inter-ORF region
+                        # (which doesn't really exist in the case of the ORF overlap)
+                        preORFA_start, preORFA_end = loci_ranges_use_A[(i)*2:(i)*2+2]
+                        preORFB_start, preORFB_end = loci_ranges_use_B[(i)*2:(i)*2+2]
+                        postORFA_start, postORFA_end = loci_ranges_use_A[(i+1)*2:(i+1)*2+2]
+                        postORFB_start, postORFB_end = loci_ranges_use_B[(i+1)*2:(i+1)*2+2]
+                        if i not in ORF_overlaps_A and i not in ORF_overlaps_B:
+                            # neither homologous block A nor block B overlap between these
+                            # ORFs: nothing to adjust
+                            # add current ORF ranges and move on
+                            loci_ranges_updated_A += [preORFA_end, postORFA_start]  # [preORFA_end, new_postORFA_start]
+                            loci_ranges_updated_B += [preORFB_end, postORFB_start]
+                        else:
+                            # get overlap lengths (positive means overlapping)
+                            overlap_nuc_len_A = preORFA_end - postORFA_start
+                            overlap_nuc_len_B = preORFB_end - postORFB_start
                                     
-                                    ## this code block is to account for overlapping features
-                                    ## (typically ORFs are non-overlapping)
-                                    ## bases are only aligned once but at an overlap would
-                                    ## be translated into two different AA sequences. To prevent
-                                    ## ensure bases are only translated and aligned once, one
-                                    ## ORF range is shortened.
+                            ## this code block is to account for overlapping features
+                            ## (typically ORFs are non-overlapping)
+                            ## bases are only aligned once but at an overlap would
+                            ## be translated into two different AA sequences. To prevent
+                            ## ensure bases are only translated and aligned once, one
+                            ## ORF range is shortened.
                                     
-                                    ## if only overlap exists in only one block, and that overlap is caused by
-                                    ## an increase of decrease in an ORF in one block and not other,
-                                    ## terminal gaps in alignment between the ORF pair indicates which ORF should
-                                    ## be shortened: the one without the gaps
+                            ## if only overlap exists in only one block, and that overlap is caused by
+                            ## an increase of decrease in an ORF in one block and not other,
+                            ## terminal gaps in alignment between the ORF pair indicates which ORF should
+                            ## be shortened: the one without the gaps
                                     
-                                    ## Occasionally overlap affected regions are encountered which
-                                    ## are already off the end of one repeat so that the above
-                                    ## assumptions do not hold and the overlap is not fixed with
-                                    ## the below code: but if these are already at the end of a repeat
-                                    ## it doesn't really matter . . .
+                            ## Occasionally overlap affected regions are encountered which
+                            ## are already off the end of one repeat so that the above
+                            ## assumptions do not hold and the overlap is not fixed with
+                            ## the below code: but if these are already at the end of a repeat
+                            ## it doesn't really matter . . .
                                     
-                                    # compare num AAs per homologous ORFs
-                                    # identify if length difference of prior or subsequent homologous ORFs are closest to overlap length
-                                    # align pre- and post- ORFs as original dimensions
-                                    # only align as codons if ORFs: could be encoded rRNA
-                                    if repeated_loci_A[i].endswith('__rRNA') or \
-                                            repeated_loci_B[i].endswith('__rRNA'):
-                                        print('========> found rRNA {}, {}'.format())
-                                        preORFA_aln, preORFB_aln = alignNW_Nuc(
-                                                genome_use_A[preORFA_start:preORFA_end], 
-                                                genome_use_B[preORFB_start:preORFB_end])
-                                    else:
-                                        preORFA_aln, preORFB_aln = alignNW_Nuc_as_AA(
-                                                genome_use_A[preORFA_start:preORFA_end], 
-                                                genome_use_B[preORFB_start:preORFB_end])
-                                    if repeated_loci_B[i+1].endswith('__rRNA') or \
-                                            repeated_loci_B[i+1].endswith('__rRNA'):
-                                        print('========> found rRNA {}, {}'.format())
-                                        postORFA_aln, postORFB_aln = alignNW_Nuc(
-                                                genome_use_A[postORFA_start:postORFA_end], 
-                                                genome_use_B[postORFB_start:postORFB_end])
-                                    else:
-                                        postORFA_aln, postORFB_aln = alignNW_Nuc_as_AA(
-                                                genome_use_A[postORFA_start:postORFA_end], 
-                                                genome_use_B[postORFB_start:postORFB_end])
+                            # compare num AAs per homologous ORFs
+                            # identify if length difference of prior or subsequent homologous ORFs are closest to overlap length
+                            # align pre- and post- ORFs as original dimensions
+                            # only align as codons if ORFs: could be encoded rRNA
+                            if repeated_loci_A[i].endswith('__rRNA') or \
+                                    repeated_loci_B[i].endswith('__rRNA'):
+                                print('========> found rRNA {}, {}'.format())
+                                preORFA_aln, preORFB_aln = alignNW_Nuc(
+                                        genome_use_A[preORFA_start:preORFA_end], 
+                                        genome_use_B[preORFB_start:preORFB_end])
+                            else:
+                                preORFA_aln, preORFB_aln = alignNW_Nuc_as_AA(
+                                        genome_use_A[preORFA_start:preORFA_end], 
+                                        genome_use_B[preORFB_start:preORFB_end])
+                            if repeated_loci_B[i+1].endswith('__rRNA') or \
+                                    repeated_loci_B[i+1].endswith('__rRNA'):
+                                print('========> found rRNA {}, {}'.format())
+                                postORFA_aln, postORFB_aln = alignNW_Nuc(
+                                        genome_use_A[postORFA_start:postORFA_end], 
+                                        genome_use_B[postORFB_start:postORFB_end])
+                            else:
+                                postORFA_aln, postORFB_aln = alignNW_Nuc_as_AA(
+                                        genome_use_A[postORFA_start:postORFA_end], 
+                                        genome_use_B[postORFB_start:postORFB_end])
                                     
-                                    # return any gaps at end of each alignment to diagnose which ORF to
-                                    # shorten
-                                    num_gaps_preA = countGaps(preORFA_aln.seq, from_end = True)
-                                    num_gaps_preB = countGaps(preORFB_aln.seq, from_end = True)
-                                    num_gaps_postA = countGaps(postORFA_aln.seq, from_end = False)
-                                    num_gaps_postB = countGaps(postORFB_aln.seq, from_end = False)
+                            # return any gaps at end of each alignment to diagnose which ORF to
+                            # shorten
+                            num_gaps_preA = countGaps(preORFA_aln.seq, from_end = True)
+                            num_gaps_preB = countGaps(preORFB_aln.seq, from_end = True)
+                            num_gaps_postA = countGaps(postORFA_aln.seq, from_end = False)
+                            num_gaps_postB = countGaps(postORFB_aln.seq, from_end = False)
                                     
-                                    print('Assessing overlaps between ORFs {} and {} '\
-                                            'in these homologous blocks'.format(i, i+1))
+                            print('Assessing overlaps between ORFs {} and {} '\
+                                    'in these homologous blocks'.format(i, i+1))
                                     
-                                    # get non-overlapping pre-ORF end and post-ORF start
-                                    # maintain codon lengths
-                                    # first attempt to correct lengths by removing
-                                    # additional codons on one or other
+                            # get non-overlapping pre-ORF end and post-ORF start
+                            # maintain codon lengths
+                            # first attempt to correct lengths by removing
+                            # additional codons on one or other
                                     
-                                    new_ORFA_ords, new_ORFB_ords = update_ORF_ends(
-                                            overlap_nuc_len_A,
-                                            preORFA_end, 
-                                            postORFA_start,
-                                            num_gaps_preA,
-                                            num_gaps_postA,
-                                            overlap_nuc_len_B,
-                                            preORFB_end, 
-                                            postORFB_start,
-                                            num_gaps_preB,
-                                            num_gaps_postB)
+                            new_ORFA_ords, new_ORFB_ords = update_ORF_ends(
+                                    overlap_nuc_len_A,
+                                    preORFA_end, 
+                                    postORFA_start,
+                                    num_gaps_preA,
+                                    num_gaps_postA,
+                                    overlap_nuc_len_B,
+                                    preORFB_end, 
+                                    postORFB_start,
+                                    num_gaps_preB,
+                                    num_gaps_postB)
                                     
-                                    loci_ranges_updated_A += new_ORFA_ords
-                                    loci_ranges_updated_B += new_ORFB_ords
+                            loci_ranges_updated_A += new_ORFA_ords
+                            loci_ranges_updated_B += new_ORFB_ords
                             
-                            loci_ranges_updated_A += [postORFA_end]
-                            loci_ranges_updated_B += [postORFB_end]
-                            # check updated versions are complete and without overlaps
-                            e1 = 'odd number of ORF-inter-ORF boundaries'
-                            e2 = 'overlap correction failed'
-                            assert len(loci_ranges_updated_A) == len(loci_ranges_use_A), e1
-                            assert loci_ranges_updated_A == sorted(loci_ranges_updated_A), e2
-                            assert len(loci_ranges_updated_B) == len(loci_ranges_use_B), e1
-                            assert loci_ranges_updated_B == sorted(loci_ranges_updated_B), e2
-                            # check all corrections yielded codons
-                            assert all([(loci_ranges_updated_A[i+1]-loci_ranges_updated_A[i])%3==0 \
-                                    for i in range(0,len(loci_ranges_updated_A),2)]), 'not all A '\
-                                    'loci updated to codons lengths'
-                            assert all([(loci_ranges_updated_B[i+1]-loci_ranges_updated_B[i])%3==0 \
-                                    for i in range(0,len(loci_ranges_updated_B),2)]), 'not all B '\
-                                    'loci updated to codons lengths'
+                    loci_ranges_updated_A += [postORFA_end]
+                    loci_ranges_updated_B += [postORFB_end]
+                    # check updated versions are complete and without overlaps
+                    e1 = 'odd number of ORF-inter-ORF boundaries'
+                    e2 = 'overlap correction failed'
+                    assert len(loci_ranges_updated_A) == len(loci_ranges_use_A), e1
+                    assert loci_ranges_updated_A == sorted(loci_ranges_updated_A), e2
+                    assert len(loci_ranges_updated_B) == len(loci_ranges_use_B), e1
+                    assert loci_ranges_updated_B == sorted(loci_ranges_updated_B), e2
+                    # check all corrections yielded codons
+                    assert all([(loci_ranges_updated_A[i+1]-loci_ranges_updated_A[i])%3==0 \
+                            for i in range(0,len(loci_ranges_updated_A),2)]), 'not all A '\
+                            'loci updated to codons lengths'
+                    assert all([(loci_ranges_updated_B[i+1]-loci_ranges_updated_B[i])%3==0 \
+                            for i in range(0,len(loci_ranges_updated_B),2)]), 'not all B '\
+                            'loci updated to codons lengths'
                             
-                        else:
-                            loci_ranges_updated_A = list(loci_ranges_use_A)
-                            loci_ranges_updated_B = list(loci_ranges_use_B)
+                else:
+                    loci_ranges_updated_A = list(loci_ranges_use_A)
+                    loci_ranges_updated_B = list(loci_ranges_use_B)
                         
-                        # all corrected ORF ranges should be codon multiple lengths
-                        # but uncorrected (non-overlapping) might have been annotated erroneously
-                        # or genuinely include partial codons . . . (pseudogenes?)
-                        # so ensure all are codon length prior to translations
-                        loci_ranges_updated_A_fixed = []
-                        loci_ranges_updated_B_fixed = []
-                        for i in range(len(loci_ranges_updated_A)/2):
-                            s,e = loci_ranges_updated_A[(i*2):(i*2)+2]
-                            ends_codon_diff = (e - s) % 3
-                            loci_ranges_updated_A_fixed += [s, e - ends_codon_diff]
-                            s,e = loci_ranges_updated_B[(i*2):(i*2)+2]
-                            ends_codon_diff = (e - s) % 3
-                            loci_ranges_updated_B_fixed += [s, e - ends_codon_diff]
+                # all corrected ORF ranges should be codon multiple lengths
+                # but uncorrected (non-overlapping) might have been annotated erroneously
+                # or genuinely include partial codons . . . (pseudogenes?)
+                # so ensure all are codon length prior to translations
+                loci_ranges_updated_A_fixed = []
+                loci_ranges_updated_B_fixed = []
+                for i in range(len(loci_ranges_updated_A)//2):
+                    s,e = loci_ranges_updated_A[(i*2):(i*2)+2]
+                    ends_codon_diff = (e - s) % 3
+                    loci_ranges_updated_A_fixed += [s, e - ends_codon_diff]
+                    s,e = loci_ranges_updated_B[(i*2):(i*2)+2]
+                    ends_codon_diff = (e - s) % 3
+                    loci_ranges_updated_B_fixed += [s, e - ends_codon_diff]
                         
-                        loci_ranges_updated_A = loci_ranges_updated_A_fixed
-                        loci_ranges_updated_B = loci_ranges_updated_B_fixed
+                loci_ranges_updated_A = loci_ranges_updated_A_fixed
+                loci_ranges_updated_B = loci_ranges_updated_B_fixed
                         
-                        ## now do the actual aligning
-                        repeated_seqs2aln_A = collectForAligning(loci_ranges_updated_A, 
-                                repeated_loci_A, genome_use_A)
-                        repeated_seqs2aln_B = collectForAligning(loci_ranges_updated_B, 
-                                repeated_loci_B, genome_use_B)
-                        Aseq_all_alnd = []
-                        Bseq_all_alnd = []
-                        for i,(Aseq,Bseq) in enumerate(zip(repeated_seqs2aln_A['seqs'],
-                                                           repeated_seqs2aln_B['seqs'])):
-                            if repeated_seqs2aln_A['types'][i] == 'ORF':
-                                Aseq_aln, Bseq_aln = alignNW_Nuc_as_AA(Aseq, Bseq)
-                            else:
-                                # inter-ORF or rRNA
-                                Aseq_aln, Bseq_aln = alignNW([_SeqRecord(Aseq, id = 'A'), 
-                                                              _SeqRecord(Bseq, id = 'B')])
+                ## now do the actual aligning
+                repeated_seqs2aln_A = collectForAligning(loci_ranges_updated_A, 
+                        repeated_loci_A, genome_use_A)
+                repeated_seqs2aln_B = collectForAligning(loci_ranges_updated_B, 
+                        repeated_loci_B, genome_use_B)
+                # align all ORFs (as amino acids) and inter-ORF regions
+                # of this pair of blocks in one batch
+                seq_pairs = list(zip(repeated_seqs2aln_A['seqs'],
+                                     repeated_seqs2aln_B['seqs']))
+                to_align = []
+                for i,(Aseq,Bseq) in enumerate(seq_pairs):
+                    if repeated_seqs2aln_A['types'][i] == 'ORF':
+                        to_align += [(Aseq.translate(), Bseq.translate())]
+                    else:
+                        # inter-ORF or rRNA
+                        to_align += [(Aseq, Bseq)]
+                        
+                alignments = _Pairwise.align_pairs(to_align, pool = pool)
+                Aseq_all_alnd = []
+                Bseq_all_alnd = []
+                for i,(Aseq,Bseq) in enumerate(seq_pairs):
+                    Aseq_aln, Bseq_aln = alignments[i]
+                    if repeated_seqs2aln_A['types'][i] == 'ORF':
+                        Aseq_aln, Bseq_aln = alignCodons(Aseq, Bseq, 
+                                Aseq_aln, Bseq_aln)
+                        Aseq_aln, Bseq_aln = str(Aseq_aln.seq), str(Bseq_aln.seq)
                             
-                            Aseq_all_alnd += [str(Aseq_aln.seq)]
-                            Bseq_all_alnd += [str(Bseq_aln.seq)]
+                    Aseq_all_alnd += [Aseq_aln]
+                    Bseq_all_alnd += [Bseq_aln]
                         
-                        ## now extend alignments at each end
-                        if len(self.tandem_repeats[replicon_id].intersection(
-                                repeated_loci_A + repeated_loci_B)) > 0:
-                            print('Not extending tandem repeats')
-                        else:
-                            ## extend at end
-                            # check for near-100% identity at end and extend further as necessary
-                            # but not if ORFs in tandem repeats because:
-                            # alignments will be to other parts of repeat, not extending contiguities
-                            # last one, extend to get to end of duplication
-                            # get current (non-extended percent identity)
-                            pIDs = self.get_percent_ID(Aseq_all_alnd[-1], Bseq_all_alnd[-1], 
-                                    window = pID_window_size, step = 20)
-                            mean_pID = sum([pID for pos,pID in pIDs][::1][-num_terminal_window_steps:])/float(num_terminal_window_steps)
-                            if mean_pID > min_pID:
-                                # end of existing alignment not divergent enough to end it: extend
-                                print('extending at end')
-                                extensionA_start = int(loci_ranges_updated_A[-1])
-                                extensionB_start = int(loci_ranges_updated_B[-1])
-                                SeqRecA_alnd_seq, extensionA_end, SeqRecB_alnd_seq, extensionB_end = do_extension(genome_use_A, 
-                                                                                                                  genome_use_B, 
-                                                                                                                  extensionA_start, 
-                                                                                                                  extensionB_start, 
-                                                                                                                  extend_len,
-                                                                                                                  max_extensions,
-                                                                                                                  direction = 1)
+                ## now extend alignments at each end
+                if len(self.tandem_repeats[replicon_id].intersection(
+                        repeated_loci_A + repeated_loci_B)) > 0:
+                    print('Not extending tandem repeats')
+                else:
+                    ## extend at end
+                    # check for near-100% identity at end and extend further as necessary
+                    # but not if ORFs in tandem repeats because:
+                    # alignments will be to other parts of repeat, not extending contiguities
+                    # last one, extend to get to end of duplication
+                    # get current (non-extended percent identity)
+                    pIDs = self.get_percent_ID(Aseq_all_alnd[-1], Bseq_all_alnd[-1], 
+                            window = pID_window_size, step = 20)
+                    mean_pID = sum([pID for pos,pID in pIDs][::1][-num_terminal_window_steps:])/float(num_terminal_window_steps)
+                    if mean_pID > min_pID:
+                        # end of existing alignment not divergent enough to end it: extend
+                        print('extending at end')
+                        extensionA_start = int(loci_ranges_updated_A[-1])
+                        extensionB_start = int(loci_ranges_updated_B[-1])
+                        SeqRecA_alnd_seq, extensionA_end, SeqRecB_alnd_seq, extensionB_end = do_extension(genome_use_A, 
+                                                                                                          genome_use_B, 
+                                                                                                          extensionA_start, 
+                                                                                                          extensionB_start, 
+                                                                                                          extend_len,
+                                                                                                          max_extensions,
+                                                                                                          direction = 1)
                                 
-                                Aseq_all_alnd += [SeqRecA_alnd_seq]
-                                Bseq_all_alnd += [SeqRecB_alnd_seq]
-                                # update last position
-                                loci_ranges_updated_A[-1] = extensionA_end
-                                loci_ranges_updated_B[-1] = extensionB_end
-                            else:
-                                print('already divergent at end ({:.0%}), not extending'.format(mean_pID))
+                        Aseq_all_alnd += [SeqRecA_alnd_seq]
+                        Bseq_all_alnd += [SeqRecB_alnd_seq]
+                        # update last position
+                        loci_ranges_updated_A[-1] = extensionA_end
+                        loci_ranges_updated_B[-1] = extensionB_end
+                    else:
+                        print('already divergent at end ({:.0%}), not extending'.format(mean_pID))
                             
-                            ## extend at end
-                            # need to reverse sequences
-                            pIDs = self.get_percent_ID(Aseq_all_alnd[0], Bseq_all_alnd[0], 
-                                    window = pID_window_size, step = 20)
-                            mean_pID = sum([pID for pos,pID in pIDs][::-1][-num_terminal_window_steps:])/float(num_terminal_window_steps)
-                            if mean_pID > min_pID:
-                                # end of existing alignment not divergent enough to end it: extend
-                                print('extending at beginning')
-                                extensionA_start = int(loci_ranges_updated_A[0])
-                                extensionB_start = int(loci_ranges_updated_B[0])
-                                SeqRecA_alnd_seq, extensionA_end, SeqRecB_alnd_seq, extensionB_end = do_extension(genome_use_A, 
-                                                                                                                  genome_use_B, 
-                                                                                                                  extensionA_start, 
-                                                                                                                  extensionB_start, 
-                                                                                                                  extend_len,
-                                                                                                                  max_extensions,
-                                                                                                                  direction = -1)
-                                Aseq_all_alnd.insert(0, SeqRecA_alnd_seq)
-                                Bseq_all_alnd.insert(0, SeqRecB_alnd_seq)
-                                # update first position
-                                loci_ranges_updated_A[0] = extensionA_end
-                                loci_ranges_updated_B[0] = extensionB_end
-                            else:
-                                print('already divergent at start ({:.0%}), not extending'.format(mean_pID))
+                    ## extend at end
+                    # need to reverse sequences
+                    pIDs = self.get_percent_ID(Aseq_all_alnd[0], Bseq_all_alnd[0], 
+                            window = pID_window_size, step = 20)
+                    mean_pID = sum([pID for pos,pID in pIDs][::-1][-num_terminal_window_steps:])/float(num_terminal_window_steps)
+                    if mean_pID > min_pID:
+                        # end of existing alignment not divergent enough to end it: extend
+                        print('extending at beginning')
+                        extensionA_start = int(loci_ranges_updated_A[0])
+                        extensionB_start = int(loci_ranges_updated_B[0])
+                        SeqRecA_alnd_seq, extensionA_end, SeqRecB_alnd_seq, extensionB_end = do_extension(genome_use_A, 
+                                                                                                          genome_use_B, 
+                                                                                                          extensionA_start, 
+                                                                                                          extensionB_start, 
+                                                                                                          extend_len,
+                                                                                                          max_extensions,
+                                                                                                          direction = -1)
+                        Aseq_all_alnd.insert(0, SeqRecA_alnd_seq)
+                        Bseq_all_alnd.insert(0, SeqRecB_alnd_seq)
+                        # update first position
+                        loci_ranges_updated_A[0] = extensionA_end
+                        loci_ranges_updated_B[0] = extensionB_end
+                    else:
+                        print('already divergent at start ({:.0%}), not extending'.format(mean_pID))
                         
-                        ## now store for next stage
-                        # keep sequences in 5-3 orientation as aligned
-                        A = ''.join(Aseq_all_alnd)
-                        B = ''.join(Bseq_all_alnd)
+                ## now store for next stage
+                # keep sequences in 5-3 orientation as aligned
+                A = ''.join(Aseq_all_alnd)
+                B = ''.join(Bseq_all_alnd)
                         
-                        # but store ordinates reversed for -ve strand
-                        if strandA == 1:
-                            delimitersA = loci_ranges_updated_A[0], loci_ranges_updated_A[-1]
-                        else:
-                            # from start last aligned ORF pair member (with extension) to end of first aligned pair member
-                            delimitersA = reverseRange(loci_ranges_updated_A[0], loci_ranges_updated_A[-1], genome_use_A)
+                # but store ordinates reversed for -ve strand
+                if strandA == 1:
+                    delimitersA = loci_ranges_updated_A[0], loci_ranges_updated_A[-1]
+                else:
+                    # from start last aligned ORF pair member (with extension) to end of first aligned pair member
+                    delimitersA = reverseRange(loci_ranges_updated_A[0], loci_ranges_updated_A[-1], genome_use_A)
                         
-                        if strandB == 1:
-                            delimitersB = loci_ranges_updated_B[0], loci_ranges_updated_B[-1]
-                        else:
-                            # from start last aligned ORF pair member (with extension) to end of first aligned pair member
-                            delimitersB = reverseRange(loci_ranges_updated_B[0], loci_ranges_updated_B[-1], genome_use_B)
+                if strandB == 1:
+                    delimitersB = loci_ranges_updated_B[0], loci_ranges_updated_B[-1]
+                else:
+                    # from start last aligned ORF pair member (with extension) to end of first aligned pair member
+                    delimitersB = reverseRange(loci_ranges_updated_B[0], loci_ranges_updated_B[-1], genome_use_B)
                         
-                        # delimiter relative position determine strand
-                        alignment_combos[repeated_loci_A, repeated_loci_B] = ((delimitersA, A),(delimitersB, B))
-                
-                homologous_groups_alnd += [alignment_combos]
-            
-            self.homologous_groups_alnd[replicon_id] = homologous_groups_alnd
+                # delimiter relative position determine strand
+                alignment_combos[repeated_loci_A, repeated_loci_B] = ((delimitersA, A),(delimitersB, B))
+        
+        return(alignment_combos)
+
+    def align_blocks(self, extend_len = 200,
+                                max_extensions = 10,
+                                min_pID = 0.95,
+                                num_terminal_window_steps = 5,
+                                max_processes = 1):
+        
+        '''
+        Align homologous blocks using the Needleman Wunch pairwise global alignment
+        
+        extension options:
+            extend_len: initial extension length
+            max_extensions: maximum extension iterations
+            min_pID: min percent ID over . . .
+            num_terminal_window_steps: . . . this number of moving window steps, 
+        to continue extension
+
+        max_processes: homologous groups are independent so are aligned in 
+        this many processes. Where processes can be forked, they share the 
+        genome sequence rather than copying it. With one group, the ORFs and 
+        inter-ORF regions of each pair of blocks are aligned in a batch 
+        shared among the processes instead, started once for all batches. 
+        Groups are collected in the same order however aligned.
+        '''
+        options = {'extend_len': extend_len,
+                   'max_extensions': max_extensions,
+                   'min_pID': min_pID,
+                   'num_terminal_window_steps': num_terminal_window_steps}
+
+        self.homologous_groups_alnd = {}
+        # for the pairs of blocks of replicons with one group, started once 
+        # when first needed
+        pairs_pool = None
+        try:
+            for replicon_id,these_homologous_groups in self.homologous_groups.items():
+                genome_seq = self.genome_sequence[replicon_id].tostring()
+                genome_strands = {}
+                genome_strands[1] = _Seq(genome_seq)
+                genome_strands[-1] = genome_strands[1].reverse_complement()
+                num_processes = max(1, min(max_processes, len(these_homologous_groups)))
+                if num_processes > 1:
+                    # largest first so a large group is not left until last
+                    order = sorted(range(len(these_homologous_groups)), key = lambda 
+                            g_n: -len(these_homologous_groups[g_n])**2 * \
+                            len(these_homologous_groups[g_n][0]))
+                    # each process gets the loci, tandem repeats, groups and 
+                    # genome when started (by fork where available, so not 
+                    # copied) instead of with each group
+                    try:
+                        context = _multiprocessing.get_context('fork')
+                    except (AttributeError, ValueError):
+                        # Python 2 always forks where it can
+                        context = _multiprocessing
+                    pool = context.Pool(num_processes, 
+                            initializer = _initGroupAligner, 
+                            initargs = (replicon_id, 
+                                        self.genome_loci_info[replicon_id], 
+                                        self.tandem_repeats[replicon_id], 
+                                        these_homologous_groups, genome_seq, 
+                                        options))
+                    results = pool.map(_alignHomologousGroup, 
+                            [(replicon_id, g_n) for g_n in order], chunksize = 1)
+                    pool.close()
+                    pool.join()
+                    homologous_groups_alnd = [None] * len(these_homologous_groups)
+                    for g_n,alignment_combos in zip(order, results):
+                        homologous_groups_alnd[g_n] = alignment_combos
+                else:
+                    if max_processes > 1 and these_homologous_groups and \
+                            pairs_pool is None:
+                        pairs_pool = _multiprocessing.Pool(max_processes)
+                    homologous_groups_alnd = []
+                    for g_n,groups in enumerate(these_homologous_groups):
+                        homologous_groups_alnd += [self.alignHomologousGroup(
+                                replicon_id, g_n, groups, genome_strands, 
+                                pool = pairs_pool, **options)]
+            
+                self.homologous_groups_alnd[replicon_id] = homologous_groups_alnd
+        finally:
+            if pairs_pool is not None:
+                pairs_pool.close()
+                pairs_pool.join()
 
     def get_percent_ID(self, A, B, window = 100, step = 20):
         pID_per_window = []
@@ -1452,9 +1670,8 @@ class Finder(_MetaSample):
                     chromchar = self.genome_sequence[replicon_id][alnd_chrom_pos0]
                 else:
                     #chromchar = self.genome_genbank_record.seq[alnd_chrom_pos0:alnd_chrom_pos0+1].reverse_complement()[0]
-                    chromchar = _Seq(
-                            self.genome_sequence[replicon_id][alnd_chrom_pos0:alnd_chrom_pos0+1].\
-                            tostring()).reverse_complement()[0]
+                    chromchar = self.genome_sequence[replicon_id][
+                            alnd_chrom_pos0:alnd_chrom_pos0+1].reverse_complement()[0]
                 
                 #print(char, chromchar)
                 e = 'mismatch detected when assigning percent identity between '\
@@ -1604,19 +1821,23 @@ class Finder(_MetaSample):
                           local_repeats_path = ['repeats'], 
                           local_genomes_path = ['genome_sequences'], 
                           retain_bwa_output = True, 
-                          force = False):
+                          force = False, 
+                          max_cpus = -1):
         '''
         Find repeats!
         Final selection of ambiguous repeats for filtering selectes regions default >=95% identity
         Initial assignment and alignment of homologous blocks requires >= 85% of the above 95% nucleotide identity
 
-        max_follow_iterations: number of times to follow one way hits . . .
+        max_follow_iterations: no longer used: one way hits are followed to 
+        all loci homologous via any chain of hits in one pass
+
+        max_cpus: alignments to each replicon are parsed in parallel and 
+        homologous groups are aligned in parallel
 
         '''
 
         exe_bwa = False
         exe_samtools = False
-        exe_aligner = False
 
         def get_exe(name):
             from baga.Dependencies import dependencies as _dependencies
@@ -1643,14 +1864,6 @@ class Finder(_MetaSample):
             self.exe_samtools = 'samtools'
             
 
-        if not exe_aligner:
-            self.exe_aligner = get_exe('seq-align')
-        elif exe_bwa == 'system':
-            self.exe_aligner = _dependencies['seq-align']['checker']['arguments']['path'][-1]
-        else:
-            self.exe_aligner = 'seq-align'
-
-
         local_repeats_path = _os.path.sep.join(local_repeats_path)
         local_genomes_path = _os.path.sep.join(local_genomes_path)
 
@@ -1668,43 +1881,32 @@ class Finder(_MetaSample):
         #### align ORFs to chromosome ####
         # <== eventually align among replicons, not per replicons
         # (single multi-sequence fastas, single BWA command, multi sequence BAMs etc)
+        # FASTA and index are only rewritten if the sequence changed
         print('Writing genome to FASTA')
+        references = _ReferenceCache(local_genomes_path)
         genome_fna = {}
         for replicon_id,seq_array in self.genome_sequence.items():
-            genome_fna[replicon_id] = '{}/{}.fna'.format(local_genomes_path, replicon_id)
-            _SeqIO.write(
-                    _SeqRecord(_Seq(seq_array.tostring()), 
-                            id = replicon_id, 
-                            description = self.genome_names[replicon_id]),
-                    genome_fna[replicon_id], 'fasta')
-            
-            cmd = [self.exe_bwa, 'index', genome_fna[replicon_id]]
-            print('Called: {}'.format(' '.join(cmd)))
-            try:
-                _subprocess.call(cmd)
-            except OSError:
+            genome_fna[replicon_id] = references.fasta(replicon_id, 
+                    {replicon_id: seq_array}, self.genome_names)
+            
+            if not references.bwaIndex(genome_fna[replicon_id], self.exe_bwa):
                 print('Problem running BWA at {}. Please use Dependencies module '\
-                        'to install locally or check system path'.format(cmd[0]))
+                        'to install locally or check system path'.format(
+                        self.exe_bwa))
 
         # collect ORF and rRNA sequences per replicon from genome_loci_info
         genome_fna_loci = {}
-        recs = {}
         for replicon_id,description in self.genome_names.items():
             genome_fna_loci[replicon_id] = '{}/{}_loci.fna'.format(local_genomes_path, replicon_id)
-            recs[replicon_id] = []
-            
+            # slices and reverse complements are views of the genome sequence
+            loci_seqs = {}
             for locus,(s,e,strand,gene_name) in self.genome_loci_info[replicon_id].items():
                 if strand == 1:
-                    recs[replicon_id] += [_SeqRecord(_Seq(
-                            self.genome_sequence[replicon_id][s:e].tostring()), 
-                            id = locus)]
+                    loci_seqs[locus] = self.genome_sequence[replicon_id][s:e]
                 else:
-                    recs[replicon_id] += [_SeqRecord(_Seq(
-                            self.genome_sequence[replicon_id][s:e].tostring()).reverse_complement(), 
-                            id = locus)]
-
-        for replicon_id,description in self.genome_names.items():
-            _SeqIO.write(recs[replicon_id], genome_fna_loci[replicon_id], 'fasta')
+                    loci_seqs[locus] = self.genome_sequence[replicon_id][s:e].reverse_complement()
+            
+            _writeFASTA(genome_fna_loci[replicon_id], loci_seqs)
 
         ## relaxed alignments using BWA i.e. find modestly divergent ORFs
         base_cmd = [self.exe_bwa, 'mem',
@@ -1796,23 +1998,12 @@ class Finder(_MetaSample):
 
         #### parse and analyse ORF-chromosome alignment ####
         print('Parsing and analysing the ORF-chromosome alignments . . .')
+        self.parseBamsForDoubleHits(dict([(replicon_id, _os.path.sep.join(
+                [local_repeats_path, bam_name])) for replicon_id,bam_name in \
+                bam_names_sorted.items()]), _decide_max_processes(max_cpus))
         for replicon_id,description in self.genome_names.items():
-            self.parseBamForDoubleHits(replicon_id, _os.path.sep.join(
-                    [local_repeats_path, bam_names_sorted[replicon_id]]))
             # this would vary for genomes other than LESB58
             self.followHitsAndAdd(replicon_id)
-            i = 0
-            while len(self.hits[replicon_id]) != len(set([a for b in 
-                    self.hits[replicon_id].values() for a in b])):
-                self.followHitsAndAdd(replicon_id)
-                i += 1
-                print(i)
-                if i == max_follow_iterations:
-                    # for general use this should be a warning that could be logged but ignored?
-                    # maybe use 'force' or a new 'ignore'?
-                    print('Followed too many one-way ORF alignments for {} in {} . . . '\
-                            ''.format(replicon_id, self.genome_name))
-                    raise
 
         #### get contiguous blocks and their homologs (other blocks) ####
         self.orderLocusHits()
@@ -1826,7 +2017,8 @@ class Finder(_MetaSample):
         # selection of ambiguous regions below
         pre_post_pID_prop = 0.85
         pre_min_pID = minimum_percent_identity * pre_post_pID_prop
-        self.align_blocks(min_pID = pre_min_pID, max_extensions = 15)
+        self.align_blocks(min_pID = pre_min_pID, max_extensions = 15, 
+                max_processes = _decide_max_processes(max_cpus))
         self.map_alignments_to_chromosome()
 
         #### identify 98% (default) identical regions
@@ -1873,14 +2065,11 @@ class Finder(_MetaSample):
             pass
 
         print('Writing genome replicons to FASTA')
+        references = _ReferenceCache(local_genomes_path)
         genome_fna = {}
         for replicon_id,seq_array in self.genome_sequence.items():
-            genome_fna[replicon_id] = '{}/{}.fna'.format(local_genomes_path, replicon_id)
-            _SeqIO.write(
-                    _SeqRecord(_Seq(seq_array.tostring()), 
-                            id = replicon_id, 
-                            description = self.genome_names[replicon_id]),
-                    genome_fna[replicon_id], 'fasta')
+            genome_fna[replicon_id] = references.fasta(replicon_id, 
+                    {replicon_id: seq_array}, self.genome_names)
 
         print('Runing numcer on each replicon')
         coords = {}
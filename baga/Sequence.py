@@ -0,0 +1,198 @@
+#! /usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Bacterial and Archaeal Genome Analyser
+# Copyright (C) 2015-2016 David Williams
+# david.williams.at.liv.d-dub.org.uk
+# License GPLv3+: GNU GPL version 3 or later
+# This is free software: you are free to change and redistribute it
+# There is NO WARRANTY, to the extent permitted by law
+#
+# Work on this software was started at The University of Liverpool, UK
+# with funding from The Wellcome Trust (093306/Z/10) awarded to:
+# Dr Steve Paterson (The University of Liverpool, UK)
+# Dr Craig Winstanley (The University of Liverpool, UK)
+# Dr Michael A Brockhurst (The University of York, UK)
+#
+'''
+Sequence module from the Bacterial and Archaeal Genome Analyzer (BAGA).
+
+This module contains a compact, read-only genome sequence type holding one
+byte per nucleotide, which can be sliced and reverse complemented without
+copying and written straight to FASTA files.
+'''
+
+# stdlib (not via baga: this module is imported by baga/__init__.py)
+import sys as _sys
+
+PY3 = _sys.version_info > (3,)
+
+def main():
+    pass
+
+if PY3:
+    _complement = bytes.maketrans(b'ACGTRYKMBVDHNacgtrykmbvdhn',
+                                  b'TGCAYRMKVBHDNtgcayrmkvbhdn')
+else:
+    import string as _string
+    _complement = _string.maketrans('ACGTRYKMBVDHNacgtrykmbvdhn',
+                                    'TGCAYRMKVBHDNtgcayrmkvbhdn')
+
+def _as_bytes(data):
+    '''bytes from text, bytes, array.array('u' or 'c') or other buffers'''
+    if isinstance(data, GenomeSequence):
+        return(data.tobytes())
+    if hasattr(data, 'typecode'):
+        # array.array
+        if data.typecode == 'u':
+            data = data.tounicode()
+        elif PY3:
+            data = data.tobytes()
+        else:
+            data = data.tostring()
+    if isinstance(data, bytes):
+        return(data)
+    if not PY3 and isinstance(data, unicode):
+        return(data.encode('ascii'))
+    if isinstance(data, str):
+        return(data.encode('ascii'))
+    return(bytes(data))
+
+class GenomeSequence(object):
+    '''
+    A nucleotide sequence stored as one byte per base
+
+    Behaves like the str and array.array('u') (or 'c' in Python 2) sequences
+    it replaces: len(), indexing gives one character strings, iterating gives
+    characters, str() and .tostring() give the whole sequence. Unlike them,
+    slicing (with step 1) and .reverse_complement() return views sharing the
+    same buffer instead of copies.
+    '''
+    __slots__ = ('_view', '_strand')
+
+    def __init__(self, data = b'', strand = 1):
+        if isinstance(data, memoryview):
+            self._view = data
+        else:
+            self._view = memoryview(_as_bytes(data))
+        self._strand = strand
+
+    def __len__(self):
+        return(len(self._view))
+
+    def _forward_slice(self, start, stop):
+        '''forward strand view for a slice of this (maybe reverse) strand'''
+        if self._strand == 1:
+            return(self._view[start:stop])
+        length = len(self._view)
+        return(self._view[length - stop:length - start])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return(GenomeSequence(self._forward_slice(start,
+                        max(start, stop)), self._strand))
+            return(GenomeSequence(self.tobytes()[key]))
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('GenomeSequence index out of range')
+        char = self._forward_slice(key, key + 1).tobytes()
+        if self._strand == -1:
+            char = char.translate(_complement)
+        if PY3:
+            return(char.decode('ascii'))
+        return(char)
+
+    def __iter__(self):
+        for char in self.tostring():
+            yield(char)
+
+    def __str__(self):
+        return(self.tostring())
+
+    def __repr__(self):
+        seq = self.tostring()
+        if len(seq) > 60:
+            seq = seq[:27] + '...' + seq[-27:]
+        return('GenomeSequence({!r})'.format(seq))
+
+    def __eq__(self, other):
+        if isinstance(other, GenomeSequence):
+            return(self.tobytes() == other.tobytes())
+        try:
+            return(self.tobytes() == _as_bytes(other))
+        except (TypeError, UnicodeError):
+            return(NotImplemented)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return(equal)
+        return(not equal)
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return(GenomeSequence(self.tobytes() + _as_bytes(other)))
+
+    def __reduce__(self):
+        return(GenomeSequence, (self.tobytes(),))
+
+    @property
+    def strand(self):
+        return(self._strand)
+
+    def reverse_complement(self):
+        '''reverse complement of this sequence as a view of the same buffer'''
+        return(GenomeSequence(self._view, -self._strand))
+
+    def tobytes(self):
+        data = self._view.tobytes()
+        if self._strand == -1:
+            return(data.translate(_complement)[::-1])
+        return(data)
+
+    def tostring(self):
+        '''the sequence as a str (as for array.array)'''
+        if PY3:
+            return(self.tobytes().decode('ascii'))
+        return(self.tobytes())
+
+    tounicode = tostring
+
+    def writeFASTA(self, handle, seq_id, description = '', width = 60):
+        '''
+        Write this sequence to a file opened in binary mode as a FASTA
+        record, like BioPython, without making a full copy of the sequence.
+        '''
+        if description and description.split(None, 1)[0] != seq_id:
+            title = '{} {}'.format(seq_id, description)
+        else:
+            title = description or seq_id
+        handle.write('>{}\n'.format(title).encode('utf-8'))
+        for start in range(0, len(self), width):
+            if self._strand == 1:
+                handle.write(self._view[start:start + width])
+            else:
+                handle.write(self[start:start + width].tobytes())
+            handle.write(b'\n')
+
+def writeFASTA(file_name, sequences, descriptions = {}, width = 60):
+    '''
+    Write a dict of GenomeSequence objects (or any sequences) to a FASTA file
+
+    Records are ordered by id and described by descriptions if provided.
+    '''
+    with open(file_name, 'wb') as fout:
+        for seq_id in sorted(sequences):
+            sequence = sequences[seq_id]
+            if not isinstance(sequence, GenomeSequence):
+                sequence = GenomeSequence(sequence)
+            sequence.writeFASTA(fout, seq_id, descriptions.get(seq_id, ''),
+                    width = width)
+
+
+if __name__ == '__main__':
+    main()
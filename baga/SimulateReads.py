@@ -297,11 +297,14 @@ class Simulator:
         if len(self.large_deletions):
             # generate a version of reference genome with large deletions
             ranges = sorted(self.large_deletions.values())
+            # slices are views of a GenomeSequence: concatenate into a copy
             genome_large_deletions = self.genome.sequence[:ranges[0][0]]
             for n,(s,e) in enumerate(ranges[:-1]):
-                genome_large_deletions.extend(self.genome.sequence[e:ranges[n+1][0]])
+                genome_large_deletions = genome_large_deletions + \
+                        self.genome.sequence[e:ranges[n+1][0]]
             
-            genome_large_deletions.extend(self.genome.sequence[ranges[n+1][1]:])
+            genome_large_deletions = genome_large_deletions + \
+                    self.genome.sequence[ranges[n+1][1]:]
             
             # adjust generated variant positions for geneome with deletions
             def adjust(pos0):
@@ -37,16 +37,17 @@ from baga import _json
 from baga import _subprocess
 from baga import _sys
 from baga import _logging
+from baga import _multiprocessing
 
 from glob import glob as _glob
 from array import array as _array
-import operator as _operator
 import time as _time
 import string as _string
 from collections import Counter as _Counter
 
 # external Python modules
 import pysam as _pysam
+import numpy as _np
 from Bio import SeqIO as _SeqIO
 from Bio.Seq import Seq as _Seq
 from Bio.SeqRecord import SeqRecord as _SeqRecord
@@ -54,8 +55,11 @@ from Bio.SeqRecord import SeqRecord as _SeqRecord
 from baga import report_time as _report_time
 from baga import get_exe_path as _get_exe_path
 from baga import get_available_memory as _get_available_memory
+from baga import decide_max_processes as _decide_max_processes
 
 from baga import MetaSample as _MetaSample
+from baga.Depths import DepthStore as _DepthStore
+from baga import Pairwise as _Pairwise
 from baga import PROGRESS
 from baga import PY3 as _PY3
 
@@ -71,6 +75,44 @@ def main():
     pass
 
 
+def window_means(values, window = 500, step = 1, resolution = 10, 
+        include_zeros = False):
+    '''
+    Mean of values in a window of specified width (in positions) moving by step 
+    values at a time. Values can have a lower than 1:1 resolution e.g., 1 in 10 
+    positions with resolution = 10.
+    
+    Negative values, and zeros unless include_zeros, are excluded from each 
+    mean. When less than half the window is valid values, it is made up with 
+    zeros to decrease the mean moderately e.g., close to edges of regions with 
+    reads mapped. Sums are taken from cumulative sums of the valid values and 
+    their counts so any window or step costs the same.
+    
+    returns numpy array of means
+    '''
+    values = _np.asarray(values, dtype = _np.float64)
+    if include_zeros:
+        valid = values >= 0
+    else:
+        valid = values > 0
+    
+    sums = _np.concatenate(([0.0], _np.cumsum(_np.where(valid, values, 0))))
+    counts = _np.concatenate(([0], _np.cumsum(valid)))
+    starts = _np.arange(0, len(values) * resolution - window, resolution)[::step]
+    ends = _np.minimum((starts + window) // resolution, len(values))
+    starts = _np.minimum(starts // resolution, ends)
+    
+    window_sums = sums[ends] - sums[starts]
+    window_counts = counts[ends] - counts[starts]
+    half_window = window / 2.0 / resolution
+    # pad with int(half window - count) zeros when count <= half window
+    divisors = _np.where(window_counts <= half_window, 
+            window_counts + _np.floor(half_window - window_counts), 
+            window_counts)
+    means = _np.zeros(len(starts))
+    _np.divide(window_sums, divisors, out = means, where = divisors > 0)
+    return(means)
+
 def moving_stats(values, window = 500, step = 1, resolution = 10):
     '''
     calculate:
@@ -82,32 +124,13 @@ def moving_stats(values, window = 500, step = 1, resolution = 10):
     over window of specified width moving by specified step size. Input can have 
     a lower than 1:1 resolution e.g., 1 in 10 positions with resolution = 10
     '''
-    mean = _array('f')
-    #variance = _array('f')
-    #st_dev = _array('f')
-    for i in range(0, len(values) * resolution - window, resolution)[::step]:  #break
-        # collect nt range allowing for resolution of ratios
-        these = values[(i / resolution) : ((i + window) / resolution)]
-        # exclude zero ratios from calculation of mean: 
-        # associated with areas of low quality read alignments
-        # also present at edges of large deletions so prevent them lowering window mean prematurely
-        # require minimum half window length 
-        these = [t for t in these if t > 0]
-        if len(these) <= window / 2.0 / resolution:
-            # when length of non-zero window is less than half that specified,
-            # make up with zeros to decrease mean moderately close to edge of 
-            # reference chromosome region with reads mapped
-            these += [0] * int(window / 2.0 / resolution - len(these))
-        
-        # if len(these) >= 3:
-            # these_mean = 0
-        # else:
-        these_mean = sum(these) / float(len(these))
-        #these_variance = sum([(t - these_mean)**2 for t in these]) / (float(len(these) - 1))
-        #these_st_dev = these_variance**0.5
-        mean.append(these_mean)
-        #variance.append(these_variance)
-        #st_dev.append(these_st_dev)
+    # exclude zero values from calculation of mean: 
+    # associated with areas of low quality read alignments
+    # also present at edges of large deletions so prevent them lowering window mean prematurely
+    # require minimum half window length: see window_means()
+    means = window_means(values, window = window, step = step, 
+            resolution = resolution)
+    mean = _array('f', means.astype(_np.float32).tobytes())
     
     #return(mean, variance, st_dev)
     return(mean)
@@ -145,6 +168,7 @@ def checkStructure(BAMs,
                    genome_name = False,
                    use_existing_bam_indexes = False,
                    force = False,
+                   max_cpus = -1,
                    # if part of a pipeline with existing logger:
                    task_name = False,
                    console_verbosity_lvl = False,
@@ -152,6 +176,8 @@ def checkStructure(BAMs,
     '''
     check for structural rearrangements . . .
     smoothed_window defaults to half of estimated fragment length
+    coverage depths for all BAMs are collected concurrently using up to 
+    max_cpus processes
     '''
 
     # this is a module level function calling other objects from module
@@ -245,19 +271,30 @@ def checkStructure(BAMs,
     # not is_secondary
     # not is_qcfail
 
+    # depth collection resolution impacts downstream resolutions
+    # i.e., 1 in 10 here plus 1 in 10 smoothed ratio == 1 in 100 considered
+    ## but why is this hardwired, but smoothed ratio provided with 10 as argument?
+    ## what if these resolutions differ?
+    ## check how getSmoothedRatios() uses smoothed ration carefully . . .
+    depth_resolution = 10
+    # collect coverage for all BAMs together: chunks of every sequence in 
+    # every BAM not already in the depth track store share one pool of processes
+    for sample,checker in sorted(checkers.items()):
+        logger.info('Collecting coverage for {} reads aligned to {}'\
+                ''.format(checker.reads_name, ', '.join(sorted(checker.genome_lengths))))
+    
+    depths = _DepthStore().getDepths(
+            sorted(set([checker.path_to_bam for checker in checkers.values()])), 
+            resolution = depth_resolution, 
+            min_mapping_quality = min_mapping_quality, 
+            max_processes = _decide_max_processes(max_cpus), 
+            force = force)
+    for sample,checker in sorted(checkers.items()):
+        checker.setCoverageDepths(depths[checker.path_to_bam], depth_resolution, 
+                min_mapping_quality)
+
     start_time = _time.time()
     for cnum,(sample,checker) in enumerate(sorted(checkers.items())):
-        logger.info('Collecting coverage for {} reads aligned to {}'\
-                ''.format(sample, ', '.join(sorted(checker.genome_lengths))))
-        # depth collection resolution impacts downstream resolutions
-        # i.e., 1 in 10 here plus 1 in 10 smoothed ratio == 1 in 100 considered
-        ## but why is this hardwired, but smoothed ratio provided with 10 as argument?
-        ## what if these resolutions differ?
-        ## check how getSmoothedRatios() uses smoothed ration carefully . . .
-        depth_resolution = 10
-        checker.getCoverageDepths(min_mapping_quality = min_mapping_quality, 
-                resolution = depth_resolution, force = force)
-        
         logger.info('Calculating mean insert size for {} reads aligned to {}'\
                 ''.format(sample, ', '.join(sorted(checker.genome_lengths))))
         checker.getMeanInsertSize(force = force)
@@ -329,7 +366,8 @@ def checkStructure(BAMs,
                     'excludes {} regions spanning {:,} basepairs'.format(sample, 
                     chrm_name, t, s))
         
-        checker.saveLocal()
+        # depths are kept in the shared depth track store
+        checker.saveLocal(exclude = ['depths_totals', 'depths_propers'])
         
         # report durations, time left etc <===
         # ==== this needs updating to work with logging
@@ -414,117 +452,117 @@ class Checker(_MetaSample):
         #print('%s / %s = %.03f' % (len(both_mapped_proper), (len(both_mapped_proper)+len(both_mapped_notproper)), proportion))
         return(proportion)
 
+    def hasCoverageDepths(self):
+        '''
+        check for total and proper-paired read depths for every sequence, e.g., 
+        from a previous analysis
+        '''
+        if not hasattr(self, 'depths_totals'):
+            self.loadCoverageDepths()
+        
+        have_totals = []
+        have_propers = []
+        try:
+            for seq_name,length in sorted(self.genome_lengths.items()):
+                if type(self.depths_totals[seq_name]) is _array and \
+                        len(self.depths_totals[seq_name]) == \
+                        int(length / self.depth_resolution) + 1:
+                    have_totals += [True]
+                    self.logger.info('Found total read depths for {} '\
+                            'against {} from previous analysis'.format(
+                            self.path_to_bam, seq_name))
+        except (AttributeError, KeyError) as e:
+            self.logger.debug('Could not find total read depths for {} '\
+                    'against {} from a previous analysis: "{}"'.format(
+                    self.path_to_bam, seq_name, e))
+            pass
+        
+        # correct looking data found for all sequences?
+        if len(have_totals):
+            have_totals = all(have_totals)
+        else:
+            have_totals = False
+        
+        try:
+            for seq_name,length in sorted(self.genome_lengths.items()):
+                if type(self.depths_propers[seq_name]) is _array and \
+                        len(self.depths_propers[seq_name]) == \
+                        int(length / self.depth_resolution) + 1:
+                    have_propers += [True]
+                    self.logger.info('Found proper-paired read depths for {} '\
+                            'against {} from previous analysis'.format(
+                            self.path_to_bam, seq_name))
+        except (AttributeError, KeyError) as e:
+            self.logger.debug('Could not find proper-paired read depths for '\
+                    '{} against {} from a previous analysis: "{}"'.format(
+                    self.path_to_bam, seq_name, e))
+            pass
+        
+        # correct looking data found for all sequences?
+        if len(have_propers):
+            have_propers = all(have_propers)
+        else:
+            have_propers = False
+        
+        return(have_totals and have_propers)
+
+    def loadCoverageDepths(self):
+        '''
+        restore depths from the shared depth track store for the resolution 
+        and minimum mapping quality of a previous analysis
+        '''
+        try:
+            resolution = self.depth_resolution
+            min_mapping_quality = self.depth_min_mapping_quality
+        except AttributeError:
+            return(False)
+        
+        depths = _DepthStore().load(self.path_to_bam, 
+                min_mapping_quality = min_mapping_quality, 
+                resolution = resolution)
+        if depths is None:
+            return(False)
+        
+        self.setCoverageDepths(depths, resolution, min_mapping_quality)
+        return(True)
+
     def getCoverageDepths(self, resolution = 10, 
                                 min_mapping_quality = 30, 
-                                force = False):
+                                force = False,
+                                max_cpus = 1):
         '''
         collect per position along genome, aligned read coverage depth that pass a 
         quality standard and those that BWA considers additionally to be in a 
         "proper" pair.
+        
+        Depths are taken from the shared depth track store, scanning the BAM 
+        in chunks shared among max_cpus processes if not found there: see 
+        Depths.collectDepths().
         '''
-
-        have_totals = []
-        have_propers = []
-        # check if needed data is present
-        if not force:
-            try:
-                for seq_name,length in sorted(self.genome_lengths.items()):
-                    if type(self.depths_totals[seq_name]) is _array and \
-                            len(self.depths_totals[seq_name]) == \
-                            int(length / self.depth_resolution) + 1:
-                        have_totals += [True]
-                        self.logger.info('Found total read depths for {} '\
-                                'against {} from previous analysis'.format(
-                                self.path_to_bam, seq_name))
-            except (AttributeError, KeyError) as e:
-                self.logger.debug('Could not find total read depths for {} '\
-                        'against {} from a previous analysis: "{}"'.format(
-                        self.path_to_bam, seq_name, e.message))
-                pass
-            
-            # correct looking data found for all sequences?
-            if len(have_totals):
-                have_totals = all(have_totals)
-            else:
-                have_totals = False
-            
-            try:
-                for seq_name,length in sorted(self.genome_lengths.items()):
-                    if type(self.depths_propers[seq_name]) is _array and \
-                            len(self.depths_propers[seq_name]) == \
-                            int(length / self.depth_resolution) + 1:
-                        have_propers += [True]
-                        self.logger.info('Found proper-paired read depths for {} '\
-                                'against {} from previous analysis'.format(
-                                self.path_to_bam, seq_name))
-            except (AttributeError, KeyError) as e:
-                self.logger.debug('Could not find proper-paired read depths for '\
-                        '{} against {} from a previous analysis: "{}"'.format(
-                        self.path_to_bam, seq_name, e.message))
-                pass
-            
-            # correct looking data found for all sequences?
-            if len(have_propers):
-                have_propers = all(have_propers)
-            else:
-                have_propers = False
-
-
-        # check if need access to reads
-        if (not all([have_totals, have_propers])) and not hasattr(self, 'reads'):
-            try:
-                self.reads = _pysam.Samfile(self.path_to_bam, 'rb')
-            except AttributeError:
-                raise Exception('Problems restoring data from disk, please '\
-                        're-run with the force option')
-
-        if not hasattr(self, 'depth_totals'):
-            self.depths_totals = {}
-
-        if not hasattr(self, 'depths_propers'):
-            self.depths_propers = {}
-
-        if force or not (have_totals and have_propers):
-            if force and (have_totals or have_propers):
-                self.logger.info('Recalculating read coverage depths '\
-                        'because force is True')
-            for h,header in enumerate(sorted(self.reads.header['SQ'])):
-                num_ref_positions = header['LN']
-                seq_name = header['SN']
-                self.logger.info('Scanning {} in {} for read coverage depths'\
-                        ''.format(seq_name, self.genome_name))
-                depth_total = _array('i', (0,) * \
-                        (int(num_ref_positions / resolution) + 1))
-                depth_proper = _array('i', (0,) * \
-                        (int(num_ref_positions / resolution) + 1))
-                pl_iter = self.reads.pileup( seq_name )
-                for x in pl_iter:
-                    # Coordinates in pysam are always 0-based.
-                    # SAM text files use 1-based coordinates.
-                    if x.pos % resolution == 0:
-                        read_count_proper_pair = 0
-                        read_count_non_dup = 0
-                        for r in x.pileups:
-                            if \
-                              not r.alignment.is_qcfail and \
-                              not r.alignment.is_duplicate and \
-                              not r.alignment.is_secondary and \
-                              r.alignment.mapping_quality >= min_mapping_quality:
-                                
-                                read_count_non_dup += 1
-                                
-                                if r.alignment.is_proper_pair:
-                                    
-                                    read_count_proper_pair += 1
-                        
-                        pos_in_arrays = x.pos / resolution
-                        depth_total[pos_in_arrays] = read_count_non_dup
-                        depth_proper[pos_in_arrays] = read_count_proper_pair
-                
-                self.depths_totals[seq_name] = depth_total
-                self.depths_propers[seq_name] = depth_proper
-                # needed for plotting
-                self.depth_resolution = resolution
+        if force and hasattr(self, 'depths_totals'):
+            self.logger.info('Recalculating read coverage depths '\
+                    'because force is True')
+        
+        depths = _DepthStore().getDepths([self.path_to_bam], 
+                resolution = resolution, 
+                min_mapping_quality = min_mapping_quality, 
+                max_processes = _decide_max_processes(max_cpus), 
+                force = force)
+        self.setCoverageDepths(depths[self.path_to_bam], resolution, 
+                min_mapping_quality)
+
+    def setCoverageDepths(self, depths, resolution, min_mapping_quality):
+        '''store depths for this BAM from the depth track store'''
+        self.depths_totals = {}
+        self.depths_propers = {}
+        for seq_name in self.genome_lengths:
+            total, proper = depths[seq_name]
+            self.depths_totals[seq_name] = _array('i', total.tobytes())
+            self.depths_propers[seq_name] = _array('i', proper.tobytes())
+        # needed for plotting
+        self.depth_resolution = resolution
+        # needed to restore depths from the store
+        self.depth_min_mapping_quality = min_mapping_quality
 
 
     def getMeanInsertSize(self, upper_limit = 10000, 
@@ -662,30 +700,14 @@ class Checker(_MetaSample):
                 self.logger.debug('Calculating smoothed ratios of read depths.')
             smoothed_ratios = {}
             for seq_name in self.depths_totals:
-                use_ratios = self.ratios
-                these_means = _array('f')
-                for i in range(0, len(use_ratios[seq_name]) * resolution - \
-                        window, resolution):
-                    # collect nt range allowing for resolution of ratios
-                    start = int(i / resolution)
-                    end = int((i + window) / resolution)
-                    these = use_ratios[seq_name][start:end]
-                    # exclude zero ratios from calculation of mean: 
-                    # associated with areas of low quality read alignments
-                    # also present at edges of large deletions so prevent
-                    # them lowering window mean prematurely
-                    # require minimum half window length 
-                    these = [t for t in these if t >= 0]
-                    if len(these) <= window / 2.0 / resolution:
-                        # when length of non-zero window is less than half
-                        # that specified, make up with zeros to decrease mean 
-                        # moderately close to edge of reference chromosome
-                        # region with reads mapped
-                        these += [0] * int(window / 2.0 / resolution - len(these))
-                    
-                    these_mean = sum(these) / float(len(these))
-                    these_means.append(these_mean)
-                smoothed_ratios[seq_name] = these_means
+                # exclude -1 ratios (no depths) from calculation of mean but 
+                # include zeros: see window_means() for treatment of windows
+                # with less than half positions with ratios
+                these_means = window_means(self.ratios[seq_name], 
+                        window = window, resolution = resolution, 
+                        include_zeros = True)
+                smoothed_ratios[seq_name] = _array('f', 
+                        these_means.astype(_np.float32).tobytes())
             
             self.smoothed_ratios = smoothed_ratios
         elif hasattr(self, 'smoothed_ratios'):
@@ -710,78 +732,46 @@ class Checker(_MetaSample):
         Threshold testing can be '>', '>=', '<' or '<='
         '''
         # sort out test function
-        if test == '>=':
-            
-            def threshold_crossed(value):
-                return(_operator.ge(value, threshold))
-            
-        elif test == '<=':
+        tests = {'>=': _np.greater_equal, 
+                 '<=': _np.less_equal, 
+                 '<': _np.less, 
+                 '>': _np.greater}
+        if test in tests:
             
-            def threshold_crossed(value):
-                return(_operator.le(value, threshold))
-
-        elif test == '<':
-            
-            def threshold_crossed(value):
-                return(_operator.lt(value, threshold))
-
-        elif test == '>':
-            
-            def threshold_crossed(value):
-                return(_operator.gt(value, threshold))
+            def threshold_crossed(values):
+                return(tests[test](values, threshold))
 
         else:
             print('Warning: "test" can be ">", ">=", "<" or "<=", not "{}"'.format(test))
             
-            def threshold_crossed(value):
-                return(False)
-
-
-        # if input is a (sparse) dict, make it list-like
-
-        #for v in these_values[::10]: threshold_crossed(v)
+            def threshold_crossed(values):
+                return(_np.zeros(len(values), dtype = bool))
 
         suspect_regions = {}
         for seq_name,these_values in values.items():
-            # convert to array adding zeros if/when required
+            # if input is a (sparse) dict, make it list-like adding zeros 
+            # if/when required
             if isinstance(these_values, dict):
-                data_type = str(type(these_values.values()[0])).split("<type '")[1][0]
-                use_values = _array(data_type)
-                for pos1 in range(min(these_values), max(these_values), resolution):
-                    try:
-                        use_values.append(these_values[pos1])
-                    except KeyError:
-                        use_values.append(0)
+                use_values = [these_values.get(pos1, 0) for pos1 in \
+                        range(min(these_values), max(these_values), resolution)]
             else:
                 use_values = these_values
             
-            these_suspect_regions = []
-            positions = range(offset, len(these_values)*resolution + offset, 
-                    resolution)
-            # initialise collecting depending on state at beginning
-            if threshold_crossed(use_values[0]):
-                collecting = True
-                these_suspect_regions += [positions[0]]
-            else:
-                collecting = False
-            for pos,v in zip(positions, use_values):
-                if threshold_crossed(v):
-                    if not collecting:
-                        # exceeds limit and not collecting so start
-                        collecting = True
-                        these_suspect_regions += [pos]
-                else:
-                    if collecting:
-                        # below limit and collecting so stop
-                        collecting = False
-                        these_suspect_regions += [pos]
-            
-            if len(these_suspect_regions) % 2 != 0:
+            # compare as float64: float32 thresholds would round differently
+            use_values = _np.asarray(use_values, dtype = _np.float64)
+            # positions were generated for length of input
+            crossed = threshold_crossed(use_values[:len(these_values)])
+            # run starts and ends are where threshold_crossed() changes
+            changes = _np.diff(_np.concatenate(([0], 
+                    crossed.astype(_np.int8))))
+            starts = offset + _np.flatnonzero(changes == 1) * resolution
+            ends = offset + _np.flatnonzero(changes == -1) * resolution
+            
+            these_suspect_regions = list(zip(starts.tolist(), ends.tolist()))
+            if len(starts) > len(ends):
                 # complete terminal range
-                these_suspect_regions += [self.genome_lengths[seq_name]]
-            
-            these_suspect_regions = [these_suspect_regions[n:n+2] for n in \
-                    range(0,len(these_suspect_regions),2)]
+                these_suspect_regions += [(int(starts[-1]), 
+                        self.genome_lengths[seq_name])]
             
             # omit either end according to buffer_distance
             these_suspect_regions = [(s,e) for s,e in these_suspect_regions if \
@@ -806,59 +796,78 @@ class Checker(_MetaSample):
         threshold = 0.5.
         Lowering threshold so that fewer positions must have no reads makes filter
         more greedy.
+        
+        Positions without reads are counted from prefix sums over the ratios so 
+        each window is checked in constant time.
         '''
 
+        window_size = int(round(self.mean_insert_size))
         extensions = {}
         for seq_name,suspect_regions in self.suspect_regions[filter_to_extend].items():
+            ratios = _np.asarray(self.ratios[seq_name], dtype = _np.float64)
+            # counts of ratios < 0 and <= 0 in ratios[a:b] are 
+            # prefix[b] - prefix[a] with a and b clipped as for slicing
+            no_reads = _np.concatenate(([0], _np.cumsum(ratios < 0)))
+            no_proper = _np.concatenate(([0], _np.cumsum(ratios <= 0)))
+            
+            def count(prefix, starts, ends):
+                starts = _np.minimum(starts, len(ratios))
+                ends = _np.maximum(_np.minimum(ends, len(ratios)), starts)
+                return(prefix[ends] - prefix[starts])
+            
+            def windows_with_reads(first, last):
+                # for each window start p in range(first, last): does 
+                # window p to p + window_size have too few no-read positions?
+                p = _np.arange(first, last)
+                return(p, count(no_reads, p // resolution, 
+                        (p + window_size) // resolution) < \
+                        window_size / resolution * threshold)
+            
             these_extensions = []
             for n in range(len(suspect_regions) - 1 ):
                 right_edge = suspect_regions[n][1]
                 next_left_edge = suspect_regions[n + 1][0]
-                window_size = int(round(self.mean_insert_size))
-                # extend from left to right
-                join = True
-                if right_edge < next_left_edge - window_size:
-                    for p in range(right_edge, next_left_edge - window_size):
-                        these_ratios = self.ratios[seq_name][p / resolution: (p + window_size) / resolution]
-                        if len([r for r in these_ratios if r < 0]) < window_size / resolution * threshold:
-                            join = False
-                            break
-                else:
-                    these_ratios = self.ratios[seq_name][right_edge / resolution: next_left_edge / resolution]
+                if not right_edge < next_left_edge - window_size:
                     effective_window_size = next_left_edge - right_edge
-                    if len([r for r in these_ratios if r <= 0]) > effective_window_size / resolution * threshold:
+                    if count(no_proper, right_edge // resolution, 
+                            next_left_edge // resolution) > \
+                            effective_window_size / resolution * threshold:
                         these_extensions += [[right_edge,next_left_edge]]
                     
                     continue
                 
-                if join:
+                # extend from left to right until first window with reads
+                p, with_reads = windows_with_reads(right_edge, 
+                        next_left_edge - window_size)
+                if not with_reads.any():
                     # got to next disrupted region: add joining non-aligned region
                     these_extensions += [[right_edge,next_left_edge]]
-                else:
-                    if p > right_edge:
-                        # got past at least first window: store non-aligned region
-                        extension_right_edge = p + int(round(window_size / 2.0))
-                        these_extensions += [[right_edge, extension_right_edge]]
-                        end = extension_right_edge
-                        
-                    else:
-                        end = right_edge
+                    continue
+                
+                p = int(p[_np.argmax(with_reads)])
+                if p > right_edge:
+                    # got past at least first window: store non-aligned region
+                    extension_right_edge = p + int(round(window_size / 2.0))
+                    these_extensions += [[right_edge, extension_right_edge]]
+                    end = extension_right_edge
                     
-                    # extend from right to left (if necessary)
-                    join = True
-                    for p in range(end, next_left_edge - window_size)[::-1]:  #break
-                        these_ratios = self.ratios[seq_name][p / resolution: (p + window_size) / resolution]
-                        if len([r for r in these_ratios if r < 0]) < window_size / resolution * threshold:
-                            join = False
-                            break
-                    if join:
-                        # got to back next disrupted region: add joining non-aligned region
-                        # (unlikely if join False above)
-                        these_extensions += [[end, next_left_edge]]
-                        
-                    elif p < next_left_edge - window_size - 1:
-                        # got past at least first window: store non-aligned region
-                        these_extensions += [[p + int(round(window_size / 2.0)), next_left_edge]]
+                else:
+                    end = right_edge
+                
+                # extend from right to left (if necessary) until last window 
+                # with reads
+                p, with_reads = windows_with_reads(end, 
+                        next_left_edge - window_size)
+                if not with_reads.any():
+                    # got to back next disrupted region: add joining non-aligned region
+                    # (unlikely if join False above)
+                    these_extensions += [[end, next_left_edge]]
+                    continue
+                
+                p = int(p[len(p) - 1 - _np.argmax(with_reads[::-1])])
+                if p < next_left_edge - window_size - 1:
+                    # got past at least first window: store non-aligned region
+                    these_extensions += [[p + int(round(window_size / 2.0)), next_left_edge]]
             
             extensions[seq_name] = these_extensions
 
@@ -915,7 +924,7 @@ def plotRegions(BAMs, genome,
                 console_verbosity_lvl = console_verbosity_lvl, 
                 log_folder = log_folder, inherit_from = 'self')
         
-        if not hasattr(checker, 'depths_propers'):
+        if not checker.hasCoverageDepths():
             raise Exception('Sample {} seems to be missing data for plotting: '\
                     'please check stucture first')
         else:
@@ -2630,14 +2639,12 @@ class Aligner:
     def seqalign(self, seqA, seqB, algorithm = 'needleman_wunsch', protein = 'no'):
         
         '''
-        Call seq-align as a subprocess to do a gapped pairwise optimal alignment
+        Gapped pairwise optimal alignment: Needleman-Wunsch in process without
+        penalties for end gaps (see Pairwise.align()) or Smith-Waterman by
+        calling seq-align as a subprocess
         algorithm = 'needleman_wunsch'|'smith_waterman'
         '''
 
-        # update aligner executable
-        # 'smith_waterman' or 'needleman_wunsch'
-        exe = _os.path.sep.join(self.exe_aligner.split(_os.path.sep)[:-1]+[algorithm])
-
         if protein in (True, 'yes'):
             seqA = seqA.translate()
             seqB = seqB.translate()
@@ -2647,30 +2654,11 @@ class Aligner:
         # seqA = _Seq('AMKINVFYAEEEESRCSRPFIISPSLVVGLREQRNLKLDSKKASLV')
         # seqB = _Seq('AMKIIKIKNVFYAESRCSRPFIISPSLVVGVQRREQRNLKLDSKKASLV')
         if algorithm == 'needleman_wunsch':
-            out_handle = _StringIO()
-            seqrecords = [_SeqRecord(seqA, id = 'A'), _SeqRecord(seqB, id = 'B')]
-            _SeqIO.write(seqrecords, out_handle, 'fasta')
-            cmd = [exe]
-            cmd += ['--stdin']
-            cmd += ['--freestartgap']
-            cmd += ['--freeendgap']
-            # print(' '.join(cmd))
-            proc = _subprocess.Popen(
-                cmd,
-                stdout = _subprocess.PIPE,
-                stderr = _subprocess.PIPE,
-                stdin = _subprocess.PIPE)
-            
-            result, err = proc.communicate(out_handle.getvalue())
-            try:
-                A, B = result.split('\n')[:2]
-                return(A, B)
-            except ValueError as e:
-                print(seqrecords)
-                _SeqIO.write(seqrecords, 'temp.fasta', 'fasta')
-                _sys.exit('There seems to be a problem with the seqalign output (return code {}):\n{} ({})'.format(proc.returncode,err,e))
+            return(_Pairwise.align(seqA, seqB, free_end_gaps = True))
 
         else:
+            # update aligner executable
+            exe = _os.path.sep.join(self.exe_aligner.split(_os.path.sep)[:-1]+[algorithm])
             print('WARNING: smith-waterman wrapper is unimplemented: output much more complex and is simply printed to stdout for now')
             out_handle = _StringIO()
             #seqrecords = [_SeqRecord(seqA, id = 'A'), _SeqRecord(seqB, id = 'B')]
@@ -2705,6 +2693,20 @@ class Aligner:
 
 
 
+    def seqalignPairs(self, pairs, protein = 'no', max_processes = 1, 
+            pool = None):
+        '''
+        Needleman-Wunsch alignment as seqalign() of each (seqA, seqB) in a 
+        list, shared among the processes of pool or else max_processes new 
+        processes
+
+        returns list of (alignedA, alignedB)
+        '''
+        if protein in (True, 'yes'):
+            pairs = [(seqA.translate(), seqB.translate()) for seqA,seqB in pairs]
+        return(_Pairwise.align_pairs(pairs, max_processes = max_processes, 
+                pool = pool, free_end_gaps = True))
+
     def countEndGaps(self, seq, pre = True):
         if pre:
             use = seq
@@ -2727,14 +2729,16 @@ class Aligner:
                            path_to_omit_sequences = False,
                            min_pID_aligned = 0.9,
                            single_assembly = False,
-                           force = False):
+                           force = False,
+                           max_processes = 1):
         
         '''
         Align contigs to reference chromosome regions
 
         Provided with a dict of chromosome range tuples to contig file paths, 
-        align each range to the contigs using seq-align as a subprocess to do 
-        a Needleman-Wunch gapped pairwise globl alignment.
+        align each range to the contigs by a Needleman-Wunch gapped pairwise 
+        global alignment (see Pairwise.align()). Each contig is aligned in both 
+        orientations, in parallel if max_processes > 1.
 
         path_to_omit_sequences can be a fasta file of contigs that should be ignored if
         encountered (e.g. contigs from unmapped reads to subtract from assemblies
@@ -2754,95 +2758,107 @@ class Aligner:
 
         aligned = {}
         too_small = []
-        for (s,e),contigfile in sorted(assemblies_by_region.items()):
-            if e - s < min_region_length:
-                too_small += [(contigfile,e - s)]
-            else:
-                ref_chrom_region = _Seq(self.genome.sequence[s-num_padding_positions:e+num_padding_positions].tostring())
-                ref_region_id = 'ref_{:07d}_{:07d}'.format(s-num_padding_positions,e+num_padding_positions)
-                aligned[ref_region_id] = {}
-                # get appropriate filename
-                if single_assembly:
-                    # contigfile == .../<sample>__<genome>_<start>-<end>+<padding>/contigs.fasta
-                    use_contigfile = '_'.join(contigfile.split('_')[:-1] + ['multi_region']) + _os.path.sep + 'contigs.fasta'
-                    # use_contigfile == .../<sample>__<genome>_multi_region/contigs.fasta
+        # both orientations of each contig are aligned at once in processes 
+        # started once for all contigs
+        pool = None
+        if max_processes > 1:
+            pool = _multiprocessing.Pool(2)
+        try:
+            for (s,e),contigfile in sorted(assemblies_by_region.items()):
+                if e - s < min_region_length:
+                    too_small += [(contigfile,e - s)]
                 else:
-                    use_contigfile = contigfile
+                    ref_chrom_region = _Seq(self.genome.sequence[s-num_padding_positions:e+num_padding_positions].tostring())
+                    ref_region_id = 'ref_{:07d}_{:07d}'.format(s-num_padding_positions,e+num_padding_positions)
+                    aligned[ref_region_id] = {}
+                    # get appropriate filename
+                    if single_assembly:
+                        # contigfile == .../<sample>__<genome>_<start>-<end>+<padding>/contigs.fasta
+                        use_contigfile = '_'.join(contigfile.split('_')[:-1] + ['multi_region']) + _os.path.sep + 'contigs.fasta'
+                        # use_contigfile == .../<sample>__<genome>_multi_region/contigs.fasta
+                    else:
+                        use_contigfile = contigfile
                 
-                # check if already did alignment
-                pattern = _os.path.sep.join(use_contigfile.split(_os.path.sep)[:-1]) + '_{}_vs_contig*.fna'.format(ref_region_id)
-                previous_alignments = _glob(pattern)
-                if len(previous_alignments) > 0 and not force:
-                    print('Found previous alignments for region {}:\n{}'.format(ref_region_id,'\n'.join(previous_alignments)))
-                    print('Use --force/-F to realign and overwrite')
-                    for aln in previous_alignments:
-                        print('contig'+aln[:-4].split('contig')[-1])
-                        aligned[ref_region_id]['contig'+aln[:-4].split('contig')[-1]] = tuple([a.seq for a in _SeqIO.parse(aln, 'fasta')])
-                else:
-                    try:
-                        num_contigs = 0
-                        for n,rec in enumerate(_SeqIO.parse(use_contigfile,'fasta')):
-                            num_contigs += 1
-                    except IOError:
-                        print('WARNING: cannot access {}'.format(use_contigfile))
-                        print('This assembly may have failed . . .')
-                        continue
+                    # check if already did alignment
+                    pattern = _os.path.sep.join(use_contigfile.split(_os.path.sep)[:-1]) + '_{}_vs_contig*.fna'.format(ref_region_id)
+                    previous_alignments = _glob(pattern)
+                    if len(previous_alignments) > 0 and not force:
+                        print('Found previous alignments for region {}:\n{}'.format(ref_region_id,'\n'.join(previous_alignments)))
+                        print('Use --force/-F to realign and overwrite')
+                        for aln in previous_alignments:
+                            print('contig'+aln[:-4].split('contig')[-1])
+                            aligned[ref_region_id]['contig'+aln[:-4].split('contig')[-1]] = tuple([a.seq for a in _SeqIO.parse(aln, 'fasta')])
+                    else:
+                        try:
+                            num_contigs = 0
+                            for n,rec in enumerate(_SeqIO.parse(use_contigfile,'fasta')):
+                                num_contigs += 1
+                        except IOError:
+                            print('WARNING: cannot access {}'.format(use_contigfile))
+                            print('This assembly may have failed . . .')
+                            continue
                     
-                    print('Found {} contigs in {} for analysis.'.format(num_contigs, use_contigfile))
-                    for n,rec in enumerate(_SeqIO.parse(use_contigfile,'fasta')):
-                        if str(rec.seq) not in unmapped_read_contigs:
-                            print('Aligning novel contig: {} to chromosome region {}-{} bp'.format(rec.id, s, e))
-                            use_seq = rec
-                            #ref_alnd,contig_alnd = self.seqalign(ref_chrom_region, rec.seq, 'smith_waterman')
-                            ref_alnd,contig_alnd = self.seqalign(ref_chrom_region, rec.seq, 'needleman_wunsch')
-                            #print(ref_alnd,contig_alnd)
-                            pIDs = dict(self.get_percent_ID(ref_alnd, contig_alnd, window = pID_window, step = pID_step))
-                            #ref_alnd_rc,contig_alnd_rc = self.seqalign(ref_chrom_region, rec.seq.reverse_complement(), 'smith_waterman')
-                            ref_alnd_rc,contig_alnd_rc = self.seqalign(ref_chrom_region, rec.seq.reverse_complement(), 'needleman_wunsch')
-                            #print(ref_alnd,contig_alnd)
-                            pIDs_rc = dict(self.get_percent_ID(ref_alnd_rc, contig_alnd_rc, window = pID_window, step = pID_step))
-                            retained = False
-                            if sum(pIDs.values()) > sum(pIDs_rc.values()):
-                                if max(pIDs.values()) >= min_pID_aligned:
-                                    # only print if contains a pID_window bp window with > 90% identity
-                                    fout = _os.path.sep.join(use_contigfile.split(_os.path.sep)[:-1]) + '_{}_vs_contig{:02d}.fna'.format(ref_region_id,n+1)
-                                    seqs = []
-                                    seqs += [_SeqRecord(seq = _Seq(ref_alnd), 
-                                                        id = ref_region_id)]
-                                    seqs += [_SeqRecord(seq = _Seq(contig_alnd), 
-                                                        id = rec.id)]
-                                    _SeqIO.write(seqs, fout, 'fasta')
-                                    print('Writing: {}'.format(fout))
-                                    retained = True
-                                    aligned[ref_region_id]['contig{:02d}'.format(n+1)] = (ref_alnd, contig_alnd)
-                            else:
-                                try:
-                                    if max(pIDs_rc.values()) >= min_pID_aligned:
+                        print('Found {} contigs in {} for analysis.'.format(num_contigs, use_contigfile))
+                        for n,rec in enumerate(_SeqIO.parse(use_contigfile,'fasta')):
+                            if str(rec.seq) not in unmapped_read_contigs:
+                                print('Aligning novel contig: {} to chromosome region {}-{} bp'.format(rec.id, s, e))
+                                use_seq = rec
+                                #ref_alnd,contig_alnd = self.seqalign(ref_chrom_region, rec.seq, 'smith_waterman')
+                                # both orientations of contig in one batch
+                                (ref_alnd,contig_alnd),(ref_alnd_rc,contig_alnd_rc) = \
+                                        self.seqalignPairs([(ref_chrom_region, rec.seq),
+                                        (ref_chrom_region, rec.seq.reverse_complement())],
+                                        pool = pool)
+                                #print(ref_alnd,contig_alnd)
+                                pIDs = dict(self.get_percent_ID(ref_alnd, contig_alnd, window = pID_window, step = pID_step))
+                                #print(ref_alnd,contig_alnd)
+                                pIDs_rc = dict(self.get_percent_ID(ref_alnd_rc, contig_alnd_rc, window = pID_window, step = pID_step))
+                                retained = False
+                                if sum(pIDs.values()) > sum(pIDs_rc.values()):
+                                    if max(pIDs.values()) >= min_pID_aligned:
                                         # only print if contains a pID_window bp window with > 90% identity
-                                        fout = _os.path.sep.join(
-                                                use_contigfile.split(_os.path.sep)[:-1]) + \
-                                                '_{}_vs_contig{:02d}_rc.fna'.format(ref_region_id,n+1)
+                                        fout = _os.path.sep.join(use_contigfile.split(_os.path.sep)[:-1]) + '_{}_vs_contig{:02d}.fna'.format(ref_region_id,n+1)
                                         seqs = []
-                                        seqs += [_SeqRecord(seq = _Seq(ref_alnd_rc), 
+                                        seqs += [_SeqRecord(seq = _Seq(ref_alnd), 
                                                             id = ref_region_id)]
-                                        seqs += [_SeqRecord(seq = _Seq(contig_alnd_rc), 
+                                        seqs += [_SeqRecord(seq = _Seq(contig_alnd), 
                                                             id = rec.id)]
                                         _SeqIO.write(seqs, fout, 'fasta')
                                         print('Writing: {}'.format(fout))
                                         retained = True
-                                        # only thr contig is reverse complemented here
-                                        aligned[ref_region_id]['contig{:02d}_rc'.format(n+1)] = (ref_alnd_rc, contig_alnd_rc)
-                                except ValueError:
-                                    # no regions found
-                                    pass
-                            if not retained:
-                                print('No alignment with a percent identity >= {:.0%} over a window of {} bp'.format(min_pID_aligned, pID_window))
-                        else:
-                            print('Omitting contig from unmapped/poorly mapped reads: {}'.format(rec.id))
-            
-                print(ref_region_id,len(aligned[ref_region_id]))
-                if len(aligned[ref_region_id]) == 0:
-                    del aligned[ref_region_id] 
+                                        aligned[ref_region_id]['contig{:02d}'.format(n+1)] = (ref_alnd, contig_alnd)
+                                else:
+                                    try:
+                                        if max(pIDs_rc.values()) >= min_pID_aligned:
+                                            # only print if contains a pID_window bp window with > 90% identity
+                                            fout = _os.path.sep.join(
+                                                    use_contigfile.split(_os.path.sep)[:-1]) + \
+                                                    '_{}_vs_contig{:02d}_rc.fna'.format(ref_region_id,n+1)
+                                            seqs = []
+                                            seqs += [_SeqRecord(seq = _Seq(ref_alnd_rc), 
+                                                                id = ref_region_id)]
+                                            seqs += [_SeqRecord(seq = _Seq(contig_alnd_rc), 
+                                                                id = rec.id)]
+                                            _SeqIO.write(seqs, fout, 'fasta')
+                                            print('Writing: {}'.format(fout))
+                                            retained = True
+                                            # only thr contig is reverse complemented here
+                                            aligned[ref_region_id]['contig{:02d}_rc'.format(n+1)] = (ref_alnd_rc, contig_alnd_rc)
+                                    except ValueError:
+                                        # no regions found
+                                        pass
+                                if not retained:
+                                    print('No alignment with a percent identity >= {:.0%} over a window of {} bp'.format(min_pID_aligned, pID_window))
+                            else:
+                                print('Omitting contig from unmapped/poorly mapped reads: {}'.format(rec.id))
+            
+                    print(ref_region_id,len(aligned[ref_region_id]))
+                    if len(aligned[ref_region_id]) == 0:
+                        del aligned[ref_region_id] 
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
         # retain info useful for summarising
         self.aligned = aligned
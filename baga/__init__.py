@@ -31,6 +31,14 @@ from hashlib import md5 as _md5
 from array import array as _array
 import logging as _logging
 import textwrap as _textwrap
+import struct as _struct
+import mmap as _mmap
+import zlib as _zlib
+import threading as _threading
+try:
+    from collections.abc import Mapping as _Mapping
+except ImportError:
+    from collections import Mapping as _Mapping
 
 PY3 = _sys.version_info > (3,)
 
@@ -46,6 +54,7 @@ else:
     from cStringIO import StringIO as _StringIO
     import cPickle as _pickle
 
+from baga.Sequence import GenomeSequence as _GenomeSequence
 
 
 ## define formatters and filters etc for logging
@@ -245,29 +254,21 @@ def bagaload(file_name):
         return _pickle.load(_gzip.open('%s.baga' % file_name,'rb'))
 
 
-def load(file_name):
+def _loadTar(file_name):
     '''
-    load metadata from previous baga objects into dict
+    load metadata from previous baga objects saved as a tar.gz into dict
     
     Will reconstruct dicts of arrays if each array was saved as:
         '__<dictname>__<key_as_arrayname>'
     Data type is inferred from start of dictname:
-        'sequence*' for unicode
+        'sequence*' for Sequence.GenomeSequence
         'ratio*' for float
         all others for integer
     '''
     def loadArray(member_name,contents):
         if 'sequence' in member_name:
-            # it's a string
-            if PY3:
-                array_data = _array('b', contents.getvalue())
-                # saved as bytes for space saving
-                # converted to unicode for test convenience
-                # but 'u' is deprecated since 3.3 . . .
-                # https://docs.python.org/3/library/array.html
-                array_data = _array('u', array_data.tobytes().decode('utf-8'))
-            else:
-                array_data = _array('c', contents.getvalue())
+            # it's a string saved as bytes
+            array_data = _GenomeSequence(contents.getvalue())
         elif 'ratio' in member_name:
             # it's a float
             array_data = _array('f', contents.getvalue())
@@ -315,10 +316,7 @@ def load(file_name):
                         ### how did this work for integers? Didn't! <== is this adequately checked?
                         ### would be better to have direct tests of json or pickle . . .
                         array_data = loadArray(member.name, contents)
-                        if PY3:
-                            contents = _array('u', contents.getvalue())
-                        else:
-                            contents = _array('c', contents.getvalue())
+                        contents = _GenomeSequence(contents.getvalue())
                 meta_data[member.name] = contents
         # add dicts of arrays to the rest of meta_data
         for member_name,d in arraydicts.items():
@@ -347,52 +345,307 @@ def load(file_name):
 
 
 
+class BagaFile(object):
+    '''
+    Read access to a baga file as written by writeBaga()
+    
+    The file starts with an eight byte magic string and two little-endian 
+    unsigned ints: the container version and the length of an uncompressed 
+    JSON index. Data blocks follow the index, each starting at a multiple of 
+    eight bytes from the start of the file at an offset (from the end of the 
+    padded index) and size given in the index for each attribute:
+    
+        {"kind": "json" or "pickle", "offset": ..., "size": ...}
+            attribute serialised and zlib compressed on its own
+        {"kind": "array", "typecode": ..., "offset": ..., "size": ...}
+            raw bytes of an array.array (or utf-8 text for "u" or "c" arrays,
+            read as Sequence.GenomeSequence)
+        {"kind": "sequence", "offset": ..., "size": ...}
+            ASCII bytes of a Sequence.GenomeSequence
+        {"kind": "arrays", "arrays": {<key>: <array or sequence entry>, ...}}
+            a dict of arrays or sequences
+    
+    The file is memory-mapped so reading one attribute only touches the 
+    pages it occupies.
+    '''
+    magic = b'BAGACONT'
+    version = 1
+    
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._file = open(file_name, 'rb')
+        magic = self._file.read(len(self.magic))
+        if magic != self.magic:
+            self._file.close()
+            raise ValueError('Not a baga container file: {}'.format(file_name))
+        
+        version, index_length = _struct.unpack('<II', self._file.read(8))
+        if version > self.version:
+            self._file.close()
+            raise ValueError('{} is baga container version {} but only up to '\
+                    'version {} is supported: is baga up to date?'.format(
+                    file_name, version, self.version))
+        
+        self.index = _json.loads(self._file.read(index_length).decode('utf-8'))
+        header_length = len(self.magic) + 8 + index_length
+        self._data_start = header_length + (-header_length % 8)
+        if _os.path.getsize(file_name) > self._data_start:
+            self._map = _mmap.mmap(self._file.fileno(), 0, 
+                    access = _mmap.ACCESS_READ)
+        else:
+            self._map = b''
+    
+    def __enter__(self):
+        return(self)
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def close(self):
+        try:
+            self._map.close()
+        except (AttributeError, BufferError):
+            # nothing mapped or views still in use: closed when released
+            pass
+        self._file.close()
+    
+    def __contains__(self, name):
+        return(name in self.index['attributes'])
+    
+    def keys(self):
+        return(list(self.index['attributes']))
+    
+    def _bytes(self, entry):
+        start = self._data_start + entry['offset']
+        return(self._map[start : start + entry['size']])
+    
+    def _array(self, entry):
+        data = self._bytes(entry)
+        if entry['kind'] == 'sequence' or entry['typecode'] in ('u', 'c'):
+            # stored as text: 1 byte per character
+            return(_GenomeSequence(data))
+        
+        array_data = _array(str(entry['typecode']))
+        if PY3:
+            array_data.frombytes(data)
+        else:
+            array_data.fromstring(data)
+        if self.index['byteorder'] != _sys.byteorder:
+            array_data.byteswap()
+        return(array_data)
+    
+    def view(self, name, key = None):
+        '''
+        Zero-copy memoryview of a numerical array (or of one in a dict of 
+        arrays by key), valid while this file is open. Python 3 only.
+        '''
+        entry = self.index['attributes'][name]
+        if key is not None:
+            entry = entry['arrays'][key]
+        start = self._data_start + entry['offset']
+        return(memoryview(self._map)[start : start + entry['size']].cast(
+                str(entry['typecode'])))
+    
+    def get(self, name):
+        '''Load one attribute'''
+        entry = self.index['attributes'][name]
+        if entry['kind'] in ('array', 'sequence'):
+            return(self._array(entry))
+        elif entry['kind'] == 'arrays':
+            return(dict([(key, self._array(array_entry)) for key,array_entry in \
+                    entry['arrays'].items()]))
+        contents = _zlib.decompress(self._bytes(entry))
+        if entry['kind'] == 'json':
+            return(_json.loads(contents.decode('utf-8')))
+        else:
+            return(_pickle.loads(contents))
+    
+    def load(self, names = None):
+        '''Load all attributes or those named into a dict'''
+        if names is None:
+            names = self.keys()
+        return(dict([(name, self.get(name)) for name in names]))
+
+
+def writeBaga(metadata, file_name, exclude = [], serialiser = 'json', 
+        logger = None):
+    '''
+    Save a dict of metadata, usually from a baga object, to a baga file
+    
+    array.array and Sequence.GenomeSequence objects and dicts of them are 
+    stored as raw, aligned blocks (arrays with their typecodes), everything else is serialised as JSON (or pickle if 
+    specified) and compressed one attribute at a time: see BagaFile. The file 
+    is written next to file_name and renamed over it when complete.
+    
+    returns list of omitted attribute names: those excluded or not 
+    serialisable e.g., functions
+    '''
+    if serialiser == 'json':
+        def serialise(att):
+            return(_json.dumps(att).encode('utf-8'))
+    elif serialiser == 'pickle':
+        def serialise(att):
+            return(_pickle.dumps(att, protocol = 2))
+    else:
+        raise NotImplementedError('Serialiser "{}" not implemented, choose '\
+                '"json" or "pickle"'.format(serialiser))
+    
+    def log(message):
+        if logger:
+            logger.debug(message)
+    
+    blocks = []
+    def add_block(data, entry):
+        entry['offset'] = sum([len(b) for b in blocks])
+        entry['size'] = len(data)
+        blocks.append(data + b'\0' * (-len(data) % 8))
+        return(entry)
+    
+    def add_array(array_data):
+        if isinstance(array_data, _GenomeSequence):
+            return(add_block(array_data.tobytes(), {'kind': 'sequence'}))
+        if array_data.typecode in ('u', 'c'):
+            if PY3:
+                data = array_data.tounicode().encode('utf-8')
+            else:
+                data = array_data.tostring()
+        elif PY3:
+            data = array_data.tobytes()
+        else:
+            data = array_data.tostring()
+        return(add_block(data, {'kind': 'array', 
+                'typecode': array_data.typecode}))
+    
+    attributes = {}
+    omissions = []
+    for att_name, att in metadata.items():
+        if att_name in exclude:
+            omissions += [att_name]
+            log('Excluding from {}: "{}" ({})'.format(file_name, att_name, 
+                    type(att)))
+            continue
+        if isinstance(att, (_array, _GenomeSequence)):
+            attributes[att_name] = add_array(att)
+            log('Stored in {}: "{}" (array)'.format(file_name, att_name))
+        elif isinstance(att, dict) and len(att) and \
+                all([isinstance(v, (_array, _GenomeSequence)) for v in \
+                att.values()]):
+            arrays = {}
+            for array_name,array_data in att.items():
+                arrays[array_name] = add_array(array_data)
+            attributes[att_name] = {'kind': 'arrays', 'arrays': arrays}
+            log('Stored in {}: "{}" ({} arrays in dict)'.format(file_name, 
+                    att_name, len(arrays)))
+        else:
+            # try saving everything else here by jsoning or pickling
+            try:
+                data = _zlib.compress(serialise(att), 6)
+            except (TypeError, _pickle.PicklingError, AttributeError):
+                # could be warning but expect functions to fail here
+                log('Not {}-able: "{}", {}'.format(serialiser, att_name, 
+                        type(att)))
+                omissions += [att_name]
+                continue
+            attributes[att_name] = add_block(data, {'kind': serialiser})
+            log('Stored in {}: "{}", {}'.format(file_name, att_name, type(att)))
+    
+    index = _json.dumps({'byteorder': _sys.byteorder, 
+            'attributes': attributes}).encode('utf-8')
+    header_length = len(BagaFile.magic) + 8 + len(index)
+    tmp_file_name = '{}.{}.tmp'.format(file_name, _os.getpid())
+    with open(tmp_file_name, 'wb') as fout:
+        fout.write(BagaFile.magic)
+        fout.write(_struct.pack('<II', BagaFile.version, len(index)))
+        fout.write(index)
+        fout.write(b'\0' * (-header_length % 8))
+        for block in blocks:
+            fout.write(block)
+    
+    _os.rename(tmp_file_name, file_name)
+    return(omissions)
+
+
+def load(file_name):
+    '''
+    load metadata from previous baga objects into dict
+    
+    Reads baga files written by writeBaga() or the earlier tar.gz based 
+    format: see convertBaga() to update those.
+    '''
+    with open(file_name, 'rb') as fin:
+        magic = fin.read(len(BagaFile.magic))
+    if magic[:2] == b'\x1f\x8b':
+        return(_loadTar(file_name))
+    with BagaFile(file_name) as baga_file:
+        return(baga_file.load())
+
+
+class LazyMetadata(_Mapping):
+    '''
+    Metadata from a baga file with each attribute loaded on first access
+    
+    Files in the earlier tar.gz based format can only be loaded whole so 
+    are loaded on instantiation. Names in omit are left out of iteration but 
+    can still be looked up by key e.g., to check sample_name.
+    '''
+    def __init__(self, file_name, omit = ()):
+        self.file_name = file_name
+        self._loaded = {}
+        self._baga_file = None
+        with open(file_name, 'rb') as fin:
+            magic = fin.read(len(BagaFile.magic))
+        if magic[:2] == b'\x1f\x8b':
+            self._loaded = _loadTar(file_name)
+            names = list(self._loaded)
+        else:
+            self._baga_file = BagaFile(file_name)
+            names = self._baga_file.keys()
+        self._all_names = set(names)
+        self._names = [name for name in names if name not in omit]
+    
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            if name not in self._all_names:
+                raise KeyError(name)
+            self._loaded[name] = self._baga_file.get(name)
+            if all([n in self._loaded for n in self._all_names]):
+                # nothing left to load
+                self._baga_file.close()
+        return(self._loaded[name])
+    
+    def __contains__(self, name):
+        return(name in self._names)
+    
+    def __iter__(self):
+        return(iter(self._names))
+    
+    def __len__(self):
+        return(len(self._names))
+    
+    def isLoaded(self, name):
+        return(name in self._loaded)
+
+
+def convertBaga(file_name, out_file_name = None):
+    '''
+    Convert a baga file in the earlier tar.gz based format to the current 
+    format, replacing it unless out_file_name is provided. Non-array 
+    attributes are pickled because the earlier format mixed JSON and pickle.
+    
+    returns list of omitted attribute names
+    '''
+    if out_file_name is None:
+        out_file_name = file_name
+    return(writeBaga(_loadTar(file_name), out_file_name, 
+            serialiser = 'pickle'))
+
+
 def save(metadata, file_name):
     '''save metadata dict from previous baga object into an baga file'''
-    omissions = []
-    with _tarfile.open(file_name, "w:gz") as tar:
-        for att_name, att in metadata.items():
-            if isinstance(att, _array):
-                if PY3:
-                    ioob = _BytesIO(att.tostring())
-                else:
-                    ioob = _StringIO(att.tostring())
-                ioob.seek(0, _os.SEEK_END)
-                length = ioob.tell()
-                ioob.seek(0)
-                thisone = _tarfile.TarInfo(name = att_name)
-                thisone.size = length
-                tar.addfile(tarinfo = thisone, fileobj = ioob)
-                #log.debug
-                print('Stored in {}: "{}" (array)'.format(file_name, 
-                        att_name))
-            else:
-                # try saving everything else here by jsoning
-                try:
-                    #log.debug
-                    print('Attempting store in {}: "{}", {}'.format(file_name, 
-                            att_name, type(att)))
-                    if PY3:
-                        ioob = _BytesIO()
-                    else:
-                        ioob = _StringIO()
-                    att_json = _json.dumps(att)
-                    ioob.write(att_json.encode('utf-8'))
-                    ioob.seek(0, _os.SEEK_END)
-                    length = ioob.tell()
-                    ioob.seek(0)
-                    thisone = _tarfile.TarInfo(name = att_name)
-                    thisone.size = length
-                    tar.addfile(tarinfo = thisone, fileobj = ioob)
-                    #log.debug
-                    print('Stored in {}: "{}", {}'.format(file_name, 
-                            att_name, att))
-                except TypeError:
-                    #log.debug
-                    print('Not JSONable: "{}", {}'.format(att_name, type(att)))
-                    # ignore non-jsonable things like functions
-                    # include unicodes, strings, lists etc etc
-                    omissions += [att_name]
+    omissions = writeBaga(metadata, file_name)
+    for att_name in omissions:
+        #log.debug
+        print('Not JSONable: "{}", {}'.format(att_name, type(metadata[att_name])))
     return(omissions)
 
 
@@ -480,6 +733,151 @@ def decide_max_processes(max_cpus):
     
     return( max_processes )
 
+class ExternalProgramError(RuntimeError):
+    '''
+    Raised when jobs run by a JobScheduler fail after all retries.
+    '''
+
+
+class JobScheduler(object):
+    '''
+    Run external programs concurrently within limits on CPUs and memory
+    
+    Each job reserves a number of CPUs and an amount of memory, e.g., the 
+    -Xmx of a Java program, and is started as soon as enough of both are 
+    free so many samples can share a node without over-subscribing it. Jobs 
+    are waited on individually (not with os.wait()), non-zero return codes or 
+    missing expected output files count as failures and failed jobs are 
+    retried.
+    
+    If a MetaSample is provided, jobs are run with its launch_external() 
+    method so each job gets its own log file in the sample's log folder. 
+    Otherwise STDOUT is written to stdout_filename, if provided.
+    '''
+    def __init__(self, max_cpus = -1, max_mem_gigs = None, sample = None, 
+            log_folder = None, retries = 0):
+        '''
+        max_cpus as for decide_max_processes(), max_mem_gigs defaults to that 
+        available according to get_available_memory() if known.
+        '''
+        self.max_processes = decide_max_processes(max_cpus)
+        if max_mem_gigs is None:
+            max_mem_gigs = get_available_memory()
+        self.max_mem_gigs = max_mem_gigs
+        self.sample = sample
+        if sample is not None and log_folder is None:
+            log_folder = getattr(sample, 'log_folder', 
+                    _os.path.sep.join([sample.analysis_path, 'logs']))
+        self.log_folder = log_folder
+        self.retries = retries
+        self.jobs = []
+        self.done = []
+    
+    def add(self, cmd, name, cpus = 1, mem_gigs = 0, outputs = [], 
+            stdout_filename = False, shell = False):
+        '''
+        Queue a command (list, or string if shell is True). name should be 
+        unique among jobs and is used for the log file name.
+        '''
+        self.jobs += [{'cmd': cmd, 
+                       'name': name, 
+                       # a job bigger than the limits runs alone
+                       'cpus': min(cpus, self.max_processes), 
+                       'mem_gigs': min(mem_gigs, self.max_mem_gigs or mem_gigs), 
+                       'outputs': outputs, 
+                       'stdout_filename': stdout_filename, 
+                       'shell': shell}]
+    
+    def _launch(self, job):
+        if self.sample is not None:
+            return(self.sample.launch_external(job['cmd'], job['name'], 
+                    self.log_folder, main_logger = self.sample.logger, 
+                    stdout_filename = job['stdout_filename'], 
+                    shell = job['shell']))
+        
+        if job['shell']:
+            print('Called: {}'.format(job['cmd']))
+        else:
+            print('Called: "{}"'.format(' '.join(map(str, job['cmd']))))
+        if job['stdout_filename']:
+            with open(job['stdout_filename'], 'wb') as for_stdout:
+                return(_subprocess.call(job['cmd'], stdout = for_stdout, 
+                        shell = job['shell']))
+        else:
+            return(_subprocess.call(job['cmd'], shell = job['shell']))
+    
+    def _run_job(self, job):
+        job['started'] = _time.time()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                print('Retrying {} ({} of {})'.format(job['name'], attempt, 
+                        self.retries))
+            try:
+                job['return_code'] = self._launch(job)
+            except Exception as e:
+                # e.g., OSError if executable missing: re-raised by run()
+                job['exception'] = e
+                return
+            missing = [o for o in job['outputs'] if not _os.path.exists(o)]
+            if job['return_code'] == 0 and not missing:
+                job['failed'] = False
+                job['finished'] = _time.time()
+                return
+            print('{} failed: return code {}{}'.format(job['name'], 
+                    job['return_code'], ', missing: ' + ', '.join(missing) if \
+                    missing else ''))
+        job['failed'] = True
+        job['finished'] = _time.time()
+    
+    def run(self):
+        '''
+        Run all queued jobs
+        
+        Jobs that were run, with 'started' and 'finished' times and 
+        'return_code' added, are then in the done attribute.
+        
+        returns list of names of jobs that failed after all retries
+        '''
+        condition = _threading.Condition()
+        free = {'cpus': self.max_processes, 'mem_gigs': self.max_mem_gigs}
+        pending = list(self.jobs)
+        running = []
+        
+        def worker(job):
+            try:
+                self._run_job(job)
+            finally:
+                with condition:
+                    free['cpus'] += job['cpus']
+                    if free['mem_gigs'] is not None:
+                        free['mem_gigs'] += job['mem_gigs']
+                    running.remove(job)
+                    condition.notify()
+        
+        with condition:
+            while pending or running:
+                # start all jobs that fit, in order queued
+                for job in list(pending):
+                    if job['cpus'] <= free['cpus'] and (free['mem_gigs'] is \
+                            None or job['mem_gigs'] <= free['mem_gigs']):
+                        free['cpus'] -= job['cpus']
+                        if free['mem_gigs'] is not None:
+                            free['mem_gigs'] -= job['mem_gigs']
+                        pending.remove(job)
+                        running.append(job)
+                        thread = _threading.Thread(target = worker, args = (job,))
+                        thread.daemon = True
+                        thread.start()
+                if pending or running:
+                    condition.wait()
+        
+        self.jobs, self.done = [], self.jobs
+        for job in self.done:
+            if 'exception' in job:
+                raise job['exception']
+        return([job['name'] for job in self.done if job['failed']])
+
+
 def report_time(start_time, this_item_index, total_items):
     '''
     print time elapsed to nearest minute or second
@@ -652,6 +1050,7 @@ class MetaSample(Base):
                         skip_analysis_path = False,
                         inherit_from = False,
                         omit_from_inheritance = [],
+                        pin_attributes = [],
                         *args, **kwargs):
         '''
         Providing only sample name will instantiate a new object.
@@ -667,6 +1066,11 @@ class MetaSample(Base):
         
         skip_analysis_path is for subclasses that don't need an analysis path 
         created e.g. CollectData.Taxonomy
+        
+        Inherited or restored metadata is loaded from the .baga file when first 
+        used so large arrays, e.g., genome sequences or read depths, are not 
+        read by steps that only need names and paths. Attributes named in 
+        pin_attributes are loaded immediately instead.
         '''
         super(MetaSample, self).__init__(*args, **kwargs)
         # log what happens during .__init__()
@@ -704,25 +1108,31 @@ class MetaSample(Base):
             file_name = '{}.{}-{}.baga'.format(module_name, type(self).__name__, self.sample_name)
             path = _os.path.sep.join([analysis_path, file_name])
             logger.debug('__init__() loading from: {}'.format(path))
-            metadata = load(path)
-            for name,content in metadata.items():
+            metadata = LazyMetadata(path, omit = ('externals_for_logging', 
+                    'log_for'))
+            # confirm loaded file is for same sample as currently analysed
+            if metadata.get('sample_name', self.sample_name) != self.sample_name:
+                raise RuntimeError("mismatch between requested sample "\
+                        "name ({}) and '{}' in local saved object: {}. "\
+                        "Delete or rename it to continue".format(
+                        self.sample_name, metadata['sample_name'], path))
+            # externals_for_logging and log_for not restored: set up below
+            # do restore: log_folder
+            lazy_attributes = {}
+            for name in metadata:
                 if name == 'sample_name':
-                    # confirm loaded file is for same sample as currently analysed
-                    if content != self.sample_name:
-                        raise RuntimeError("mismatch between requested sample "\
-                                "name ({}) and '{}' in local saved object: {}. "\
-                                "Delete or rename it to continue".format(
-                                self.sample_name, content, path))
-                    else:
-                        continue
-                if name in ('externals_for_logging','log_for'):
-                    # do not restore: set up below
-                    # do restore: log_folder
                     continue
-                # set as attributes
-                setattr(self, name, content)
-                logger.debug('__init__() loaded: {} ({})'.format(name, 
-                        type(content)))
+                if name in pin_attributes:
+                    # set as attributes
+                    setattr(self, name, metadata[name])
+                    logger.debug('__init__() loaded: {} ({})'.format(name, 
+                            type(metadata[name])))
+                else:
+                    # set as attributes on first access: see __getattr__()
+                    lazy_attributes[name] = metadata
+                    logger.debug('__init__() will load when used: {}'.format(
+                            name))
+            self._lazy_attributes = lazy_attributes
         elif isinstance(inherit_from, list):
             i = {}
             for Module_Datatype,Class_SubtaskTool in inherit_from:
@@ -734,32 +1144,31 @@ class MetaSample(Base):
                         Class_SubtaskTool, self.sample_name)
                 logger.debug('__init__() inheriting from: {}'.format(file_name))
                 try:
-                    metadata = load(file_name)
+                    # don't inherit module specific operational stuff
+                    # and the previous inheritance i.e., 'i'
+                    # (could change this later?)
+                    metadata = LazyMetadata(file_name, 
+                            omit = inheritance_filter | set(['sample_name']))
                 except FileNotFoundError as e:
                     raise InheritanceFileNotFoundError(e)
                 if len(metadata):
+                    if metadata.get('sample_name', self.sample_name) != \
+                            self.sample_name:
+                        raise RuntimeError("mismatch between requested "\
+                                "sample name ({}) and '{}' in local "\
+                                "saved object: {}. Delete or rename it "\
+                                "to continue".format(self.sample_name, 
+                                metadata['sample_name'], file_name))
                     if Module_Datatype not in i:
                         i[Module_Datatype] = {}
-                    i[Module_Datatype][Class_SubtaskTool] = {}
                     # how to log this from a specific module if defined in superclass?
                     # print('Inheriting from: {}'.format(file_name))
-                    # store inheritance in dictionaries
-                    for name,content in metadata.items():
-                        if name == 'sample_name':
-                            if content != self.sample_name:
-                                raise RuntimeError("mismatch between requested "\
-                                        "sample name ({}) and '{}' in local "\
-                                        "saved object: {}. Delete or rename it "\
-                                        "to continue".format(self.sample_name, 
-                                        content, file_name))
-                            else:
-                                continue
-                        if name in inheritance_filter:
-                            # don't inherit module specific operational stuff
-                            # and the previous inheritance i.e., 'i'
-                            # (could change this later?)
-                            continue
-                        i[Module_Datatype][Class_SubtaskTool][name] = content
+                    # store inheritance in dictionaries: each loaded when 
+                    # first used unless pinned
+                    i[Module_Datatype][Class_SubtaskTool] = metadata
+                    for name in metadata:
+                        if name in pin_attributes:
+                            metadata[name]
                         logger.debug('__init__() inherited: {}'.format(name))
             self.i = i
             
@@ -847,100 +1256,38 @@ class MetaSample(Base):
         # by baga metadata inheritance in MetaSample's __init__() method.
         # '''
 
+    def __getattr__(self, name):
+        '''load inherited attributes when first used: see __init__()'''
+        lazy_attributes = self.__dict__.get('_lazy_attributes', {})
+        if name not in lazy_attributes:
+            raise AttributeError("'{}' object has no attribute '{}'".format(
+                    type(self).__name__, name))
+        content = lazy_attributes.pop(name)[name]
+        setattr(self, name, content)
+        self.logger.debug('loaded: {} ({})'.format(name, type(content)))
+        return(content)
+
     def saveLocal(self, exclude = [], serialiser = 'json'):
         '''
         Save an baga object to a file
         
         Objects usually contain sample metadata information. The data is 
-        saved as a compressed archive with attributes as JSON (or pickle if 
-        specified in arguments) or raw Python array.array objects as bytes or 
-        strings. Dictionaries of arrays are deconstructed and saved as 
-        array.array bytes and can be reconstrcuted by baga metadata 
-        inheritance in MetaSample's __init__() method.
+        saved with attributes as JSON (or pickle if specified in arguments) 
+        and raw Python array.array objects as typed blocks that are read back 
+        by baga metadata inheritance in MetaSample's __init__() method: see 
+        writeBaga().
         '''
-        if serialiser == 'json':
-            import json as _serialiser
-        elif serialiser == 'pickle':
-            import sys
-            if sys.version_info.major == 3:
-                import pickle as _serialiser
-            else:
-                import cPickle as _serialiser
-        else:
-            raise NotImplementedError('Serialiser "{}" not implemented, choose '\
-                    '"json" or "pickle"')
-        def saveArray(array_data, member_name, tar):
-            if array_data.typecode == 'u':
-                # 1 byte per character instead of 2 (4?)
-                # 'u' Deprecated since version 3.3, will be removed in version 4.0
-                # https://docs.python.org/3/library/array.html
-                # so how to conveniently and efficiently put a string into an array?
-                # implement own fetch methods for extracting region or writing to text file?
-                # better way of doing this?
-                array_data = _array('b', bytes(''.join(array_data.tolist()), encoding = 'utf-8'))
-                #array_data = _array('b', array_data.encode('utf-8'))
-            if PY3:
-                ioob = _BytesIO(array_data.tobytes())
-            else:
-                ioob = _StringIO(array_data.tostring())
-            ioob.seek(0, _os.SEEK_END)
-            length = ioob.tell()
-            ioob.seek(0)
-            thisone = _tarfile.TarInfo(name = member_name)
-            thisone.size = length
-            tar.addfile(tarinfo = thisone, fileobj = ioob)
-        
-        omissions = []
-        with _tarfile.open(self.file_name, "w:gz", compresslevel = 3) as tar:
-            for att_name, att in self.__dict__.items():
-                if att_name in exclude:
-                    omissions += [att_name]
-                    self.logger.debug('Excluding from {}: "{}" ({})'.format(
-                            self.file_name, att_name, type(att)))
-                if isinstance(att, _array):
-                    saveArray(att, att_name, tar)
-                    self.logger.debug('Stored in {}: "{}" (array)'.format(
-                            self.file_name, att_name))
-                elif isinstance(att, dict) and \
-                        all([isinstance(v, _array) for v in att.values()]):
-                    # can save dicts of arrays efficiently as array.tobytes()
-                    # .tostring() in python2 which is what .tofile() does
-                    for array_name,array_data in att.items():
-                        member_name = '__{}__{}'.format(att_name,array_name)
-                        saveArray(array_data, member_name, tar)
-                        self.logger.debug('Stored in {}: "{}" (array) in {} '\
-                                '(dict) as {}'.format(self.file_name, 
-                                array_name, att_name, member_name))
-                else:
-                    # try saving everything else here by jsoning or pickling
-                    try:
-                        if PY3:
-                            ioob = _BytesIO()
-                        else:
-                            ioob = _StringIO()
-                        att_serialised = _serialiser.dumps(att)
-                        try:
-                            # json makes strings which need encoding to bytes
-                            ioob.write(att_serialised.encode('utf-8'))
-                        except AttributeError:
-                            # pickle makes bytes
-                            ioob.write(att_serialised)
-                        ioob.seek(0, _os.SEEK_END)
-                        length = ioob.tell()
-                        ioob.seek(0)
-                        thisone = _tarfile.TarInfo(name = att_name)
-                        thisone.size = length
-                        tar.addfile(tarinfo = thisone, fileobj = ioob)
-                        self.logger.debug('Stored in {}: "{}", {}'.format(
-                                self.file_name, att_name, type(att)))
-                    except TypeError:
-                        # could be warning but expect functions to fail here
-                        self.logger.debug('Not {}-able: "{}", {}'.format(
-                                serialiser, att_name, type(att)))
-                        # ignore non-jsonable things like functions
-                        # include unicodes, strings, lists etc etc
-                        omissions += [att_name]
-        return(omissions)
+        metadata = dict(self.__dict__)
+        # inherited attributes not yet used are saved too
+        for name,source in metadata.pop('_lazy_attributes', {}).items():
+            if name not in metadata:
+                metadata[name] = source[name]
+        if 'i' in metadata:
+            metadata['i'] = dict([(module, dict([(task, dict(inheritance)) for \
+                    task,inheritance in tasks.items()])) for module,tasks in \
+                    metadata['i'].items()])
+        return(writeBaga(metadata, self.file_name, exclude = exclude, 
+                serialiser = serialiser, logger = self.logger))
 
 
     def launch_external(self, cmd, 
@@ -972,7 +1319,10 @@ class MetaSample(Base):
         logger_for_external.addHandler(this_ext_file_handler)
         
         # log issuing command
-        command_str = 'Command: "{}"'.format(' '.join(cmd))
+        if shell and not isinstance(cmd, list):
+            command_str = 'Command: "{}"'.format(cmd)
+        else:
+            command_str = 'Command: "{}"'.format(' '.join(map(str, cmd)))
         if main_logger:
             main_logger.log(PROGRESS, command_str)
         logger_for_external.log(PROGRESS, command_str)
@@ -1022,13 +1372,13 @@ class MetaSample(Base):
         if proc.returncode == 0:
             logger_for_external.info(return_code)
             # some programs (e.g. LMAT) do not produce informative return codes
-            if not stdout_filename:
+            if not stdout_filename and main_logger:
                 if 'error' in stdout.decode('utf-8').lower():
                     main_logger.warning('Despite return code 0, '\
                             '"Error" string detected in STDOUT: check logs, '\
                             'including thoses generated directly by {}'\
                             ''.format(external_program_name))
-            if 'error' in stderr.decode('utf-8').lower():
+            if 'error' in stderr.decode('utf-8').lower() and main_logger:
                 main_logger.warning('Despite return code 0, '\
                         '"Error" string detected in STDERR: check logs, '\
                         'including thoses generated directly by {}'\
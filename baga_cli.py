@@ -475,6 +475,12 @@ parser_PrepareReads.add_argument('-t', "--trim",
     help = "trim read ends based on quality scores using Sickle",
     action = 'store_true')
 
+parser_PrepareReads.add_argument('-I', "--in_process", 
+    help = "with --adaptors and --trim, remove adaptors and trim by quality \
+score in a single pass within baga instead of using CutAdapt then Sickle. No \
+intermediate adaptor-cut fastq files are made",
+    action = 'store_true')
+
 parser_PrepareReads.add_argument('-D', "--delete_intermediates", 
     help = "delete intermediate fastq files to save space. Files are only deleted if those for next stage are found",
     action = 'store_true')
@@ -511,6 +517,19 @@ parser_AlignReads.add_argument('-d', "--deduplicate",
     help = "Remove duplicates using Picard",
     action = 'store_true')
 
+parser_AlignReads.add_argument('-s', "--streamed", 
+    help = "with --align, pipe BWA alignments directly into sorting and \
+duplicate marking (samtools markdup if available, else Picard) to make sorted, \
+deduplicated and indexed BAMs without intermediate SAM and BAM files. \
+--deduplicate is then not needed",
+    action = 'store_true')
+
+parser_AlignReads.add_argument('-T', "--threads_per_sample", 
+    help = "number of BWA threads per read pair with --align. Read pairs are \
+aligned concurrently within --max_cpus. Default divides --max_cpus between all \
+read pairs",
+    type = int)
+
 parser_AlignReads.add_argument('-r', "--indelrealign", 
     help = "realign read alignments near potential indels using GATK",
     action = 'store_true')
@@ -751,6 +770,12 @@ parser_Structure.add_argument('-m', "--max_memory",
     help = "maximum memory to use in gigabytes for each assembly. If not specified, total available at launch time will be used.",
     type = int)
 
+parser_Structure.add_argument('-N', "--max_cpus", 
+    help = "maximum number of cpu cores used when parallel processing e.g., "\
+    "collecting read depths from several BAMs with --check",
+    type = int,
+    default = -1)
+
 parser_Structure.add_argument('-l', "--min_align_region", 
     help = "when using --collect, set minimum region to align among those reported as potentially rearranged (by --check).",
     type = int,
@@ -1686,44 +1711,46 @@ if task_name == 'CollectData':
                 genome_identifiers = []
                 not_downloaded = []
                 c = 0
-                try:
-                    while c < total:
-                        c += 1
-                        task_logger.info('Fetching {} of {}'.format(c, total))
-                        res = genome.downloadNextAssembly(
-                                include_complete = include_complete, 
-                                include_scaffolds = include_scaffolds, 
-                                include_contigs = include_contigs, 
-                                refseq_only = args.refseq_only, 
-                                force = args.force, 
-                                retain_gbk = args.keep_gbk,
-                                path = '.') # args.analysis_path
-                        if genome.file_name:
-                            # False if not DLd
-                            genome_identifiers += [res]
-                            filenames += [genome.file_name]
-                            download_urls[genome.sample_name] = genome.source
-                            genome.saveLocal(exclude = ["assemblies_info", 
-                                    "assemblies_problems"])
-                            task_logger.info('saved genome to: {}'.format(
-                                    genome.file_name))
-                            task_logger.info('IMPORTANT: use "--genome_name {}" to '\
-                                    'use this genome for baga analyses'.format(
-                                    genome.sample_name))
-                            # no option to save to other folder yet
-                            # if args.analysis_path != '.':
-                                # new_path = os.path.sep.join([args.analysis_path,
-                                        # genome.file_name])
-                                # genome.logger.log(PROGRESS, 
-                                        # 'Moving to new path: {}'.format(new_path))
-                                # os.rename(genome.file_name, new_path)
-                        else:
-                            not_downloaded += [res]
-                except StopIteration:
-                    task_logger.info('Completed downloads for search term: {}. {} '\
-                            'downloaded, {} not downloaded'.format(search_term, 
-                            len(filenames), len(not_downloaded)))
-                    pass
+                # each download is parsed as it arrives so allow one per CPU
+                from baga import decide_max_processes
+                max_workers = decide_max_processes(args.max_cpus)
+                task_logger.info('Fetching {} with up to {} at once'.format(total, 
+                        max_workers))
+                for res in genome.downloadAssemblies(
+                            max_workers = max_workers, 
+                            include_complete = include_complete, 
+                            include_scaffolds = include_scaffolds, 
+                            include_contigs = include_contigs, 
+                            refseq_only = args.refseq_only, 
+                            force = args.force, 
+                            retain_gbk = args.keep_gbk,
+                            path = '.'): # args.analysis_path
+                    c += 1
+                    task_logger.info('Fetched {} of {}'.format(c, total))
+                    if genome.file_name:
+                        # False if not DLd
+                        genome_identifiers += [res]
+                        filenames += [genome.file_name]
+                        download_urls[genome.sample_name] = genome.source
+                        genome.saveLocal(exclude = ["assemblies_info", 
+                                "assemblies_problems"])
+                        task_logger.info('saved genome to: {}'.format(
+                                genome.file_name))
+                        task_logger.info('IMPORTANT: use "--genome_name {}" to '\
+                                'use this genome for baga analyses'.format(
+                                genome.sample_name))
+                        # no option to save to other folder yet
+                        # if args.analysis_path != '.':
+                            # new_path = os.path.sep.join([args.analysis_path,
+                                    # genome.file_name])
+                            # genome.logger.log(PROGRESS, 
+                                    # 'Moving to new path: {}'.format(new_path))
+                            # os.rename(genome.file_name, new_path)
+                    else:
+                        not_downloaded += [res]
+                task_logger.info('Completed downloads for search term: {}. {} '\
+                        'downloaded, {} not downloaded'.format(search_term, 
+                        len(filenames), len(not_downloaded)))
             
             if len(search_terms):
                 # save a record of downloaded genomes
@@ -1834,7 +1861,7 @@ if args.subparser == 'CollectData':
         read_accessions = [r.strip('"').strip("'") for r in use_reads]
         read_accessions.sort()
         reads = CollectData.Reads()
-        reads.getFromENA(read_accessions)
+        reads.getFromENA(read_accessions, max_cpus = args.max_cpus)
         # make a name from run accessions . . .
         if args.reads_group_name is None:
             use_reads_group_name = read_accessions[0]+'plus%sothers' % (len(read_accessions) - 1)
@@ -1871,7 +1898,7 @@ if args.subparser == 'CollectData':
         
         from baga import CollectData
         reads = CollectData.Reads()
-        reads.getFromPath(use_reads_path)
+        reads.getFromPath(use_reads_path, max_cpus = args.max_cpus)
         reads.saveLocal(use_reads_group_name)
 
 ### Prepare Reads ###
@@ -1894,7 +1921,8 @@ if args.subparser == 'PrepareReads':
             reads = PrepareReads.Reads(downloaded_reads)
             read_cov_depth, genome_size = args.subsample_to_cov
             print('Subsampling reads group {} to {}x coverage for a {:,} bp genome'.format(use_name_reads, read_cov_depth, genome_size))
-            reads.subsample(genome_size, read_cov_depth, force = args.force)
+            reads.subsample(genome_size, read_cov_depth, force = args.force, 
+                    max_cpus = args.max_cpus)
             reads.saveLocal(use_name_reads)
         
         if args.adaptors is not None:
@@ -1910,14 +1938,18 @@ if args.subparser == 'PrepareReads':
                     print('Loading subsampled reads group %s' % use_name_reads)
                     reads = baga.bagaload('baga.PrepareReads.Reads-%s' % use_name_reads)
             
-            try:
-                reads.cutAdaptors(force = args.force, max_cpus = args.max_cpus)
-            except OSError:
-                exe_fail('cutadapt')
+            if args.in_process and args.trim:
+                print('\nRemoving adaptors and trimming reads . . .')
+                reads.cutAndTrim(force = args.force, max_cpus = args.max_cpus)
+            else:
+                try:
+                    reads.cutAdaptors(force = args.force, max_cpus = args.max_cpus)
+                except OSError:
+                    exe_fail('cutadapt')
             
             reads.saveLocal(use_name_reads)
         
-        if args.trim:
+        if args.trim and not (args.in_process and args.adaptors is not None):
             # could check whether adaptor cut read files exist
             # need to test parallelism with lots of stdout reports
             if not args.adaptors:
@@ -2045,21 +2077,31 @@ if using:
                     log_folder = task_log_folder)  # use inherit from here?, inherit_from = upstreams)
             print('\nAligning reads . . .')
             # let BWA estimate insert size and assign proper_pairs
-            try:
-                alignments.align(max_cpus = args.max_cpus, force = args.force)
-            except OSError:
-                exe_fail('bwa')
-            
-            try:
-                alignments.toBAMs(force = args.force, max_cpus = args.max_cpus)
-            except OSError:
-                exe_fail('samtools')
+            if args.streamed:
+                try:
+                    alignments.alignStreamed(max_cpus = args.max_cpus, 
+                            threads_per_sample = args.threads_per_sample, 
+                            force = args.force)
+                except OSError:
+                    exe_fail('bwa')
+            else:
+                try:
+                    alignments.align(max_cpus = args.max_cpus, 
+                            threads_per_sample = args.threads_per_sample, 
+                            force = args.force)
+                except OSError:
+                    exe_fail('bwa')
+                
+                try:
+                    alignments.toBAMs(force = args.force, max_cpus = args.max_cpus)
+                except OSError:
+                    exe_fail('samtools')
             
             # need to include the genome name for aligning a group of reads sets to more than one genome
             alignments.saveLocal()
         
         
-        if args.deduplicate:
+        if args.deduplicate and not (args.align and args.streamed):
             if not args.align:
                 # add an exception here and inform to use --align first
                 print('Loading previously processed read alignments: %s' % alns_name)
@@ -2229,7 +2271,8 @@ if task_name == 'Repeats':
             finder.findRepeats(
                     minimum_percent_identity = args.minimum_percent_identity * 0.01, 
                     minimum_repeat_length = args.minimum_repeat_length,
-                    max_extensions = 25)
+                    max_extensions = 25,
+                    max_cpus = args.max_cpus)
             # save to file
             finder.saveLocal(serialiser = 'pickle')
             # also save just the ranges for filtering <== check if this is still used by FilterVariants etc
@@ -2391,6 +2434,7 @@ if task_name == 'Structure':
                     smoothed_resolution = 10, 
                     ratio_threshold = args.ratio_threshold, 
                     genome_name = use_name_genome, force = args.force, 
+                    max_cpus = args.max_cpus, 
                     task_name = task_name, 
                     console_verbosity_lvl = verbosities[args.verbosity], 
                     log_folder = task_log_folder
@@ -2962,7 +3006,9 @@ if args.subparser == 'FilterVariants':
     for VCF in VCFs:
         try:
             with open(VCF, 'r') as filein:
-                header, header_section_order, colnames, variants = CallVariants.parseVCF(VCF)
+                # only the header is parsed here: variants are streamed later
+                vcf = CallVariants.VCFReader(VCF)
+                header, colnames = vcf.header, vcf.colnames
                 contigs = {}
                 for contiginfo in header['contig']:
                     bits = contiginfo.split('<')[-1].split('>')[0].split(',')
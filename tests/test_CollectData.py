@@ -0,0 +1,119 @@
+#! /usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Bacterial and Archaeal Genome Analyser
+# Copyright (C) 2015-2016 David Williams
+# david.williams.at.liv.d-dub.org.uk
+# License GPLv3+: GNU GPL version 3 or later
+# This is free software: you are free to change and redistribute it
+# There is NO WARRANTY, to the extent permitted by law
+#
+'''
+Tests for the CollectData module from the Bacterial and Archaeal Genome
+Analyzer (BAGA).
+
+Run with: python -m unittest discover tests
+'''
+
+import gzip
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from baga import CollectData
+
+GBK = '''LOCUS       TEST_1                    60 bp    DNA     circular BCT 01-JAN-2016
+DEFINITION  Test organism chromosome, complete genome.
+VERSION     TEST_1.1
+FEATURES             Location/Qualifiers
+     CDS             1..30
+                     /locus_tag="T0001"
+                     /gene="abcD"
+     CDS             complement(31..60)
+                     /locus_tag="T0002"
+ORIGIN
+        1 atgaaacccg ggtttaaacc cgggtttaaa cccgggttta aacccgggtt taaacccggg
+//
+'''
+
+def _gzipped(text, members = 1):
+    '''text as one or more concatenated gzip members'''
+    data = text.encode('ascii')
+    chunk = -(-len(data) // members)
+    out = io.BytesIO()
+    for i in range(0, len(data), chunk):
+        member = io.BytesIO()
+        with gzip.GzipFile(fileobj = member, mode = 'wb') as fout:
+            fout.write(data[i:i + chunk])
+        out.write(member.getvalue())
+    return(out.getvalue())
+
+class _Handler(BaseHTTPRequestHandler):
+    files = {}
+    def do_GET(self):
+        data = self.files[self.path]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class StreamGBKTest(unittest.TestCase):
+    '''Genome._streamGBK() on a gzipped GenBank file from an HTTP server'''
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        thread = threading.Thread(target = self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url_base = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.tmp = tempfile.mkdtemp()
+        self.genome = CollectData.Genome.__new__(CollectData.Genome)
+        self.genome.logger = logging.getLogger(__name__)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def _serve(self, path, data):
+        _Handler.files[path] = data
+        return(self.url_base + path)
+
+    def test_stream(self):
+        for members in (1, 3):
+            data = _gzipped(GBK, members)
+            url = self._serve('/{}_genomic.gbff.gz'.format(members), data)
+            gbk_filename = os.path.join(self.tmp, 'out.gbff')
+            sequence, annotations, names = self.genome._streamGBK(url,
+                    hashlib.md5(data).hexdigest(),
+                    gbk_filename = gbk_filename)
+            self.assertEqual(list(sequence), ['TEST_1.1'])
+            self.assertEqual(len(sequence['TEST_1.1']), 60)
+            ORF_ranges = annotations['TEST_1.1'][0]
+            self.assertEqual(ORF_ranges['T0001'], (0, 30, 1, 'abcD'))
+            self.assertEqual(ORF_ranges['T0002'], (30, 60, -1, ''))
+            self.assertEqual(names['TEST_1.1'],
+                    'Test organism chromosome, complete genome')
+            with open(gbk_filename) as fin:
+                self.assertEqual(fin.read(), GBK)
+
+    def test_checksum_fail(self):
+        url = self._serve('/bad_genomic.gbff.gz', _gzipped(GBK))
+        gbk_filename = os.path.join(self.tmp, 'bad.gbff')
+        self.assertRaises(ValueError, self.genome._streamGBK, url, '0' * 32,
+                gbk_filename = gbk_filename)
+        self.assertFalse(os.path.exists(gbk_filename))
+
+if __name__ == '__main__':
+    unittest.main()
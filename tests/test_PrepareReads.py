@@ -0,0 +1,107 @@
+#! /usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Bacterial and Archaeal Genome Analyser
+# Copyright (C) 2015-2016 David Williams
+# david.williams.at.liv.d-dub.org.uk
+# License GPLv3+: GNU GPL version 3 or later
+# This is free software: you are free to change and redistribute it
+# There is NO WARRANTY, to the extent permitted by law
+#
+'''
+Tests for the PrepareReads module from the Bacterial and Archaeal Genome
+Analyzer (BAGA).
+
+Run with: python -m unittest discover tests
+'''
+
+import random
+import unittest
+
+from baga import PrepareReads
+
+def sickle_sliding_window(qual, length_threshold, qual_threshold):
+    '''
+    Transliteration of sliding_window() in sickle's sliding_window.c at the
+    commit in Dependencies.py (sanger qualities, no --no-5prime or
+    --trunc-n)
+
+    returns (five_prime_cut, three_prime_cut), both -1 if discarded
+    '''
+    length = len(qual)
+    window_size = int(0.1 * length)
+    window_start = 0
+    window_total = 0
+    three_prime_cut = length
+    five_prime_cut = 0
+    found_five_prime = 0
+
+    if length < length_threshold:
+        return(-1, -1)
+
+    if window_size == 0:
+        window_size = length
+
+    q = [ord(c) - 33 for c in qual]
+    for i in range(window_size):
+        window_total += q[i]
+
+    for i in range(length - window_size + 1):
+        window_avg = float(window_total) / float(window_size)
+
+        if found_five_prime == 0 and window_avg >= qual_threshold:
+            for j in range(window_start, window_start + window_size):
+                if q[j] >= qual_threshold:
+                    five_prime_cut = j
+                    break
+            found_five_prime = 1
+
+        if window_avg < qual_threshold or \
+                window_start + window_size > length:
+            for j in range(window_start, window_start + window_size):
+                if q[j] < qual_threshold:
+                    three_prime_cut = j
+                    break
+            break
+
+        window_total -= q[window_start]
+        if window_start + window_size < length:
+            window_total += q[window_start + window_size]
+        window_start += 1
+
+    if found_five_prime == 0 or \
+            three_prime_cut - five_prime_cut < length_threshold:
+        three_prime_cut = -1
+        five_prime_cut = -1
+
+    return(five_prime_cut, three_prime_cut)
+
+class QualityTrimsTest(unittest.TestCase):
+    '''quality_trims() against sickle -q 25 -l 50'''
+    def test_against_sickle(self):
+        rng = random.Random(15)
+        quals = []
+        for n in range(3000):
+            length = rng.choice((36, 75, 100, 101, 150, 151))
+            # runs of good and bad bases so windows cross the threshold
+            qual = []
+            while len(qual) < length:
+                mean = rng.choice((10, 22, 27, 35))
+                qual += [min(41, max(2, int(rng.gauss(mean, 6)))) for i in \
+                        range(rng.randint(1, 40))]
+            quals += [''.join([chr(q + 33) for q in qual[:length]])]
+        # also trim some to shorter lengths e.g., after adaptor removal
+        lengths = [len(q) if n % 3 else rng.randint(0, len(q)) for n,q in \
+                enumerate(quals)]
+        starts, ends, keep = PrepareReads.quality_trims(
+                [q.encode('ascii') for q in quals], lengths, 25, 50)
+        for n,(qual,length) in enumerate(zip(quals, lengths)):
+            five, three = sickle_sliding_window(qual[:length], 50, 25)
+            if five == -1:
+                self.assertFalse(keep[n], (n, qual[:length]))
+            else:
+                self.assertTrue(keep[n], (n, qual[:length]))
+                self.assertEqual((starts[n], ends[n]), (five, three))
+
+if __name__ == '__main__':
+    unittest.main()